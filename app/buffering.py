@@ -0,0 +1,119 @@
+"""
+Write-behind buffering for recommendation micro service.
+
+Likes on popular recommendations arrive much faster than they need to be
+written. A LikeBuffer adds them up in memory and writes the totals to the
+storage engine in one batch, either every few seconds or as soon as enough
+likes are waiting.
+
+"""
+
+import atexit
+import logging
+import threading
+
+
+class LikeBuffer(object):
+    """
+    Aggregates likes in memory and flushes them to a storage engine
+
+    Args:
+        engine (StorageEngine): the engine the likes are flushed to
+        interval (float): the number of seconds between flushes
+        threshold (int): the number of waiting likes that triggers a flush
+        lock (threading.Lock): the lock that guards the pending likes
+        on_flush (function): called with the ids whose likes were written
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, engine, interval=1.0, threshold=1000, lock=None, on_flush=None):
+        self.engine = engine
+        self.on_flush = on_flush
+        self.interval = interval
+        self.threshold = threshold
+        self.lock = lock or threading.Lock()
+        self.pending = {}
+        # The stored records of the ids liked since the last flush, so that
+        # further likes of them don't read the data store again
+        self.records = {}
+        self.count = 0
+        # Only ever grows, so it tells if any likes were added since it was read
+        self.changes = 0
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    def add(self, id, amount=1, record=None):
+        """ Buffers likes for a recommendation and keeps its stored record """
+        with self.lock:
+            if record is not None:
+                self.records.setdefault(id, record)
+            self.pending[id] = self.pending.get(id, 0) + amount
+            self.count += amount
+            self.changes += 1
+            full = self.count >= self.threshold
+        if full:
+            self.flush()
+
+    def pending_likes(self, id):
+        """ Returns the likes that are waiting to be written for a recommendation """
+        return self.pending.get(id, 0)
+
+    def record(self, id):
+        """ Returns the stored record of a recommendation liked since the last flush or None """
+        return self.records.get(id)
+
+    def discard(self, id):
+        """ Forgets the waiting likes of a recommendation that was overwritten """
+        with self.lock:
+            self.records.pop(id, None)
+            self.count -= self.pending.pop(id, 0)
+
+    def clear(self):
+        """ Forgets all of the waiting likes """
+        with self.lock:
+            self.pending = {}
+            self.records = {}
+            self.count = 0
+
+    def flush(self):
+        """ Writes the waiting likes to the storage engine in one batch """
+        with self.lock:
+            batch, self.pending = self.pending, {}
+            self.records = {}
+            self.count = 0
+        if not batch:
+            return
+        try:
+            self.engine.incr_likes_many(batch)
+        except Exception:
+            self.logger.exception('Could not flush likes, keeping them for the next flush')
+            with self.lock:
+                for id, amount in batch.items():
+                    self.pending[id] = self.pending.get(id, 0) + amount
+                    self.count += amount
+            raise
+        if self.on_flush:
+            self.on_flush(list(batch))
+        self.logger.debug('Flushed likes for %d recommendations', len(batch))
+
+    def start(self):
+        """ Starts flushing on the interval and when the process exits """
+        self.__thread = threading.Thread(target=self.__run, name='like-buffer')
+        self.__thread.daemon = True
+        self.__thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """ Stops the flushing thread and writes everything that is waiting """
+        self.__stopped.set()
+        if self.__thread and self.__thread is not threading.current_thread():
+            self.__thread.join()
+        self.flush()
+
+    def __run(self):
+        """ Flushes the waiting likes until the buffer is stopped """
+        while not self.__stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                pass
@@ -0,0 +1,147 @@
+"""
+Read-through cache for recommendation micro service.
+
+A RecordCache keeps recently read records and query results in the memory
+of one worker, so hot products are answered without a round trip to the
+data store. The cache holds a bounded number of entries, evicts the least
+recently used one when it is full and expires entries after a time to live.
+
+Every entry remembers the ids of the records in it and can be tagged with
+the (attribute, value) pairs of the query that produced it. A write drops
+the entries that hold one of its ids, which covers the values a record had
+before, and the entries tagged with its new values, which covers the
+queries it now belongs to. Invalidations are published on CHANNEL so the
+other workers drop their stale entries too.
+
+An entry can also keep the version token of the data store that was read
+before it was fetched. A lookup that gives a different token misses, so a
+response whose ETag comes from the current version never gets an older
+body from an entry whose invalidation hasn't arrived yet.
+
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+# Channel that the invalidations are published on
+CHANNEL = 'cache:invalidate'
+
+
+class RecordCache(object):
+    """
+    LRU cache of stored records with a time to live
+
+    Args:
+        max_size (int): the number of entries to keep at most
+        ttl (float): the number of seconds an entry is kept
+    """
+
+    def __init__(self, max_size=10000, ttl=30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.tagged = {}
+        self.containing = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version=None):
+        """ Returns the cached value of a key or None
+
+        Args:
+            key (tuple): the key of the value
+            version (str): the version token the value has to have been
+                           cached at, None for any
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value, ids, tags, cached_version = entry
+            if expires < time.time() or (version is not None and version != cached_version):
+                self.__forget(key, entry)
+                self.misses += 1
+                return None
+            # Move the entry to the most recently used end
+            self.entries[key] = entry
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ids, tags=(), generation=None, version=None):
+        """
+        Caches the value of a key
+
+        Args:
+            key (tuple): the key of the value
+            value: the record or the list of records to cache
+            ids (list): the ids of the records in the value
+            tags (list): the (attribute, value) pairs of the query
+            generation (int): the generation read before the value was
+                              fetched, the value is dropped if anything
+                              was invalidated since then
+            version (str): the version token read before the value was fetched
+        """
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.__forget(key, old)
+            ids = frozenset(ids)
+            tags = frozenset(tags)
+            self.entries[key] = (time.time() + self.ttl, value, ids, tags, version)
+            for id in ids:
+                self.containing.setdefault(id, set()).add(key)
+            for tag in tags:
+                self.tagged.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_size:
+                oldest, entry = self.entries.popitem(last=False)
+                self.__forget(oldest, entry)
+                self.evictions += 1
+
+    def invalidate(self, ids=(), tags=()):
+        """ Drops the entries that hold one of the ids or have one of the tags """
+        with self.lock:
+            self.generation += 1
+            keys = set()
+            for id in ids:
+                keys.update(self.containing.get(id, ()))
+            for tag in tags:
+                keys.update(self.tagged.get(tag, ()))
+            for key in keys:
+                self.__forget(key, self.entries.pop(key))
+
+    def clear(self):
+        """ Drops all of the entries """
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.tagged.clear()
+            self.containing.clear()
+
+    def stats(self):
+        """ Returns the hit, miss and eviction counters and the size """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self.entries),
+                    'max_size': self.max_size,
+                    'hit_ratio': float(self.hits) / lookups if lookups else 0.0}
+
+    def __forget(self, key, entry):
+        """ Removes a key that was taken out of the entries from the lookups """
+        expires, value, ids, tags, version = entry
+        for lookup, names in ((self.containing, ids), (self.tagged, tags)):
+            for name in names:
+                keys = lookup.get(name)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del lookup[name]
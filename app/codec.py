@@ -0,0 +1,143 @@
+"""
+Record codec for recommendation micro service.
+
+Records are stored as a fixed-width packed header followed by an optional
+recommendation type text. The known recommendation types are stored as a
+one byte code, so most records take 34 bytes instead of the 140 bytes of a
+pickled dictionary.
+
+Format version 1
+----------------
+byte  0      - format version (1)
+bytes 1-8    - id
+bytes 9-16   - product_id
+bytes 17-24  - recommended_product_id
+bytes 25-32  - likes
+byte  33     - recommendation_type code (0 when the type is stored as text)
+bytes 34-    - recommendation_type as UTF-8 text (only when the code is 0)
+
+All of the integers are signed 64 bit little endian. Records that were
+saved as pickled dictionaries before the codec existed are still decoded.
+
+JSON format
+-----------
+Records can also be stored as their canonical JSON text, which is the JSON
+of the fields with the keys sorted and no whitespace:
+
+{"id":1,"likes":0,"product_id":2,"recommendation_type":"accessory",...}
+
+It takes about three times the space of the packed format, but a stored
+record can be sent as the body of a response without decoding it. The
+formats are told apart by their first byte, so records of both can be
+stored side by side.
+
+"""
+
+import json
+import pickle
+import struct
+
+VERSION = 1
+HEADER = struct.Struct('<BqqqqB')
+
+# Offsets of the fields that are read and updated without decoding
+PRODUCT_ID_OFFSET = 9
+LIKES_OFFSET = 25
+
+# Recommendation types stored as a one byte code, code 0 is free text
+TYPES = (None, 'up-sell', 'cross-sell', 'accessory')
+TYPE_CODES = dict((name, code) for code, name in enumerate(TYPES) if name)
+
+# Formats that records can be stored in
+FORMATS = ('packed', 'json')
+
+# Fields of a record, the canonical JSON has them in this order
+FIELDS = ('id', 'likes', 'product_id', 'recommendation_type', 'recommended_product_id')
+
+# Prefix of the canonical JSON text, which the id follows
+JSON_PREFIX = '{"id":'
+
+JSON_ENCODER = json.JSONEncoder(sort_keys=True, separators=(',', ':'))
+
+# Canonical JSON of a packed record, filled in without building a dictionary
+JSON_TEMPLATE = ('{"id":%d,"likes":%d,"product_id":%d,'
+                 '"recommendation_type":%s,"recommended_product_id":%d}')
+TYPE_JSON = [name and JSON_ENCODER.encode(name) for name in TYPES]
+
+
+def encode(data, format='packed'):
+    """
+    Encodes a record into its packed representation or its canonical JSON
+
+    Args:
+        data (dict): A record with the fields of Recommendation.serialize()
+        format (str): one of FORMATS
+    """
+    if format == 'json':
+        return to_json(data)
+    recommendation_type = data['recommendation_type']
+    code = TYPE_CODES.get(recommendation_type, 0)
+    try:
+        header = HEADER.pack(VERSION, data['id'], data['product_id'],
+                             data['recommended_product_id'], data['likes'], code)
+    except struct.error as error:
+        raise ValueError('Recommendation can not be encoded: %s' % error)
+    if code:
+        return header
+    return header + recommendation_type.encode('utf-8')
+
+
+def decode(value):
+    """
+    Decodes a stored record into a dictionary
+
+    Args:
+        value (str): A packed record, canonical JSON or a pickled dictionary
+    """
+    if value[:1] == '{':
+        return json.loads(value)
+    if value[:1] != chr(VERSION):
+        return pickle.loads(value)
+    version, id, product_id, recommended_product_id, likes, code = \
+        HEADER.unpack_from(value)
+    if code:
+        recommendation_type = TYPES[code]
+    else:
+        recommendation_type = value[HEADER.size:].decode('utf-8')
+    return {"id": id,
+            "product_id": product_id,
+            "recommended_product_id": recommended_product_id,
+            "recommendation_type": recommendation_type,
+            "likes": likes}
+
+
+def to_json(data):
+    """ Returns the canonical JSON text of a record """
+    return JSON_ENCODER.encode(dict((name, data[name]) for name in FIELDS))
+
+
+def as_json(value):
+    """
+    Returns the canonical JSON text of a stored record
+
+    Records that are stored as JSON are returned as they are.
+
+    Args:
+        value (str): A stored record in any format
+    """
+    if value[:1] == '{':
+        return value
+    if value[:1] != chr(VERSION):
+        return to_json(decode(value))
+    version, id, product_id, recommended_product_id, likes, code = \
+        HEADER.unpack_from(value)
+    if code:
+        recommendation_type = TYPE_JSON[code]
+    else:
+        recommendation_type = JSON_ENCODER.encode(value[HEADER.size:].decode('utf-8'))
+    return JSON_TEMPLATE % (id, likes, product_id, recommendation_type, recommended_product_id)
+
+
+def json_id(text):
+    """ Reads the id of a record from its canonical JSON text """
+    return int(text[len(JSON_PREFIX):text.index(',')])
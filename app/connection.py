@@ -0,0 +1,228 @@
+"""
+Redis connections for recommendation micro service.
+
+Builds the Redis client of the model with a bounded connection pool,
+socket timeouts, periodic health checks and a retry policy, and reports
+the statistics of its pool.
+
+Options
+-------
+max_connections (int) - the most connections the pool opens
+blocking (bool) - wait for a free connection instead of failing when the
+                  pool is exhausted
+pool_timeout (float) - the seconds a blocking pool waits for a connection
+connect_timeout (float) - the seconds to wait for a connection to open
+socket_timeout (float) - the seconds to wait for a reply
+health_check_interval (int) - ping connections idle for this many seconds
+                              before they are used again, 0 to never
+retries (int) - the number of times a failed read is retried
+retry_backoff (float) - the seconds to wait before the first retry, which
+                        doubles on every retry
+retry_max_backoff (float) - the most seconds to wait between retries
+
+Observers
+---------
+Functions added to the observers of a client are called after every round
+trip to Redis with the command, the arguments of the commands it sent, the
+reply (None when it failed), the seconds it took and whether it failed. A
+pipeline or a transaction is one round trip with the command PIPELINE or
+MULTI and the list of the replies of its commands.
+
+"""
+
+import time
+import logging
+import threading
+
+from redis import Redis, ConnectionPool, BlockingConnectionPool
+from redis.client import Pipeline
+from redis.exceptions import ConnectionError, TimeoutError
+
+DEFAULTS = {
+    'max_connections': 50,
+    'blocking': False,
+    'pool_timeout': 5.0,
+    'connect_timeout': 2.0,
+    'socket_timeout': 5.0,
+    'health_check_interval': 30,
+    'retries': 3,
+    'retry_backoff': 0.05,
+    'retry_max_backoff': 1.0,
+}
+
+# Commands that leave the data the same when they run twice, so they can be
+# retried after a failure that may have happened after Redis ran them.
+# INCR, INCRBY and the likes script (EVALSHA) are not among them.
+IDEMPOTENT_COMMANDS = frozenset([
+    'PING', 'GET', 'MGET', 'EXISTS', 'SCAN', 'ZCARD', 'ZSCORE', 'ZRANGE',
+    'ZREVRANGE', 'ZRANGEBYSCORE', 'ZREVRANGEBYSCORE', 'SET', 'DEL', 'ZADD',
+    'ZREM', 'SCRIPT LOAD',
+])
+
+
+def observe(observers, command, commands, call, *args, **kwargs):
+    """ Calls a function and tells the observers how long its round trip took """
+    started = time.time()
+    result = None
+    failed = True
+    try:
+        result = call(*args, **kwargs)
+        failed = False
+        return result
+    finally:
+        seconds = time.time() - started
+        for observer in observers:
+            observer(command, commands, result, seconds, failed)
+
+
+class ObservedPipeline(Pipeline):
+    """ Pipeline that tells the observers of its client about its round trips """
+
+    def __init__(self, observers, *args, **kwargs):
+        super(ObservedPipeline, self).__init__(*args, **kwargs)
+        self.observers = observers
+
+    def immediate_execute_command(self, *args, **options):
+        # Commands run right away while the pipeline is watching keys
+        call = super(ObservedPipeline, self).immediate_execute_command
+        if not self.observers:
+            return call(*args, **options)
+        return observe(self.observers, args[0], (args,), call, *args, **options)
+
+    def execute(self, raise_on_error=True):
+        call = super(ObservedPipeline, self).execute
+        if not self.observers or not self.command_stack:
+            return call(raise_on_error)
+        command = 'MULTI' if self.transaction or self.explicit_transaction else 'PIPELINE'
+        return observe(self.observers, command, [args for args, options in self.command_stack],
+                       call, raise_on_error)
+
+
+class RetryingRedis(Redis):
+    """
+    Redis client that retries idempotent commands with exponential backoff
+
+    Pipelines and transactions keep the reconnect once behavior of redis-py,
+    since a transaction has to be retried as a whole by its caller.
+
+    Args:
+        retries (int): the number of times a failed command is retried
+        backoff (float): the seconds to wait before the first retry
+        max_backoff (float): the most seconds to wait between retries
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, retries=3, backoff=0.05, max_backoff=1.0, **kwargs):
+        super(RetryingRedis, self).__init__(**kwargs)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retried = 0
+        self.failed = 0
+        self.observers = []
+        self.__lock = threading.Lock()
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return ObservedPipeline(self.observers, self.connection_pool, self.response_callbacks,
+                                transaction, shard_hint)
+
+    def execute_command(self, *args, **options):
+        if not self.observers:
+            return self.__execute(*args, **options)
+        # Retries are part of the round trip of the command
+        return observe(self.observers, args[0], (args,), self.__execute, *args, **options)
+
+    def __execute(self, *args, **options):
+        retries = self.retries if args[0] in IDEMPOTENT_COMMANDS else 0
+        attempt = 0
+        while True:
+            try:
+                return super(RetryingRedis, self).execute_command(*args, **options)
+            except (ConnectionError, TimeoutError) as error:
+                if attempt >= retries:
+                    with self.__lock:
+                        self.failed += 1
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                attempt += 1
+                with self.__lock:
+                    self.retried += 1
+                self.logger.warning('Retrying %s in %.2fs after: %s', args[0], delay, error)
+                time.sleep(delay)
+
+
+def parse_bool(value):
+    """ Reads a bool option that may be given as text, such as "false" in JSON credentials """
+    if isinstance(value, basestring):
+        text = value.strip().lower()
+        if text in ('true', 'yes', 'on', '1'):
+            return True
+        if text in ('false', 'no', 'off', '0', ''):
+            return False
+        raise ValueError('Invalid boolean: %r' % value)
+    return bool(value)
+
+
+def coerce_options(options):
+    """
+    Converts options to the types of their DEFAULTS
+
+    Options read from the credentials of VCAP_SERVICES are often strings,
+    so every option is converted the way its default is typed.
+    """
+    settings = dict(DEFAULTS)
+    for name, value in (options or {}).items():
+        default = DEFAULTS.get(name)
+        if isinstance(default, bool):
+            value = parse_bool(value)
+        elif isinstance(default, (int, float)):
+            value = type(default)(value)
+        settings[name] = value
+    return settings
+
+
+def connect(host, port, password=None, options=None):
+    """
+    Creates a Redis client with a configured connection pool
+
+    Args:
+        host (str): the Redis host name
+        port (int): the Redis port
+        password (str): the Redis password or None
+        options (dict): overrides of DEFAULTS
+    """
+    settings = coerce_options(options)
+    pool_args = dict(host=host, port=int(port), password=password,
+                     max_connections=settings['max_connections'],
+                     socket_connect_timeout=settings['connect_timeout'],
+                     socket_timeout=settings['socket_timeout'],
+                     health_check_interval=settings['health_check_interval'])
+    if settings['blocking']:
+        pool = BlockingConnectionPool(timeout=settings['pool_timeout'], **pool_args)
+    else:
+        pool = ConnectionPool(**pool_args)
+    return RetryingRedis(retries=settings['retries'],
+                         backoff=settings['retry_backoff'],
+                         max_backoff=settings['retry_max_backoff'],
+                         connection_pool=pool)
+
+
+def pool_stats(redis):
+    """ Returns the connection counts of the pool of a Redis client """
+    pool = redis.connection_pool
+    # redis-py has no public counters, so they are read from the pool itself
+    if isinstance(pool, BlockingConnectionPool):
+        created = len(pool._connections)
+        idle = len([connection for connection in pool.pool.queue if connection is not None])
+    else:
+        created = pool._created_connections
+        idle = len(pool._available_connections)
+    stats = {'blocking': isinstance(pool, BlockingConnectionPool),
+             'max_connections': pool.max_connections,
+             'created': created,
+             'idle': idle,
+             'in_use': created - idle}
+    if isinstance(redis, RetryingRedis):
+        stats['retried'] = redis.retried
+        stats['failed'] = redis.failed
+    return stats
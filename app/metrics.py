@@ -0,0 +1,248 @@
+"""
+Metrics of the recommendation micro service.
+
+Keeps counters, gauges and histograms in the memory of the worker and
+renders them in the Prometheus text format for GET /metrics. Every update
+takes one short lock of its metric, so the metrics are cheap enough to
+stay on in production.
+
+Metrics
+-------
+http_requests_total - requests by method, route and status
+http_request_duration_seconds - request latency by method and route
+http_requests_in_flight - requests being served by method and route
+http_response_size_bytes - response body sizes by method and route
+redis_commands_total - Redis commands sent, by command
+redis_round_trip_seconds - latency of Redis round trips, by command, with
+                           pipelines and transactions as PIPELINE and MULTI
+redis_round_trip_errors_total - Redis round trips that failed, by command
+query_rows_scanned_total - index entries read from the data store, by query
+query_rows_returned_total - recommendations returned, by query
+
+"""
+
+import bisect
+import threading
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REDIS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def escape_label(value):
+    """ Escapes a label value of the text format """
+    return unicode(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_value(value):
+    """ Formats a sample value of the text format """
+    if isinstance(value, (int, long)):
+        return str(value)
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    """
+    Values of a metric, one per combination of label values
+
+    Args:
+        name (str): the name of the metric
+        documentation (str): the help text of the metric
+        labels (tuple): the names of its labels
+    """
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def samples(self):
+        """ Returns the (name, labels, value) samples of the metric """
+        with self.lock:
+            values = sorted(self.values.items())
+        return [(self.name, zip(self.labels, key), value) for key, value in values]
+
+    def get(self, labels=()):
+        """ Returns the value of a combination of label values """
+        with self.lock:
+            return self.values.get(tuple(labels), 0)
+
+
+class Counter(Metric):
+    """ A count that only goes up """
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        """ Adds an amount to the count of the label values """
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Counter):
+    """ A value that goes up and down """
+    type = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        """ Subtracts an amount from the value of the label values """
+        self.inc(labels, -amount)
+
+    def set(self, value, labels=()):
+        """ Sets the value of the label values """
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    """ Counts observations in buckets and keeps their sum """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        """ Counts an observation of the label values """
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def get(self, labels=()):
+        """ Returns the number of observations of a combination of label values """
+        with self.lock:
+            entry = self.values.get(tuple(labels))
+            return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self.lock:
+            values = sorted((key, (list(entry[0]), entry[1])) for key, entry in self.values.items())
+        samples = []
+        for key, (counts, total) in values:
+            labels = zip(self.labels, key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', labels + [('le', format_value(float(bound)))],
+                                cumulative))
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, cumulative))
+        return samples
+
+
+class Registry(object):
+    """ The metrics of a worker and the collectors that read more of them when scraped """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, documentation, labels=()):
+        """ Creates and registers a Counter """
+        return self.add(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        """ Creates and registers a Gauge """
+        return self.add(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        """ Creates and registers a Histogram """
+        return self.add(Histogram(name, documentation, labels, buckets))
+
+    def add(self, metric):
+        """ Registers a metric and returns it """
+        self.metrics.append(metric)
+        return metric
+
+    def register(self, collector):
+        """ Registers a function that returns a list of metrics when scraped """
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def render(self):
+        """ Returns all of the metrics in the Prometheus text format """
+        metrics = list(self.metrics)
+        for collector in self.collectors:
+            metrics.extend(collector())
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation.replace('\\', r'\\')
+                                           .replace('\n', r'\n')))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                if labels:
+                    name += '{%s}' % ','.join('%s="%s"' % (label, escape_label(text))
+                                              for label, text in labels)
+                lines.append('%s %s' % (name, format_value(value)))
+        return (u'\n'.join(lines) + u'\n').encode('utf-8')
+
+
+######################################################################
+# METRICS OF THE SERVICE
+######################################################################
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'http_requests_total', 'Requests served', ('method', 'route', 'status'))
+HTTP_LATENCY = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Seconds to serve a request', ('method', 'route'))
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    'http_requests_in_flight', 'Requests being served', ('method', 'route'))
+HTTP_RESPONSE_SIZE = REGISTRY.histogram(
+    'http_response_size_bytes', 'Bytes in the body of a response', ('method', 'route'),
+    SIZE_BUCKETS)
+
+REDIS_COMMANDS = REGISTRY.counter(
+    'redis_commands_total', 'Redis commands sent', ('command',))
+REDIS_LATENCY = REGISTRY.histogram(
+    'redis_round_trip_seconds', 'Seconds of a Redis round trip, pipelines count as PIPELINE '
+    'and transactions as MULTI', ('command',), REDIS_BUCKETS)
+REDIS_ERRORS = REGISTRY.counter(
+    'redis_round_trip_errors_total', 'Redis round trips that failed', ('command',))
+
+ROWS_SCANNED = REGISTRY.counter(
+    'query_rows_scanned_total', 'Index entries read from the data store by queries', ('query',))
+ROWS_RETURNED = REGISTRY.counter(
+    'query_rows_returned_total', 'Recommendations returned by queries', ('query',))
+
+
+def observe_redis(command, commands, reply, seconds, failed):
+    """ Counts the commands of a Redis round trip and records its latency """
+    if len(commands) == 1:
+        REDIS_COMMANDS.inc((commands[0][0],))
+    else:
+        counts = {}
+        for args in commands:
+            counts[args[0]] = counts.get(args[0], 0) + 1
+        for name, count in counts.iteritems():
+            REDIS_COMMANDS.inc((name,), count)
+    REDIS_LATENCY.observe(seconds, (command,))
+    if failed:
+        REDIS_ERRORS.inc((command,))
+
+
+def watch_redis(redis):
+    """ Reports the round trips of a Redis client that takes observers to the metrics """
+    observers = getattr(redis, 'observers', None)
+    if observers is not None and observe_redis not in observers:
+        observers.append(observe_redis)
+
+
+def count_rows(query, scanned=0, returned=0):
+    """ Counts the index entries a query read from the data store and the rows it returned """
+    if scanned:
+        ROWS_SCANNED.inc((query,), scanned)
+    if returned:
+        ROWS_RETURNED.inc((query,), returned)
@@ -20,18 +20,21 @@ likes (int) - the count of how many people like this recommendation
 
 import os
 import json
+import uuid
 import logging
 import threading
 
-import pickle
-from redis import Redis
 from redis.exceptions import ConnectionError
-from cerberus import Validator
+from app.storage import ENGINES, INDEXES, RedisEngine
+from app.buffering import LikeBuffer
+from app.cache import RecordCache, CHANNEL
+from app.validation import SchemaValidator
+from app import codec, connection, metrics, tracing
 
 #######################################################################
 # Recommendations Model for database
-#   This class must be initialized with use_db(redis) before using
-#   where redis is a value connection to a Redis database
+#   This class must be initialized with init_db() before using
+#   which selects the storage engine that keeps the data
 #######################################################################
 
 
@@ -45,18 +48,40 @@ class Recommendation(object):
     Class that represents a Recommendation.
 
     This version uses an in-memory collection of recommendations for testing
+
+    Instances only have slots for their fields, so they take no per
+    instance dictionary. The queries can also return the stored records
+    as serialized dictionaries or as their canonical JSON text, without
+    creating any Recommendations. The public methods add their time to the
+    trace of the request being served, see app.tracing.
     """
+    __slots__ = ('id', 'product_id', 'recommended_product_id', 'recommendation_type', 'likes')
     logger = logging.getLogger(__name__)
     lock = threading.Lock()
     redis = None
+    # The integers have to fit the signed 64 bits of the packed records
     schema = {
-        'id': {'type': 'integer'},
-        'product_id': {'type': 'integer', 'required': True},
-        'recommended_product_id': {'type': 'integer', 'required': True},
+        'id': {'type': 'integer', 'min': -2 ** 63, 'max': 2 ** 63 - 1},
+        'product_id': {'type': 'integer', 'required': True, 'min': -2 ** 63, 'max': 2 ** 63 - 1},
+        'recommended_product_id': {'type': 'integer', 'required': True,
+                                   'min': -2 ** 63, 'max': 2 ** 63 - 1},
         'recommendation_type': {'type': 'string', 'required': True},
-        'likes': {'type': 'integer'}
+        'likes': {'type': 'integer', 'min': -2 ** 63, 'max': 2 ** 63 - 1}
     }
-    __validator = Validator(schema)
+    __validator = SchemaValidator(schema)
+    engine = None
+    like_buffer = None
+    cache = None
+    scan_batch_size = 1000
+    # A filter is checked one candidate id at a time instead of reading all
+    # of its ids once it matches this many times more ids than the candidates
+    probe_ratio = 4
+    __listener = None
+    # Writes are published on the invalidation channel only when the workers
+    # cache, otherwise every save, delete and like would take a round trip more
+    publish_invalidations = False
+    # Tells the invalidations of this process apart from those of the others
+    __origin = uuid.uuid4().hex
 
     def __init__(self, id=0, product_id=0, recommended_product_id=0,
                  recommendation_type="", likes=0):
@@ -70,6 +95,7 @@ class Recommendation(object):
     def __repr__(self):
         return '<Recommendation %r>' % (self.product_id)
 
+    @tracing.timed
     def save(self):
         """
         Saves a Recommendation to the data store
@@ -78,11 +104,51 @@ class Recommendation(object):
             raise DataValidationError('product_id is not set')
         if self.id == 0:
             self.id = Recommendation.__next_index()
-        Recommendation.redis.set(self.id, pickle.dumps(self.serialize()))
+        if Recommendation.like_buffer:
+            Recommendation.like_buffer.discard(self.id)
+        Recommendation.engine.save(self.serialize())
+        Recommendation.__invalidate([self.id], self.__tags())
 
+    @staticmethod
+    @tracing.timed
+    def save_all(recommendations):
+        """
+        Saves a list of Recommendations to the data store at once
+
+        New Recommendations get their ids from one reserved block and all of
+        them are written in a single transaction. Recommendations that
+        already have an id keep it and the id sequence is moved past it.
+        """
+        if not recommendations:
+            return
+        for recommendation in recommendations:
+            if recommendation.product_id is None:
+                raise DataValidationError('product_id is not set')
+        new = [recommendation for recommendation in recommendations if recommendation.id == 0]
+        if len(new) < len(recommendations):
+            # Keep ids that were given, such as imported ones, out of the sequence
+            Recommendation.engine.advance_index(max(recommendation.id for recommendation in recommendations))
+        if new:
+            first = Recommendation.engine.next_indexes(len(new))
+            for offset, recommendation in enumerate(new):
+                recommendation.id = first + offset
+        if Recommendation.like_buffer:
+            for recommendation in recommendations:
+                Recommendation.like_buffer.discard(recommendation.id)
+        Recommendation.engine.save_many([recommendation.serialize()
+                                         for recommendation in recommendations])
+        tags = set()
+        for recommendation in recommendations:
+            tags.update(recommendation.__tags())
+        Recommendation.__invalidate([recommendation.id for recommendation in recommendations], tags)
+
+    @tracing.timed
     def delete(self):
         """ Removes a Recommendation from the data store """
-        Recommendation.redis.delete(self.id)
+        if Recommendation.like_buffer:
+            Recommendation.like_buffer.discard(self.id)
+        Recommendation.engine.delete(self.id)
+        Recommendation.__invalidate([self.id])
 
     def serialize(self):
         """ Serializes a Recommendation into a dictionary """
@@ -92,6 +158,7 @@ class Recommendation(object):
                 "recommendation_type": self.recommendation_type,
                 "likes": self.likes}
 
+    @tracing.timed
     def deserialize(self, data):
         """
         Deserializes a Recommendation from a dictionary
@@ -99,105 +166,685 @@ class Recommendation(object):
         Args:
             data (dict): A dictionary containing the Recommendation data
         """
-        if isinstance(data, dict) and Recommendation.__validator.validate(data):
-            # self.id = data['id']
-            self.product_id = data['product_id']
-            self.recommended_product_id = data['recommended_product_id']
-            self.recommendation_type = data['recommendation_type']
-            self.likes = data['likes']
-        else:
-            raise DataValidationError('Invalid recommendation data: ' + str(Recommendation.__validator.errors))
+        if not isinstance(data, dict):
+            raise DataValidationError('Invalid recommendation data: expected a dictionary')
+        errors = Recommendation.__validator.validate(data)
+        if errors:
+            raise DataValidationError('Invalid recommendation data: ' + str(errors))
+        # self.id = data['id']
+        self.product_id = data['product_id']
+        self.recommended_product_id = data['recommended_product_id']
+        self.recommendation_type = data['recommendation_type']
+        self.likes = data.get('likes', self.likes)
         return self
 
     @staticmethod
     def __next_index():
         """ Generates the next index in a continual sequence """
-        return Recommendation.redis.incr('index')
+        return Recommendation.engine.next_index()
+
+    @staticmethod
+    @tracing.timed
+    def rebuild_indexes():
+        """
+        Rebuilds the indexes from the Recommendations in the database
+
+        Use this to index data that was saved before the indexes existed.
+        Returns the number of Recommendations that were indexed.
+        """
+        count = Recommendation.engine.rebuild_indexes(Recommendation.scan_batch_size)
+        Recommendation.__invalidate(clear=True)
+        Recommendation.logger.info('Rebuilt indexes for %d recommendations', count)
+        return count
+
+    @staticmethod
+    def __load(data):
+        """ Creates a Recommendation from a stored record
+
+        Stored records were validated when they were saved, so they are
+        trusted and not validated again.
+        """
+        likes = data['likes']
+        if Recommendation.like_buffer:
+            likes += Recommendation.like_buffer.pending_likes(data['id'])
+        return Recommendation(data['id'], data['product_id'], data['recommended_product_id'],
+                              data['recommendation_type'], likes)
+
+    @staticmethod
+    def __record(data):
+        """ Returns a stored record as it would be serialized, without a Recommendation
+
+        The record is returned as is when no likes are buffered for it, so
+        it can be shared with the cache and must not be changed.
+        """
+        if Recommendation.like_buffer:
+            pending = Recommendation.like_buffer.pending_likes(data['id'])
+            if pending:
+                return dict(data, likes=data['likes'] + pending)
+        return data
+
+    @staticmethod
+    def __json_record(text):
+        """ Returns the canonical JSON text of a stored record with the buffered likes """
+        if Recommendation.like_buffer:
+            pending = Recommendation.like_buffer.pending_likes(codec.json_id(text))
+            if pending:
+                data = json.loads(text)
+                data['likes'] += pending
+                return codec.to_json(data)
+        return text
+
+    @staticmethod
+    def __loader(serialized):
+        """ Returns the function that turns stored records into query results
+
+        Args:
+            serialized: False for Recommendations, True for serialized
+                        dictionaries and 'json' for canonical JSON text
+        """
+        if serialized == 'json':
+            return Recommendation.__json_record
+        return Recommendation.__record if serialized else Recommendation.__load
+
+    @staticmethod
+    def __record_id(data):
+        """ Returns the id of a stored record or of its canonical JSON text """
+        if isinstance(data, basestring):
+            return codec.json_id(data)
+        return data['id']
+
+    @staticmethod
+    def iter_all(batch_size=None):
+        """
+        Iterates over all of the Recommends in the database
+
+        The storage engine fetches the records in batches, so only one batch
+        is held in memory at a time.
+
+        Args:
+            batch_size (int): the number of records to fetch per round trip,
+                              defaults to Recommendation.scan_batch_size
+        """
+        for data in Recommendation.engine.scan(batch_size or Recommendation.scan_batch_size):
+            yield Recommendation.__load(data)
 
     @staticmethod
+    @tracing.timed
     def all():
         """ Returns all of the Recommends in the database """
-        results = []
-        for key in Recommendation.redis.keys():
-            if key != 'index':
-                data = pickle.loads(Recommendation.redis.get(key))
-                recommendation = Recommendation(data['id']).deserialize(data)
-                results.append(recommendation)
-
-        return results
+        return list(Recommendation.iter_all())
 
     @staticmethod
+    @tracing.timed
     def remove_all():
         """ Removes all of the Recommendations from the database """
-        Recommendation.redis.flushall()
+        if Recommendation.like_buffer:
+            Recommendation.like_buffer.clear()
+        Recommendation.engine.remove_all()
+        Recommendation.__invalidate(clear=True)
+
+    @staticmethod
+    @tracing.timed
+    def find(Recommendation_id, serialized=False, version=None):
+        """ Finds a Recommendation by it's ID
+
+        Returns the serialized dictionary or the canonical JSON text of the
+        Recommendation instead when serialized is True or 'json'. A cached
+        copy is only used when it was read at the given version token.
+        """
+        encoded = serialized == 'json'
+        data = Recommendation.__cached(('find', str(Recommendation_id), encoded),
+                                       lambda: Recommendation.engine.get(Recommendation_id, encoded),
+                                       version=version)
+        if data:
+            return Recommendation.__loader(serialized)(data)
+        return None
+
+    @staticmethod
+    @tracing.timed
+    def find_many(ids, serialized=False):
+        """ Finds the Recommendations of many ids with one round trip
+
+        Returns a dict of id to Recommendation for the ids that exist, or to
+        its serialized dictionary or canonical JSON text when serialized is
+        True or 'json'.
+        """
+        load = Recommendation.__loader(serialized)
+        return dict((Recommendation.__record_id(data), load(data))
+                    for data in Recommendation.engine.get_many(ids, serialized == 'json'))
 
     @staticmethod
-    def find(Recommendation_id):
-        """ Finds a Recommendation by it's ID """
-        if Recommendation.redis.exists(Recommendation_id):
-            data = pickle.loads(Recommendation.redis.get(Recommendation_id))
-            recommendation = Recommendation(data['id']).deserialize(data)
+    @tracing.timed
+    def like(Recommendation_id, amount=1):
+        """
+        Atomically adds to the likes of a Recommendation
+
+        The increment happens inside the data store in a single round trip,
+        so concurrent likes are never lost. When the likes are buffered they
+        are only added to the buffer, and the record is read once per flush
+        interval: the buffer keeps it until the next flush. Returns the
+        updated Recommendation or None if it doesn't exist.
+        """
+        buffer = Recommendation.like_buffer
+        if buffer:
+            data = buffer.record(Recommendation_id)
+            if data is None:
+                data = Recommendation.__cached(('find', str(Recommendation_id), False),
+                                               lambda: Recommendation.engine.get(Recommendation_id))
+                if not data:
+                    return None
+            recommendation = Recommendation.__load(data)
+            buffer.add(recommendation.id, amount, data)
+            recommendation.likes += amount
             return recommendation
+        data = Recommendation.engine.incr_likes(Recommendation_id, amount)
+        if data:
+            Recommendation.__invalidate([data['id']])
+            return Recommendation.__load(data)
         return None
 
     @staticmethod
-    def __find_by(attribute, value):
-        """ Generic Query that finds a key with a specific value """
-        Recommendation.logger.info('Processing %s query for %s', attribute, value)
-        search_criteria = value
-        results = []
-        for key in Recommendation.redis.keys():
-            if key != 'index':
-                data = pickle.loads(Recommendation.redis.get(key))
-                if isinstance(data[attribute], str):
-                    test_value = data[attribute]
-                else:
-                    test_value = data[attribute]
-                if test_value == search_criteria:
-                    results.append(Recommendation(data['id']).deserialize(data))
-        return results
+    def start_like_buffer(interval=1.0, threshold=1000):
+        """
+        Buffers likes in memory and writes them behind in batches
+
+        Likes are flushed to the data store every interval seconds, as soon
+        as threshold likes are waiting and when the process exits. Reads
+        include the likes that are still waiting.
+        """
+        Recommendation.stop_like_buffer()
+        Recommendation.like_buffer = LikeBuffer(Recommendation.engine, interval,
+                                                threshold, Recommendation.lock,
+                                                Recommendation.__invalidate)
+        Recommendation.like_buffer.start()
 
     @staticmethod
-    def find_by_product_id(product_id):
+    def stop_like_buffer():
+        """ Writes the buffered likes and goes back to writing every like """
+        if Recommendation.like_buffer:
+            Recommendation.like_buffer.stop()
+            Recommendation.like_buffer = None
+
+    @staticmethod
+    def pool_stats():
+        """ Returns the connection counts of the Redis pool or None without Redis """
+        if Recommendation.redis:
+            return connection.pool_stats(Recommendation.redis)
+        return None
+
+    @staticmethod
+    @tracing.timed
+    def version(id=None, product_id=None):
+        """
+        Returns a token that changes whenever a Recommendation in a scope changes
+
+        The scope is the Recommendation with the id, the Recommendations of
+        the product_id or all of them when neither is given. Reading the
+        token is a single round trip that doesn't fetch any Recommendations.
+        Likes that are still buffered in this process change it too.
+        """
+        token = Recommendation.engine.version(id, product_id)
+        if Recommendation.like_buffer:
+            token += '.%s.%d' % (Recommendation.__origin, Recommendation.like_buffer.changes)
+        return token
+
+    @staticmethod
+    def enable_cache(max_size=10000, ttl=30.0):
+        """
+        Caches the records read by find and the find_by_* index queries
+
+        The cache is kept in this process. Entries are dropped when this or
+        any other process that shares the data store writes the records in
+        them, and expire after ttl seconds in case an invalidation is lost.
+        """
+        Recommendation.disable_cache()
+        Recommendation.cache = RecordCache(max_size, ttl)
+        Recommendation.publish_invalidations = True
+        Recommendation.__listener = Recommendation.engine.subscribe(
+            CHANNEL, Recommendation.__invalidated)
+
+    @staticmethod
+    def disable_cache():
+        """ Stops caching and listening for invalidations """
+        if Recommendation.__listener:
+            Recommendation.__listener.stop()
+            Recommendation.__listener = None
+        Recommendation.cache = None
+
+    @staticmethod
+    def cache_stats():
+        """ Returns the hit and miss counters of the cache or None if it is off """
+        if Recommendation.cache:
+            return Recommendation.cache.stats()
+        return None
+
+    def __tags(self):
+        """ Returns the (attribute, value) pairs of the index queries this Recommendation is in """
+        return [('product_id', self.product_id),
+                ('recommended_product_id', self.recommended_product_id),
+                ('recommendation_type', self.recommendation_type)]
+
+    @staticmethod
+    def __cached(key, fetch, tags=(), version=None):
+        """ Returns the cached records of a key or fetches and caches them
+
+        The version token, when it is given, has to be read before the fetch
+        so that the cached records are never older than it.
+        """
+        cache = Recommendation.cache
+        if not cache:
+            return fetch()
+        value = cache.get(key, version)
+        if value is not None:
+            return value
+        generation = cache.generation
+        value = fetch()
+        if isinstance(value, list):
+            cache.put(key, value, [Recommendation.__record_id(data) for data in value], tags,
+                      generation, version)
+        elif value:
+            cache.put(key, value, [Recommendation.__record_id(value)], tags, generation, version)
+        return value
+
+    @staticmethod
+    def __invalidate(ids=(), tags=(), clear=False):
+        """ Drops stale cache entries here and tells the other processes to """
+        if Recommendation.cache:
+            if clear:
+                Recommendation.cache.clear()
+            else:
+                Recommendation.cache.invalidate(ids, tags)
+        if not Recommendation.publish_invalidations:
+            return
+        message = {'origin': Recommendation.__origin, 'clear': clear,
+                   'ids': list(ids), 'tags': list(tags)}
+        try:
+            Recommendation.engine.publish(CHANNEL, json.dumps(message))
+        except ConnectionError:
+            Recommendation.logger.warning('Could not publish cache invalidation')
+
+    @staticmethod
+    def __invalidated(message):
+        """ Drops the cache entries that another process invalidated """
+        try:
+            message = json.loads(message)
+            if message['origin'] == Recommendation.__origin or not Recommendation.cache:
+                return
+            if message['clear']:
+                Recommendation.cache.clear()
+            else:
+                Recommendation.cache.invalidate(message['ids'],
+                                                [tuple(tag) for tag in message['tags']])
+        except (ValueError, KeyError, TypeError):
+            Recommendation.logger.exception('Ignoring invalid cache invalidation')
+
+    @staticmethod
+    @tracing.timed
+    def find_all(after=0, limit=None, serialized=False):
+        """ Returns a page of all of the Recommends, ordered by id
+        Args:
+            after (int): only return Recommends with a greater id, for paging
+            limit (int): the number of Recommends to return at most, None for all
+            serialized: True to return serialized dictionaries instead of
+                        Recommends, 'json' to return their canonical JSON text
+        """
+        load = Recommendation.__loader(serialized)
+        records = Recommendation.engine.find_all(after, limit, serialized == 'json')
+        metrics.count_rows('find_all', len(records), len(records))
+        return [load(data) for data in records]
+
+    @staticmethod
+    def __find_by_index(attribute, value, after, limit, serialized=False):
+        """ Query that resolves a value through its index """
+        Recommendation.logger.info('Processing %s index query for %s', attribute, value)
+        encoded = serialized == 'json'
+        query = 'find_by_' + attribute
+
+        def fetch():
+            records = list(Recommendation.engine.find_by(attribute, value, after, limit, encoded))
+            metrics.count_rows(query, scanned=len(records))
+            return records
+
+        records = Recommendation.__cached(('find_by', attribute, value, after, limit, encoded),
+                                          fetch, [(attribute, value)])
+        metrics.count_rows(query, returned=len(records))
+        load = Recommendation.__loader(serialized)
+        return [load(data) for data in records]
+
+    @staticmethod
+    @tracing.timed
+    def find_by_product_id(product_id, after=0, limit=None):
         """ Returns Recommend with the given product_id
         Args:
             product_id (int): the product_id of the Recommend you want to match
+            after (int): only return Recommends with a greater id, for paging
+            limit (int): the number of Recommends to return at most, None for all
+        """
+        return Recommendation.__find_by_index('product_id', product_id, after, limit)
+
+    @staticmethod
+    @tracing.timed
+    def find_by_product_ids(product_ids, limit=None, serialized=False, version=None):
+        """ Returns the Recommends of many product_ids, grouped by product_id
+
+        The product_ids that aren't cached are read with one pipelined index
+        read and one MGET for all of them.
+
+        Args:
+            product_ids (list): the product_ids of the Recommends you want to match
+            limit (int): the number of Recommends to return per product_id, None for all
+            serialized: True to return serialized dictionaries instead of
+                        Recommends, 'json' to return their canonical JSON text
+            version (str): the version token read before the query, cached
+                           Recommends read at another version are read again
         """
-        return Recommendation.__find_by('product_id', product_id)
+        groups = {}
+        missing = []
+        cache = Recommendation.cache
+        encoded = serialized == 'json'
+        for product_id in product_ids:
+            key = ('find_by', 'product_id', product_id, 0, limit, encoded)
+            records = cache.get(key, version) if cache else None
+            if records is None:
+                missing.append(product_id)
+            else:
+                groups[product_id] = records
+        if missing:
+            generation = cache.generation if cache else None
+            id_lists = Recommendation.engine.find_ids_many(
+                [('product_id', product_id) for product_id in missing], limit)
+            ids = sorted(set(id for id_list in id_lists for id in id_list))
+            metrics.count_rows('find_by_product_ids', scanned=sum(len(id_list) for id_list in id_lists))
+            records = dict((Recommendation.__record_id(data), data)
+                           for data in Recommendation.engine.get_many(ids, encoded))
+            for product_id, id_list in zip(missing, id_lists):
+                groups[product_id] = [records[id] for id in id_list if id in records]
+                if cache:
+                    cache.put(('find_by', 'product_id', product_id, 0, limit, encoded),
+                              groups[product_id], id_list, [('product_id', product_id)], generation,
+                              version)
+        metrics.count_rows('find_by_product_ids',
+                           returned=sum(len(groups[product_id]) for product_id in product_ids))
+        load = Recommendation.__loader(serialized)
+        return dict((product_id, [load(data) for data in groups[product_id]])
+                    for product_id in product_ids)
 
     @staticmethod
-    def find_by_recommend_product_id(recommended_product_id):
+    @tracing.timed
+    def find_top_by_product_id(product_id, count=10, serialized=False):
+        """ Returns the Recommends of a product_id with the most likes first
+        Args:
+            product_id (int): the product_id of the Recommends you want to rank
+            count (int): the number of Recommends to return at most
+            serialized: True to return serialized dictionaries instead of
+                        Recommends, 'json' to return their canonical JSON text
+        """
+        Recommendation.logger.info('Processing top %s query for product_id %s', count, product_id)
+        load = Recommendation.__loader(serialized)
+        records = Recommendation.engine.find_top(product_id, count, serialized == 'json')
+        metrics.count_rows('find_top_by_product_id', len(records), len(records))
+        return [load(data) for data in records]
+
+    @staticmethod
+    @tracing.timed
+    def find_by_recommend_product_id(recommended_product_id, after=0, limit=None):
         """ Returns Recommend with the given product_id
         Args:
             recommend_product_id (int): the recommend_product_id of the Recommend you want to match
+            after (int): only return Recommends with a greater id, for paging
+            limit (int): the number of Recommends to return at most, None for all
         """
-        return Recommendation.__find_by('recommended_product_id', recommended_product_id)
+        return Recommendation.__find_by_index('recommended_product_id', recommended_product_id,
+                                              after, limit)
 
     @staticmethod
-    def find_by_recommend_type(recommendation_type):
+    @tracing.timed
+    def find_by_recommend_type(recommendation_type, after=0, limit=None):
         """ Returns Recommend with given recommendation_type
         Args:
             recommend_type (int): the recommend type of the Recommend you want to match
+            after (int): only return Recommends with a greater id, for paging
+            limit (int): the number of Recommends to return at most, None for all
         """
-        return Recommendation.__find_by('recommendation_type', recommendation_type)
+        return Recommendation.__find_by_index('recommendation_type', recommendation_type,
+                                              after, limit)
 
     @staticmethod
+    @tracing.timed
     def find_by_likes(likes):
         """ Returns Recommends that have more likes
         Args:
             likes (int): the number of likes that a Recommend should have at least
         """
-        return Recommendation.__find_by('likes', likes)
+        return Recommendation.find_by_likes_range(likes, likes)
+
+    @staticmethod
+    @tracing.timed
+    def find_by_likes_range(min_likes=None, max_likes=None, after=None, limit=None):
+        """ Returns Recommends with likes in a range, ordered by likes and then by id
+        Args:
+            min_likes (int): the fewest likes a Recommend should have, None for no limit
+            max_likes (int): the most likes a Recommend should have, None for no limit
+            after (tuple): only return Recommends after this (likes, id) position, for paging
+            limit (int): the number of Recommends to return at most, None for all
+        """
+        Recommendation.logger.info('Processing likes range query for %s to %s', min_likes, max_likes)
+        records = Recommendation.engine.find_by_likes(min_likes, max_likes,
+                                                      Recommendation.__likes_position(after), limit)
+        metrics.count_rows('find_by_likes_range', len(records), len(records))
+        return [Recommendation.__load(data) for data in records]
+
+    @staticmethod
+    @tracing.timed
+    def find_where(filters, after=0, limit=None, serialized=False):
+        """ Returns the Recommends that match all of the filters, ordered by id
+
+        A likes range on its own is ordered by likes and then by id instead,
+        like find_by_likes_range, and is paged after a (likes, id) position.
+
+        Args:
+            filters (dict): the product_id, recommended_product_id and
+                            recommendation_type to match and the min_likes and
+                            max_likes of a likes range, filters that are None
+                            or missing match every Recommend
+            after: only return Recommends with a greater id, or after the
+                   (likes, id) position of a likes range, for paging
+            limit (int): the number of Recommends to return at most, None for all
+            serialized: True to return serialized dictionaries instead of
+                        Recommends, 'json' to return their canonical JSON text
+        """
+        return Recommendation.find_page(filters, after, limit, serialized)[0]
+
+    @staticmethod
+    @tracing.timed
+    def find_page(filters, after=0, limit=None, serialized=False, version=None):
+        """ Returns a page of find_where and the position the next page starts after
+
+        The position is the id, or the (likes, id) pair of a likes range, of
+        the last match of the page in the indexes, or None when nothing
+        matches after the page. It doesn't depend on the records that are
+        returned, so a Recommend that is deleted between reading the indexes
+        and reading the records doesn't end the paging early.
+
+        Args: the same as find_where and
+            version (str): the version token read before the query, a cached
+                           page read at another version is read again
+        """
+        predicates = Recommendation.__predicates(filters)
+        if not predicates:
+            query = 'find_all'
+        elif len(predicates) > 1:
+            query = 'find_where'
+        elif predicates[0][0] == 'likes':
+            query = 'find_by_likes_range'
+            after = Recommendation.__likes_position(after)
+        else:
+            query = 'find_by_' + predicates[0][0]
+        if query != 'find_by_likes_range' and isinstance(after, tuple):
+            raise DataValidationError('Only a likes range is paged after a (likes, id) position')
+        encoded = serialized == 'json'
+        cache = Recommendation.cache
+        # Likes change too often to cache and a like can move any record into
+        # the range, without filters any new Recommend can join the page
+        cached = (cache and predicates and
+                  all(attribute != 'likes' for attribute, value in predicates))
+        key = ('find_where', tuple(predicates), after, limit, encoded)
+        page = cache.get(key, version) if cached else None
+        if page is None:
+            generation = cache.generation if cached else None
+            # One more position than the page tells if there is a next page
+            positions = Recommendation.__find_positions(predicates, after,
+                                                        limit + 1 if limit else None, query)
+            cursor = None
+            if limit and len(positions) > limit:
+                positions = positions[:limit]
+                cursor = positions[-1]
+            ids = positions
+            if query == 'find_by_likes_range':
+                ids = [id for likes, id in positions]
+            page = (Recommendation.engine.get_many(ids, encoded), cursor)
+            if cached:
+                cache.put(key, page, ids, predicates, generation, version)
+        records, cursor = page
+        metrics.count_rows(query, returned=len(records))
+        load = Recommendation.__loader(serialized)
+        return [load(data) for data in records], cursor
+
+    @staticmethod
+    @tracing.timed
+    def explain(filters):
+        """ Returns the plan that find_where would use for the filters
+
+        The plan lists the indexes in the order they are used with the
+        number of Recommends each one matches. The first index is scanned a
+        chunk at a time until a page is found, the next ones are either read
+        between the ids of the chunk and intersected with them or probed for
+        each of those ids, whichever reads less. A likes range of more than
+        scan_batch_size Recommends is always probed, since its ids aren't
+        kept in id order.
+        """
+        predicates = Recommendation.__predicates(filters)
+        if not predicates:
+            return {'steps': [{'operation': 'scan', 'index': 'all'}]}
+        return Recommendation.__plan(predicates)
+
+    @staticmethod
+    def __predicates(filters):
+        """ Turns query filters into the (attribute, value) predicates of the indexes """
+        predicates = [(attribute, filters[attribute]) for attribute in INDEXES
+                      if filters.get(attribute) is not None]
+        min_likes = filters.get('min_likes')
+        max_likes = filters.get('max_likes')
+        if min_likes is not None or max_likes is not None:
+            predicates.append(('likes', (min_likes, max_likes)))
+        return predicates
+
+    @staticmethod
+    def __plan(predicates):
+        """ Orders the predicates from the most to the least selective index """
+        counts = Recommendation.engine.count(predicates)
+        # The ids of a likes range have to be read whole to put them in id
+        # order, which is only done for small ranges
+        probed = set(predicate for count, predicate in zip(counts, predicates)
+                     if predicate[0] == 'likes' and count > Recommendation.scan_batch_size)
+        ranked = sorted(zip(counts, predicates),
+                        key=lambda item: (len(predicates) > 1 and item[1] in probed, item[0]))
+        steps = []
+        estimate = ranked[0][0]
+        for count, (attribute, value) in ranked:
+            if not steps:
+                operation = 'scan'
+            elif (attribute, value) not in probed and count <= Recommendation.probe_ratio * estimate:
+                operation = 'intersect'
+            else:
+                operation = 'probe'
+            steps.append({'operation': operation, 'index': attribute, 'value': value, 'rows': count})
+            estimate = min(estimate, count)
+        return {'steps': steps, 'estimated_rows': estimate}
+
+    @staticmethod
+    def __find_positions(predicates, after, limit, query):
+        """ Returns the ids after the given one that match every predicate, in order
+
+        A likes range on its own returns its (likes, id) positions instead.
+        """
+        if query == 'find_where':
+            plan = Recommendation.__plan(predicates)
+            Recommendation.logger.info('Processing query plan %s', plan['steps'])
+            return Recommendation.__run_plan(plan, after, limit)
+        if query == 'find_by_likes_range':
+            positions = Recommendation.engine.find_positions(predicates[0][1], after, limit)
+        else:
+            positions = Recommendation.engine.find_ids(predicates[0] if predicates else None,
+                                                       after, limit)
+        metrics.count_rows(query, scanned=len(positions))
+        return positions
+
+    @staticmethod
+    def __likes_position(after):
+        """ Returns the (likes, id) position a likes range is paged after, None for its start """
+        if not after:
+            return None
+        if isinstance(after, tuple) and len(after) == 2:
+            return after
+        raise DataValidationError('A likes range is paged after a (likes, id) position')
+
+    @staticmethod
+    def __run_plan(plan, after, limit):
+        """ Returns the ids after the given one that match every step of a plan
+
+        The first index is read in chunks, the first one the size of the page
+        and the next ones sized by the share of the ids that matched so far,
+        so a page reads about as much of it as it needs.
+        """
+        steps = plan['steps']
+        if not plan['estimated_rows']:
+            return []
+        first = (steps[0]['index'], steps[0]['value'])
+        # A likes range is read whole, its ids aren't in id order
+        size = None if first[0] == 'likes' else limit
+        ids = []
+        scanned = read = 0
+        while True:
+            chunk = Recommendation.engine.find_ids(first, after, size)
+            scanned += len(chunk)
+            read += len(chunk)
+            matches = chunk
+            for step in steps[1:]:
+                if not matches:
+                    break
+                predicate = (step['index'], step['value'])
+                if step['operation'] == 'intersect':
+                    # Only the ids up to the end of the chunk can match it
+                    found = set(Recommendation.engine.find_ids(predicate, after, None, chunk[-1]))
+                    scanned += len(found)
+                    matches = [id for id in matches if id in found]
+                else:
+                    # Probing reads one index entry per candidate
+                    scanned += len(matches)
+                    matches = Recommendation.engine.filter_ids(matches, predicate)
+            ids.extend(matches)
+            if size is None or len(chunk) < size or len(ids) >= limit:
+                break
+            after = chunk[-1]
+            size = (limit - len(ids)) * read // len(ids) + 1 if ids else size * 2
+        metrics.count_rows('find_where', scanned=scanned)
+        return ids[:limit]
 
 #######################################################################
 # REDIS DATABASE CONNECTION METHODS
 #######################################################################
 
     @staticmethod
-    def connect_to_redis(hostname, port, password):
-        """ Connects to Redis and tests the connection """
+    def connect_to_redis(hostname, port, password, options=None):
+        """ Connects to Redis and tests the connection
+
+        Args:
+            options (dict): the connection pool, timeout and retry settings,
+                            see app.connection.DEFAULTS
+        """
         Recommendation.logger.info("Testing Connection to: %s:%s", hostname, port)
-        Recommendation.redis = Redis(host=hostname, port=port, password=password)
+        Recommendation.redis = connection.connect(hostname, port, password, options)
         try:
             Recommendation.redis.ping()
             Recommendation.logger.info("Connection established")
@@ -208,7 +855,7 @@ class Recommendation(object):
         return Recommendation.redis
 
     @staticmethod
-    def init_db(redis=None):
+    def init_db(redis=None, engine='redis', options=None, record_format='packed'):
 
         """
         Initialized Redis database connection
@@ -218,12 +865,29 @@ class Recommendation(object):
           2) With Redis running on the local server as with Travis CI
           3) With Redis --link in a Docker container called 'redis'
           4) Passing in your own Redis connection object
+          5) With engine='memory' to keep the data in this process
+
+        The connection pool, timeout and retry options can also be set in
+        the credentials of the VCAP_SERVICES, which take precedence.
+        Redis keeps the records in record_format, 'packed' or 'json'.
 
         Exception:
         ----------
           redis.ConnectionError - if ping() test fails
+          ValueError - if the storage engine is unknown
 
         """
+        if engine not in ENGINES:
+            raise ValueError('Unknown storage engine: %s' % engine)
+        Recommendation.stop_like_buffer()
+        Recommendation.disable_cache()
+        Recommendation.publish_invalidations = False
+        Recommendation.engine = None
+        if engine != 'redis':
+            Recommendation.logger.info("Using %s storage engine...", engine)
+            Recommendation.redis = None
+            Recommendation.engine = ENGINES[engine]()
+            return
         if redis:
             Recommendation.logger.info("Using client connection...")
             Recommendation.redis = redis
@@ -234,6 +898,7 @@ class Recommendation(object):
                 Recommendation.logger.error("Client Connection Error!")
                 Recommendation.redis = None
                 raise ConnectionError('Could not connect to the Redis Service')
+            Recommendation.engine = RedisEngine(Recommendation.redis, record_format)
             return
         # Get the credentials from the Bluemix environment
         if 'VCAP_SERVICES' in os.environ:
@@ -243,14 +908,19 @@ class Recommendation(object):
             creds = services['rediscloud'][0]['credentials']
             Recommendation.logger.info("Conecting to Redis on host %s port %s",
                                        creds['hostname'], creds['port'])
-            Recommendation.connect_to_redis(creds['hostname'], creds['port'], creds['password'])
+            options = dict(options or {})
+            options.update((name, value) for name, value in creds.items()
+                           if name in connection.DEFAULTS)
+            Recommendation.connect_to_redis(creds['hostname'], creds['port'], creds['password'],
+                                            options)
         else:
             Recommendation.logger.info("VCAP_SERVICES not found, checking localhost for Redis")
-            Recommendation.connect_to_redis('127.0.0.1', 6379, None)
+            Recommendation.connect_to_redis('127.0.0.1', 6379, None, options)
             if not Recommendation.redis:
                 Recommendation.logger.info("No Redis on localhost, looking for redis host")
-                Recommendation.connect_to_redis('redis', 6379, None)
+                Recommendation.connect_to_redis('redis', 6379, None, options)
         if not Recommendation.redis:
             # if you end up here, redis instance is down.
             Recommendation.logger.fatal('*** FATAL ERROR: Could not connect to the Redis Service')
             raise ConnectionError('Could not connect to the Redis Service')
+        Recommendation.engine = RedisEngine(Recommendation.redis, record_format)
@@ -5,18 +5,31 @@ It demonstrates how a RESTful service should be implemented.
 Paths
 -----
 GET  /recommendations - Retrieves a list of recommendations from the database
+GET  /recommendations?ids={ids} - Retrieves many recommendations by id at once
+GET  /recommendations?product_ids={ids} - Retrieves the recommendations of many products at once
 GET  /recommendations/{id} - Retrieves a recommendation with a specific id
 POST /recommendations - Creates a recommendation in the datbase from the posted database
+POST /recommendations/batch - Creates a list of recommendations in the database at once
 PUT  /recommendations/{id} - Updates a recommendation in the database fom the posted database with a specific id
 DELETE /recommendations{id} - Removes a recommendation from the database that matches the id
+GET  /products/{id}/recommendations/top - Retrieves the recommendations of a product with the most likes
+GET  /recommendations/cache - Retrieves the hit and miss counters of the record cache
+GET  /recommendations/pool - Retrieves the connection counts of the Redis pool
+GET  /metrics - Retrieves the metrics of the worker in the Prometheus text format
 """
 
 import os
 import sys
+import time
+import base64
+import hashlib
+from collections import OrderedDict
 from app.models import Recommendation
+from app import metrics, tracing
 from . import app
 import logging
-from flask import Flask, Response, jsonify, request, json, url_for, make_response
+from flask import Flask, Response, jsonify, request, json, url_for, make_response, \
+    stream_with_context, _request_ctx_stack
 from flask_api import status
 from flasgger import Swagger
 from models import Recommendation, DataValidationError
@@ -29,10 +42,17 @@ PORT = os.getenv('PORT', '5000')
 HTTP_200_OK = 200
 HTTP_201_CREATED = 201
 HTTP_204_NO_CONTENT = 204
+HTTP_304_NOT_MODIFIED = 304
 HTTP_400_BAD_REQUEST = 400
 HTTP_404_NOT_FOUND = 404
 HTTP_409_CONFLICT = 409
 
+# Content type of newline delimited JSON streams
+NDJSON = 'application/x-ndjson'
+
+# Requests slower than SLOW_REQUEST_MS are logged here as one JSON object per line
+SLOW_LOG = logging.getLogger('app.slow_requests')
+
 ######################################################################
 # Configure Swagger before initializing it
 ######################################################################
@@ -93,6 +113,94 @@ def internal_server_error(error):
     return jsonify(status=500, error='Internal Server Error', message=error.message), 500
 
 
+######################################################################
+# Request metrics
+######################################################################
+
+
+@app.before_request
+def start_request_metrics():
+    """ Counts the request as in flight """
+    if not app.config['METRICS_ENABLED']:
+        return
+    # The metrics of a request are kept on its context, which is one lookup
+    # instead of one for every attribute of the request and of g
+    context = _request_ctx_stack.top
+    rule = context.request.url_rule
+    # The rule is the route template, so every id of a route shares its metrics
+    labels = (context.request.method, rule.rule if rule else 'unmatched')
+    context.metrics = [labels, time.time(), 500]
+    metrics.HTTP_IN_FLIGHT.inc(labels)
+
+
+@app.after_request
+def record_response_metrics(response):
+    """ Keeps the status and records the size of the response """
+    state = getattr(_request_ctx_stack.top, 'metrics', None)
+    if state is not None:
+        state[2] = response.status_code
+        # Streamed responses have no length until they are sent
+        if not response.is_streamed:
+            metrics.HTTP_RESPONSE_SIZE.observe(response.calculate_content_length(), state[0])
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(error):
+    """ Counts the request and records its latency once it is done """
+    context = _request_ctx_stack.top
+    state = getattr(context, 'metrics', None)
+    if state is None:
+        return
+    context.metrics = None
+    labels, started, status = state
+    # Errors that escaped the handlers are answered with a 500 and skip after_request
+    if error is not None:
+        status = 500
+    metrics.HTTP_IN_FLIGHT.dec(labels)
+    metrics.HTTP_REQUESTS.inc(labels + (str(status),))
+    metrics.HTTP_LATENCY.observe(time.time() - started, labels)
+
+
+######################################################################
+# Request tracing
+######################################################################
+
+
+@app.before_request
+def start_request_trace():
+    """ Starts adding up the Redis commands and model time of the request """
+    if app.config['REQUEST_TRACING']:
+        tracing.start()
+
+
+@app.after_request
+def record_trace_status(response):
+    """ Keeps the status and sends the command count in debug mode """
+    trace = tracing.current()
+    if trace is not None:
+        trace.status = response.status_code
+        if app.debug:
+            # Streamed responses send the commands made before streaming
+            response.headers['X-Redis-Commands'] = str(trace.commands)
+    return response
+
+
+@app.teardown_request
+def finish_request_trace(error):
+    """ Logs the request to the slow log when it took SLOW_REQUEST_MS or more """
+    trace = tracing.finish()
+    if trace is None or (time.time() - trace.started) * 1000 < app.config['SLOW_REQUEST_MS']:
+        return
+    entry = trace.summary()
+    entry.update(method=request.method,
+                 path=request.path,
+                 route=request.url_rule.rule if request.url_rule else None,
+                 query=request.args.to_dict(flat=False),
+                 status=500 if error is not None or trace.status is None else trace.status)
+    SLOW_LOG.warning(json.dumps(entry, sort_keys=True))
+
+
 ######################################################################
 # GET INDEX
 ######################################################################
@@ -112,7 +220,7 @@ def list_recommendations():
     """
     Retrieves a list of recommendations from the database
     This endpoint will return all recommendations unless it is given
-    a query parameter
+    query parameters, which can be combined to match all of them
     ----
     tags:
         - Recommendations
@@ -130,6 +238,47 @@ def list_recommendations():
           name: recommended_product_id
           type: integer
           description: query the recommendation that matches the recommended_product_id
+        - in: query
+          name: min_likes
+          type: integer
+          description: query the recommendations that have at least min_likes likes
+        - in: query
+          name: max_likes
+          type: integer
+          description: query the recommendations that have at most max_likes likes,
+                       a likes range on its own is listed by likes and then by id
+        - in: query
+          name: limit
+          type: integer
+          description: the number of recommendations to return at most, up to MAX_PAGE_SIZE
+        - in: query
+          name: cursor
+          type: string
+          description: the cursor of the next page from the Link or X-Next-Cursor header
+        - in: query
+          name: stream
+          type: integer
+          description: set to 1 to stream every match as newline delimited JSON,
+                       which is also selected by Accept application/x-ndjson
+        - in: query
+          name: ids
+          type: string
+          description: comma separated ids, returns an object of id to recommendation,
+                       or null for the ids that don't exist
+        - in: query
+          name: product_ids
+          type: string
+          description: comma separated product ids, returns an object of product id
+                       to its list of recommendations, up to limit per product
+        - in: query
+          name: explain
+          type: integer
+          description: set to 1 to get the query plan of the filters instead of
+                       the recommendations
+        - in: header
+          name: If-None-Match
+          type: string
+          description: the ETag of a copy the client already has
     definitions:
         Recommendation:
             type: object
@@ -148,73 +297,98 @@ def list_recommendations():
                     description: the count of how many people like this recommendation
     responses:
         200:
-            description: A list of recommendations
+            description: A list of recommendations, with a Link header to the next page
             schema:
                 type: list
+        304:
+            description: The list has not changed since the ETag was sent
         400:
             description: Recommendation was not found
 
     """
-    results = []
-    product_id = request.args.get('product_id')
-    recommendation_type = request.args.get('recommendation_type')
-    recommended_product_id = request.args.get('recommended_product_id')
-    if product_id:
-        message, return_code = query_recommendations_by_product_id(product_id)
-    elif recommended_product_id:
-        message, return_code = query_recommendations_by_recommended_product_id(recommended_product_id)
-    elif recommendation_type:
-        message, return_code = query_recommendations_by_recommendation_type(recommendation_type)
+    after, limit = get_page_args()
+    filters = get_query_filters()
+    if request.args.get('explain') in ('1', 'true', 'True'):
+        return jsonify(Recommendation.explain(filters)), HTTP_200_OK
+    if 'product_id' in filters:
+        version = Recommendation.version(product_id=filters['product_id'])
     else:
-        results = Recommendation.all()
-        message = [recommendation.serialize() for recommendation in results]
-        return_code = HTTP_200_OK
-
-    return jsonify(message), return_code
+        version = Recommendation.version()
+    etag = make_etag(version)
+    if etag in request.if_none_match:
+        return not_modified(etag)
+    # The cached records are only used when they were read at this version,
+    # so the ETag never labels an older body
+    if 'ids' in request.args or 'product_ids' in request.args:
+        response = json_response(get_many(filters, limit, version))
+        response.set_etag(etag)
+        return response
+    if stream_requested():
+        find_page = lambda after, limit: Recommendation.find_page(filters, after, limit,
+                                                                  serialized='json',
+                                                                  version=version)
+        response = Response(stream_with_context(generate_ndjson(find_page, after)),
+                            mimetype=NDJSON)
+        response.set_etag(etag)
+        return response
+
+    # The stored records are sent as they are, without decoding them
+    rows, position = Recommendation.find_page(filters, after, limit, serialized='json',
+                                              version=version)
+    if filters and not rows and position is None:
+        message = {'error': 'Recommendation with %s was not found' % describe_filters(filters)}
+        return jsonify(message), HTTP_404_NOT_FOUND
+
+    response = json_response('[%s]' % ','.join(rows))
+    response.set_etag(etag)
+    if position is not None:
+        next_cursor = encode_cursor(position)
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = '<%s>; rel="next"' % url_for('list_recommendations',
+                                                                _external=True, **args)
+    return response
 
-def query_recommendations_by_product_id(product_id):
-    """
-    Query a recommendation from the database that have the same product_id
+######################################################################
+# TOP recommendations OF A PRODUCT
+######################################################################
+@app.route('/products/<int:id>/recommendations/top', methods=['GET'])
+def top_recommendations(id):
+    """ Retrieves the recommendations of a product with the most likes first
+    ---
+    tags:
+      - Recommendations
+    path:
+      - /products/<int:id>/recommendations/top
+    parameters:
+      - name: id
+        in: path
+        description: The product id of the recommendations
+        type: integer
+        required: true
+      - name: n
+        in: query
+        description: The number of recommendations to return (default 10, at most MAX_TOP_COUNT)
+        type: integer
+    responses:
+      200:
+        description: A list of recommendations ranked by likes
+      400:
+        description: n is not a positive integer or is more than MAX_TOP_COUNT
+      404:
+        description: The product has no recommendations
     """
-    recommendations = Recommendation.find_by_product_id(int(product_id))
-    if len(recommendations) > 0:
-        message = [recommendation.serialize()
-                   for recommendation in recommendations]
-        return_code = HTTP_200_OK
-    else:
-        message = {'error': 'Recommendation with product_id: \
-                    %s was not found' % str(product_id)}
-        return_code = HTTP_404_NOT_FOUND
-
-    return message, return_code
-
-def query_recommendations_by_recommendation_type(recommendation_type):
-    """ Query a recommendation from the database that have the same recommendation type """
-    recommendations = Recommendation.find_by_recommend_type(str(recommendation_type))
-    if len(recommendations) > 0:
-        message = [recommendation.serialize()
-                   for recommendation in recommendations]
-        return_code = HTTP_200_OK
-    else:
-        message = {'error': 'Recommendation with product_id: \
-                    %s was not found' % str(recommendation_type)}
-        return_code = HTTP_404_NOT_FOUND
-
-    return message, return_code
-
-def query_recommendations_by_recommended_product_id(recommended_product_id):
-    """ Query a recommendation from the database that have the same recommended product id """
-    recommendations = Recommendation.find_by_recommend_product_id(int(recommended_product_id))
-    if len(recommendations) > 0:
-        message = [recommendation.serialize()
-                   for recommendation in recommendations]
-        return_code = HTTP_200_OK
-    else:
-        message = {'error': 'Recommendation with product_id: \
-                    %s was not found' % str(recommended_product_id)}
-        return_code = HTTP_404_NOT_FOUND
-
-    return message, return_code
+    count = request.args.get('n', '10')
+    if not count.isdigit() or int(count) < 1:
+        raise DataValidationError('n must be a positive integer')
+    if int(count) > app.config['MAX_TOP_COUNT']:
+        raise DataValidationError('n can be at most %d' % app.config['MAX_TOP_COUNT'])
+    rows = Recommendation.find_top_by_product_id(id, int(count), serialized='json')
+    if rows:
+        return json_response('[%s]' % ','.join(rows))
+    message = {'error': 'Recommendation with product_id: %s was not found' % str(id)}
+    return jsonify(message), HTTP_404_NOT_FOUND
 
 ######################################################################
 # RETRIEVE A recommendation
@@ -235,21 +409,29 @@ def get_recommendations(id):
         description: The unique id of a recommendation
         type: integer
         required: true
+      - name: If-None-Match
+        in: header
+        description: The ETag of a copy the client already has
+        type: string
     responses:
       200:
         description: Recommendation returned
+      304:
+        description: Recommendation has not changed since the ETag was sent
       404:
         description: Recommendation not found
     """
-    recommendation = Recommendation.find(id)
+    version = Recommendation.version(id=id)
+    etag = make_etag(version)
+    if etag in request.if_none_match:
+        return not_modified(etag)
+    recommendation = Recommendation.find(id, serialized='json', version=version)
     if recommendation:
-        message = recommendation.serialize()
-        return_code = HTTP_200_OK
-    else:
-        message = {'error' : 'Recommendation with id: %s was not found' % str(id)}
-        return_code = HTTP_404_NOT_FOUND
-
-    return jsonify(message), return_code
+        response = json_response(recommendation)
+        response.set_etag(etag)
+        return response
+    message = {'error' : 'Recommendation with id: %s was not found' % str(id)}
+    return jsonify(message), HTTP_404_NOT_FOUND
 
 ######################################################################
 # ADD A NEW recommendation
@@ -303,6 +485,54 @@ def create_recommendations():
     response.headers['Location'] = url_for('get_recommendations', id=recommendation.id, _external=True)
     return response
 
+######################################################################
+# ADD MANY NEW recommendations
+######################################################################
+
+
+@app.route('/recommendations/batch', methods=['POST'])
+def create_recommendations_batch():
+    """ Creates and saves a list of recommendations at once
+    ---
+    tags:
+      - Recommendations
+    path:
+      - /recommendations/batch
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: array
+          items:
+            $ref: '#/definitions/Recommendation'
+    responses:
+      201:
+        description: All of the recommendations were created, in the order they were posted
+      400:
+        description: Nothing was created, the errors list the invalid recommendations
+    """
+    payload = request.get_json()
+    if not isinstance(payload, list):
+        raise DataValidationError('Expected a list of recommendations')
+    if len(payload) > app.config['MAX_BATCH_SIZE']:
+        raise DataValidationError('A batch can have at most %d recommendations'
+                                  % app.config['MAX_BATCH_SIZE'])
+    recommendations = []
+    errors = []
+    for index, data in enumerate(payload):
+        try:
+            recommendations.append(Recommendation().deserialize(data))
+        except DataValidationError as error:
+            errors.append({'index': index, 'message': error.message})
+    if errors:
+        return jsonify(status=400, error='Bad Request', errors=errors,
+                       message='%d of %d recommendations are invalid'
+                       % (len(errors), len(payload))), HTTP_400_BAD_REQUEST
+    Recommendation.save_all(recommendations)
+    message = [recommendation.serialize() for recommendation in recommendations]
+    return jsonify(message), HTTP_201_CREATED
+
 ######################################################################
 # UPDATE AN EXISTING RECOMMENDATION
 ######################################################################
@@ -396,18 +626,77 @@ def like_recommendation(id):
       404:
         description: Recommendation not found
     """
-    recommendation = Recommendation.find(id)
+    recommendation = Recommendation.like(id)
     if not recommendation:
         message = {'error': 'Recommendation with product_id: %s was not found' % str(id)}
         return_code = HTTP_404_NOT_FOUND
     else:
-        recommendation.likes += 1
-        recommendation.save()
         message = recommendation.serialize()
         return_code = HTTP_200_OK
 
     return jsonify(message), return_code
 
+######################################################################
+# RECORD CACHE STATISTICS
+######################################################################
+
+@app.route('/recommendations/cache', methods=['GET'])
+def cache_statistics():
+    """ Retrieves the hit and miss counters of the record cache of this worker
+    ---
+    tags:
+      - Recommendations
+    responses:
+      200:
+        description: The cache counters, or enabled false when there is no cache
+    """
+    stats = Recommendation.cache_stats()
+    if stats is None:
+        return jsonify(enabled=False), HTTP_200_OK
+    return jsonify(enabled=True, **stats), HTTP_200_OK
+
+######################################################################
+# REDIS CONNECTION POOL STATISTICS
+######################################################################
+
+@app.route('/recommendations/pool', methods=['GET'])
+def pool_statistics():
+    """ Retrieves the connection counts of the Redis pool of this worker
+    ---
+    tags:
+      - Recommendations
+    responses:
+      200:
+        description: The pool counters, or enabled false when Redis is not used
+    """
+    stats = Recommendation.pool_stats()
+    if stats is None:
+        return jsonify(enabled=False), HTTP_200_OK
+    return jsonify(enabled=True, **stats), HTTP_200_OK
+
+######################################################################
+# METRICS
+######################################################################
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """ Retrieves the metrics of this worker in the Prometheus text format
+    ---
+    tags:
+      - Metrics
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: The request, Redis, query, cache and pool metrics
+      404:
+        description: Metrics are disabled
+    """
+    if not app.config['METRICS_ENABLED']:
+        return jsonify(error='Metrics are disabled'), HTTP_404_NOT_FOUND
+    return Response(metrics.REGISTRY.render(), status=HTTP_200_OK,
+                    content_type=metrics.CONTENT_TYPE)
+
 ######################################################################
 # DELETE ALL RECOMMENDATIONS DATA (for testing only)
 ######################################################################
@@ -423,10 +712,207 @@ def recommendations_reset():
 ######################################################################
 
 
+def encode_cursor(position):
+    """ Makes the opaque cursor of the page that follows a recommendation id
+
+    The pages of a likes range follow a (likes, id) position instead.
+    """
+    if isinstance(position, tuple):
+        return base64.urlsafe_b64encode('likes:%d:%d' % position).rstrip('=')
+    return base64.urlsafe_b64encode('id:%d' % position).rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ Returns the recommendation id or the (likes, id) position that a page cursor follows """
+    try:
+        fields = base64.urlsafe_b64decode(str(cursor) + '=' * (-len(cursor) % 4)).split(':')
+        if fields[0] == 'id' and len(fields) == 2:
+            return int(fields[1])
+        if fields[0] == 'likes' and len(fields) == 3:
+            return int(fields[1]), int(fields[2])
+    except (TypeError, ValueError):
+        pass
+    raise DataValidationError('Invalid cursor: %s' % cursor)
+
+
+def get_many(filters, limit, version=None):
+    """ Returns the JSON object of the recommendations of the ids or product_ids of the query string """
+    if filters or request.args.get('cursor') or stream_requested():
+        raise DataValidationError('ids and product_ids can not be combined with '
+                                  'filters, cursors or streams')
+    if 'ids' in request.args:
+        ids = get_id_list('ids')
+        rows = Recommendation.find_many(ids, serialized='json')
+        return '{%s}' % ','.join('"%d":%s' % (id, rows.get(id, 'null')) for id in ids)
+    product_ids = get_id_list('product_ids')
+    groups = Recommendation.find_by_product_ids(product_ids, limit, serialized='json',
+                                                version=version)
+    return '{%s}' % ','.join('"%d":[%s]' % (product_id, ','.join(groups[product_id]))
+                             for product_id in product_ids)
+
+
+def json_response(text):
+    """ Makes a 200 response of JSON text that is already encoded """
+    return Response(text, status=HTTP_200_OK, mimetype='application/json')
+
+
+def get_id_list(name):
+    """ Returns the distinct comma separated integers of a query string argument, in order """
+    try:
+        ids = [int(id) for id in request.args.get(name).split(',') if id.strip()]
+    except ValueError:
+        raise DataValidationError('%s must be comma separated integers' % name)
+    if not ids:
+        raise DataValidationError('%s must have at least one id' % name)
+    if len(ids) > app.config['MAX_MULTI_GET']:
+        raise DataValidationError('%s can have at most %d ids' % (name, app.config['MAX_MULTI_GET']))
+    return list(OrderedDict.fromkeys(ids))
+
+
+def get_query_filters():
+    """ Returns the filters of the query string that recommendations have to match """
+    filters = {}
+    for name in ('product_id', 'recommended_product_id'):
+        value = request.args.get(name)
+        if value:
+            filters[name] = int(value)
+    recommendation_type = request.args.get('recommendation_type')
+    if recommendation_type:
+        filters['recommendation_type'] = recommendation_type
+    min_likes, max_likes = get_likes_range(request.args.get('min_likes'),
+                                           request.args.get('max_likes'))
+    if min_likes is not None:
+        filters['min_likes'] = min_likes
+    if max_likes is not None:
+        filters['max_likes'] = max_likes
+    return filters
+
+
+def describe_filters(filters):
+    """ Describes query filters for an error message """
+    return ', '.join('%s: %s' % (name, filters[name]) for name in
+                     ('product_id', 'recommended_product_id', 'recommendation_type',
+                      'min_likes', 'max_likes') if name in filters)
+
+
+def get_likes_range(min_likes, max_likes):
+    """ Converts the likes range of the query string to integers or None """
+    try:
+        min_likes = int(min_likes) if min_likes else None
+        max_likes = int(max_likes) if max_likes else None
+    except ValueError:
+        raise DataValidationError('min_likes and max_likes must be integers')
+    return min_likes, max_likes
+
+
+def stream_requested():
+    """ Tells if the client asked for a newline delimited JSON stream """
+    return (request.args.get('stream') in ('1', 'true', 'True') or
+            request.accept_mimetypes.best == NDJSON)
+
+
+def generate_ndjson(find_page, after=0):
+    """
+    Yields every recommendation of a query as a line of JSON
+
+    The query is fetched a page at a time so memory use stays the same no
+    matter how many recommendations match.
+
+    Args:
+        find_page (function): returns the page of recommendations after a position
+                              as canonical JSON text and the position the next
+                              page starts after, or None after the last page
+        after: the id, or the (likes, id) position of a likes range, to start after
+    """
+    batch_size = Recommendation.scan_batch_size
+    while after is not None:
+        page, after = find_page(after, batch_size)
+        for recommendation in page:
+            yield recommendation + '\n'
+
+
+def make_etag(version):
+    """
+    Makes the strong ETag of the response to this request
+
+    The ETag only depends on the version of the data and on the request, so
+    it is known before any recommendation is fetched.
+    """
+    return hashlib.sha1('%s %s %s' % (version, request.full_path,
+                                      stream_requested())).hexdigest()
+
+
+def not_modified(etag):
+    """ Tells the client that its copy with the ETag is still current """
+    response = make_response('', HTTP_304_NOT_MODIFIED)
+    response.set_etag(etag)
+    return response
+
+
+def get_page_args():
+    """ Returns the id to page after and the page size from the query string """
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit')
+    after = decode_cursor(cursor) if cursor else 0
+    if limit is None:
+        return after, None
+    if not limit.isdigit() or int(limit) < 1:
+        raise DataValidationError('limit must be a positive integer')
+    if int(limit) > app.config['MAX_PAGE_SIZE']:
+        raise DataValidationError('limit can be at most %d' % app.config['MAX_PAGE_SIZE'])
+    return after, int(limit)
+
+
+
 @app.before_first_request
 def init_db(redis=None):
     """ Initlaize the model """
-    Recommendation.init_db(redis)
+    Recommendation.init_db(redis, app.config['STORAGE_ENGINE'], app.config['REDIS_OPTIONS'],
+                           app.config['RECORD_FORMAT'])
+    if app.config['LIKES_BUFFERED']:
+        Recommendation.start_like_buffer(app.config['LIKES_FLUSH_INTERVAL'],
+                                         app.config['LIKES_FLUSH_THRESHOLD'])
+    if app.config['CACHE_ENABLED']:
+        Recommendation.enable_cache(app.config['CACHE_SIZE'], app.config['CACHE_TTL'])
+    if app.config['REQUEST_TRACING']:
+        tracing.watch_redis(Recommendation.redis)
+    if app.config['METRICS_ENABLED']:
+        metrics.watch_redis(Recommendation.redis)
+        metrics.REGISTRY.register(collect_model_metrics)
+
+
+def collect_model_metrics():
+    """ Reads the record cache and Redis pool statistics when the metrics are scraped """
+    collected = []
+    cache = Recommendation.cache_stats()
+    if cache is not None:
+        for key, documentation in (('hits', 'Reads served by the record cache'),
+                                   ('misses', 'Reads the record cache could not serve'),
+                                   ('evictions', 'Entries evicted from the record cache')):
+            counter = metrics.Counter('recommendation_cache_%s_total' % key, documentation)
+            counter.inc((), cache[key])
+            collected.append(counter)
+        for key, documentation in (('size', 'Entries in the record cache'),
+                                   ('hit_ratio', 'Share of the reads served by the record cache')):
+            gauge = metrics.Gauge('recommendation_cache_' + key, documentation)
+            gauge.set(cache[key])
+            collected.append(gauge)
+    pool = Recommendation.pool_stats()
+    if pool is not None:
+        connections = metrics.Gauge('redis_pool_connections', 'Connections of the Redis pool',
+                                    ('state',))
+        connections.set(pool['idle'], ('idle',))
+        connections.set(pool['in_use'], ('in_use',))
+        limit = metrics.Gauge('redis_pool_max_connections', 'Most connections of the Redis pool')
+        limit.set(pool['max_connections'])
+        collected.extend([connections, limit])
+        for key, documentation in (('retried', 'Redis commands retried after an error'),
+                                   ('failed', 'Redis commands that failed after their retries')):
+            if key in pool:
+                counter = metrics.Counter('redis_commands_%s_total' % key, documentation)
+                counter.inc((), pool[key])
+                collected.append(counter)
+    return collected
 
 
 def initialize_logging(log_level=logging.INFO):
@@ -0,0 +1,884 @@
+"""
+Storage engines for recommendation micro service.
+
+The Recommendation model keeps its data in a storage engine. Engines work
+on serialized recommendations (the dictionaries made by serialize()) so
+they don't depend on the model.
+
+Engines
+-------
+StorageEngine - the interface that every engine implements
+RedisEngine - keeps the recommendations in Redis
+MemoryEngine - keeps the recommendations in the memory of this process
+
+"""
+
+import uuid
+import bisect
+import heapq
+import threading
+from app import codec
+
+# Attributes that can be queried through an index instead of a full scan
+INDEXES = ('product_id', 'recommended_product_id', 'recommendation_type')
+
+# Sets the id sequence in KEYS[1] to ARGV[1] unless it is already past it
+ADVANCE_INDEX_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[1]) or '0') < tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+"""
+
+# Prefix of the sorted sets that rank the ids of a product_id by likes
+TOP_PREFIX = 'idx:top:'
+
+# Sorted set that orders all of the ids by likes
+LIKES_KEY = 'idx:likes'
+
+# Sorted set of all of the ids, used to page through every record
+ALL_KEY = 'idx:all'
+
+# Prefix of the version counters of records and of products
+VERSION_PREFIX = 'ver:'
+PRODUCT_VERSION_PREFIX = 'ver:product:'
+
+# Version counter of all of the records
+ALL_VERSION_KEY = 'ver:all'
+
+# Random token that changes when the data store is emptied, so the version
+# counters that start over never repeat an earlier version
+EPOCH_KEY = 'ver:epoch'
+
+# Adds ARGV[1] to the likes of the packed or canonical JSON record in KEYS[1],
+# moves it in the likes orderings, bumps its versions and returns the updated
+# record. Returns nil for a missing record and 0 for a record that is still
+# pickled, which has to be re-encoded before it can be updated. The likes and
+# product_id of a JSON record are found at the start of its canonical text.
+# Lua numbers are doubles, which can't hold every 64 bit integer, so the
+# integers are kept as their high and low 32 bits and only leave the script
+# as decimal text.
+INCR_LIKES_SCRIPT = """
+local WORD = 4294967296
+local function negate(high, low)
+    if low == 0 then
+        return (WORD - high) %% WORD, 0
+    end
+    return WORD - 1 - high, WORD - low
+end
+local function parse(text)
+    local high, low = 0, 0
+    for digit in string.gmatch(text, '%%d') do
+        low = low * 10 + tonumber(digit)
+        high = (high * 10 + math.floor(low / WORD)) %% WORD
+        low = low %% WORD
+    end
+    if string.sub(text, 1, 1) == '-' then
+        return negate(high, low)
+    end
+    return high, low
+end
+local function add(high, low, other_high, other_low)
+    low = low + other_low
+    return (high + other_high + math.floor(low / WORD)) %% WORD, low %% WORD
+end
+local function format(high, low)
+    local sign = ''
+    if high >= WORD / 2 then
+        sign = '-'
+        high, low = negate(high, low)
+    end
+    local digits = ''
+    repeat
+        local part = (high %% 10) * WORD + low
+        high = math.floor(high / 10)
+        low = math.floor(part / 10)
+        digits = string.format('%%d', part %% 10) .. digits
+    until high == 0 and low == 0
+    return sign .. digits
+end
+local function read(value, offset)
+    return (struct.unpack('<I4', value, offset + 5)), (struct.unpack('<I4', value, offset + 1))
+end
+
+local value = redis.call('GET', KEYS[1])
+if not value then
+    return false
+end
+local product_id, likes
+local amount_high, amount_low = parse(ARGV[1])
+if string.byte(value, 1) == %(version)d then
+    product_id = format(read(value, %(product_offset)d))
+    local high, low = read(value, %(likes_offset)d)
+    high, low = add(high, low, amount_high, amount_low)
+    likes = format(high, low)
+    local packed = struct.pack('<I4I4', low, high)
+    redis.call('SETRANGE', KEYS[1], %(likes_offset)d, packed)
+    value = string.sub(value, 1, %(likes_offset)d) .. packed .. string.sub(value, %(likes_offset)d + 9)
+else
+    local head, old
+    head, old, product_id = string.match(value, '^(%(json_prefix)s%%-?%%d+,"likes":)(%%-?%%d+),"product_id":(%%-?%%d+)')
+    if not head then
+        return 0
+    end
+    likes = format(add(amount_high, amount_low, parse(old)))
+    value = head .. likes .. string.sub(value, #head + #old + 1)
+    redis.call('SET', KEYS[1], value)
+end
+redis.call('ZADD', '%(top_prefix)s' .. product_id, likes, KEYS[1])
+redis.call('ZADD', '%(likes_key)s', likes, KEYS[1])
+redis.call('INCR', '%(version_prefix)s' .. KEYS[1])
+redis.call('INCR', '%(product_version_prefix)s' .. product_id)
+redis.call('INCR', '%(all_version_key)s')
+return value
+""" % {'version': codec.VERSION, 'product_offset': codec.PRODUCT_ID_OFFSET,
+       'likes_offset': codec.LIKES_OFFSET, 'json_prefix': codec.JSON_PREFIX,
+       'top_prefix': TOP_PREFIX,
+       'likes_key': LIKES_KEY, 'version_prefix': VERSION_PREFIX,
+       'product_version_prefix': PRODUCT_VERSION_PREFIX, 'all_version_key': ALL_VERSION_KEY}
+
+
+# Returns the ids and likes of the entries of the likes ordering in KEYS[1]
+# with likes from ARGV[1] to ARGV[2], at most ARGV[3] of them or all when it
+# is negative, that come after the position of ARGV[4] likes and the id
+# ARGV[5] when they are given. Redis orders the entries that have the same
+# likes by the bytes of their ids, so the position is found by a binary search
+# of those entries in the same order.
+FIND_POSITIONS_SCRIPT = """
+local function precedes(a, b)
+    for i = 1, math.min(#a, #b) do
+        local x, y = string.byte(a, i), string.byte(b, i)
+        if x ~= y then
+            return x < y
+        end
+    end
+    return #a < #b
+end
+local start = redis.call('ZCOUNT', KEYS[1], '-inf', '(' .. ARGV[1])
+local stop = redis.call('ZCOUNT', KEYS[1], '-inf', ARGV[2]) - 1
+if ARGV[5] then
+    local low = redis.call('ZCOUNT', KEYS[1], '-inf', '(' .. ARGV[4])
+    local high = low + redis.call('ZCOUNT', KEYS[1], ARGV[4], ARGV[4])
+    while low < high do
+        local middle = math.floor((low + high) / 2)
+        if precedes(ARGV[5], redis.call('ZRANGE', KEYS[1], middle, middle)[1]) then
+            high = middle
+        else
+            low = middle + 1
+        end
+    end
+    start = math.max(start, low)
+end
+if tonumber(ARGV[3]) >= 0 then
+    stop = math.min(stop, start + tonumber(ARGV[3]) - 1)
+end
+if stop < start then
+    return {}
+end
+return redis.call('ZRANGE', KEYS[1], start, stop, 'WITHSCORES')
+"""
+
+
+class StorageEngine(object):
+    """
+    Interface of a data store for Recommendations
+
+    Records are dictionaries with the same fields as Recommendation.serialize()
+    The read methods that take encoded return the canonical JSON text of the
+    records (see app.codec) instead when it is True.
+    """
+
+    def ping(self):
+        """ Tests that the data store can be reached """
+        raise NotImplementedError
+
+    def next_index(self):
+        """ Generates the next id in a continual sequence """
+        raise NotImplementedError
+
+    def next_indexes(self, count):
+        """ Reserves a block of count ids and returns the first one """
+        raise NotImplementedError
+
+    def advance_index(self, id):
+        """ Moves the id sequence forward so it never generates the given id """
+        raise NotImplementedError
+
+    def save(self, data):
+        """ Saves a record and updates its index entries """
+        raise NotImplementedError
+
+    def save_many(self, records):
+        """ Saves a list of records and their index entries all at once """
+        raise NotImplementedError
+
+    def delete(self, id):
+        """ Removes a record and its index entries """
+        raise NotImplementedError
+
+    def get(self, id, encoded=False):
+        """ Returns the record with the given id or None """
+        raise NotImplementedError
+
+    def find_all(self, after=0, limit=None, encoded=False):
+        """ Returns the records with an id after the given one, ordered by id
+
+        At most limit records are returned, or all of them when limit is None.
+        """
+        raise NotImplementedError
+
+    def find_by(self, attribute, value, after=0, limit=None, encoded=False):
+        """ Returns the records with an indexed attribute value, ordered by id """
+        raise NotImplementedError
+
+    def find_top(self, product_id, count, encoded=False):
+        """ Returns up to count records of a product_id with the most likes first """
+        raise NotImplementedError
+
+    def find_by_likes(self, min_likes, max_likes, after=None, limit=None, encoded=False):
+        """ Returns the records with likes in a range, ordered by likes and then by id
+
+        A bound of None leaves that end of the range open. The records start
+        after the (likes, id) position given by after, or at the start of the
+        range when it is None.
+        """
+        raise NotImplementedError
+
+    def count(self, predicates):
+        """ Returns the number of records that match each predicate in one round trip
+
+        A predicate is an (attribute, value) pair of an indexed attribute or
+        ('likes', (min_likes, max_likes)) for a likes range.
+        """
+        raise NotImplementedError
+
+    def find_ids(self, predicate, after=0, limit=None, until=None):
+        """ Returns the ids after the given one that match a predicate, in order
+
+        A predicate of None matches all of the records. Only the ids up to
+        until are returned when it is given.
+        """
+        raise NotImplementedError
+
+    def find_positions(self, likes_range, after=None, limit=None):
+        """ Returns the (likes, id) positions of the records with likes in a range
+
+        The positions are ordered by likes and then by id, in the order the
+        engine keeps the ids that have the same likes, and start after the
+        given position, or at the start of the range when it is None.
+        """
+        raise NotImplementedError
+
+    def find_ids_many(self, predicates, limit=None):
+        """ Returns the ids that match each equality predicate, in order, in one round trip
+
+        At most limit ids are returned per predicate, or all of them when
+        limit is None.
+        """
+        raise NotImplementedError
+
+    def filter_ids(self, ids, predicate):
+        """ Returns the ids that match a predicate, keeping their order, in one round trip """
+        raise NotImplementedError
+
+    def get_many(self, ids, encoded=False):
+        """ Returns the records of a list of ids that exist, keeping their order """
+        raise NotImplementedError
+
+    def incr_likes(self, id, amount):
+        """ Atomically adds to the likes of a record and returns it or None """
+        raise NotImplementedError
+
+    def incr_likes_many(self, likes):
+        """ Adds to the likes of many records, given as a dict of id to amount """
+        raise NotImplementedError
+
+    def scan(self, batch_size):
+        """ Iterates over all of the records, fetching batch_size at a time """
+        raise NotImplementedError
+
+    def remove_all(self):
+        """ Removes all of the records, indexes and the id sequence """
+        raise NotImplementedError
+
+    def rebuild_indexes(self, batch_size):
+        """ Rebuilds the indexes and returns the number of records indexed """
+        raise NotImplementedError
+
+    def version(self, id=None, product_id=None):
+        """ Returns a token that changes whenever a record in a scope is written
+
+        The scope is the record with the id, the records of the product_id or
+        all of the records when neither is given.
+        """
+        raise NotImplementedError
+
+    def publish(self, channel, message):
+        """ Sends a message to the other processes that share the data store """
+        raise NotImplementedError
+
+    def subscribe(self, channel, handler):
+        """ Calls handler with every message published on a channel
+
+        Returns the listener thread, which has a stop() method, or None when
+        there is nothing to listen to.
+        """
+        raise NotImplementedError
+
+
+######################################################################
+# REDIS ENGINE
+######################################################################
+
+
+class RedisEngine(StorageEngine):
+    """
+    Keeps Recommendations in Redis
+
+    Each record is stored under its id in the packed or the JSON format of
+    app.codec and every indexed attribute value has a sorted set of the ids that have
+    it, scored by id. Every product_id also has a sorted set of its ids
+    scored by likes, one more sorted set orders all of the ids by likes and
+    the last one holds all of the ids for paging. Every write bumps the
+    version counters of the record, its product and all of the records.
+
+    Args:
+        redis (Redis): the client of the Redis server
+        record_format (str): the format records are written in, one of
+                             app.codec.FORMATS, records in the other format
+                             can still be read
+    """
+
+    def __init__(self, redis, record_format='packed'):
+        if record_format not in codec.FORMATS:
+            raise ValueError('Unknown record format: %s' % record_format)
+        self.redis = redis
+        self.record_format = record_format
+        self.__incr_likes = redis.register_script(INCR_LIKES_SCRIPT)
+        self.__advance_index = redis.register_script(ADVANCE_INDEX_SCRIPT)
+        self.__find_positions = redis.register_script(FIND_POSITIONS_SCRIPT)
+
+    def ping(self):
+        return self.redis.ping()
+
+    def next_index(self):
+        return self.redis.incr('index')
+
+    def next_indexes(self, count):
+        return self.redis.incrby('index', count) - count + 1
+
+    def advance_index(self, id):
+        self.__advance_index(keys=['index'], args=[id])
+
+    def save(self, data):
+        self.save_many([data])
+
+    def save_many(self, records):
+        ids = [data['id'] for data in records]
+
+        def update(pipe):
+            """ Swaps the records and their index entries in one transaction """
+            # The current record of every id, so a later copy of an id in the
+            # batch unindexes the earlier copy instead of the stored record
+            current = {}
+            for id, old in zip(ids, pipe.mget(ids)):
+                if old and id not in current:
+                    current[id] = codec.decode(old)
+            pipe.multi()
+            for data in records:
+                old = current.get(data['id'])
+                if old:
+                    self.__unindex(pipe, old)
+                    self.__touch(pipe, old)
+                pipe.set(data['id'], codec.encode(data, self.record_format))
+                self.__index(pipe, data)
+                self.__touch(pipe, data)
+                current[data['id']] = data
+
+        self.redis.transaction(update, *ids)
+
+    def delete(self, id):
+        def remove(pipe):
+            """ Removes the record and its index entries in one transaction """
+            old = pipe.get(id)
+            pipe.multi()
+            if old:
+                old = codec.decode(old)
+                self.__unindex(pipe, old)
+                self.__touch(pipe, old)
+            pipe.delete(id)
+
+        self.redis.transaction(remove, id)
+
+    def get(self, id, encoded=False):
+        data = self.redis.get(id)
+        if data:
+            return codec.as_json(data) if encoded else codec.decode(data)
+        return None
+
+    def find_all(self, after=0, limit=None, encoded=False):
+        return self.__mget(self.__page(ALL_KEY, after, limit), encoded)
+
+    def find_by(self, attribute, value, after=0, limit=None, encoded=False):
+        return self.__mget(self.__page(self.__index_key(attribute, value), after, limit), encoded)
+
+    def find_top(self, product_id, count, encoded=False):
+        return self.__mget(self.redis.zrevrange(TOP_PREFIX + str(product_id), 0, count - 1),
+                           encoded)
+
+    def find_by_likes(self, min_likes, max_likes, after=None, limit=None, encoded=False):
+        positions = self.find_positions((min_likes, max_likes), after, limit)
+        return self.__mget([id for likes, id in positions], encoded)
+
+    def count(self, predicates):
+        pipe = self.redis.pipeline(transaction=False)
+        for attribute, value in predicates:
+            if attribute == 'likes':
+                pipe.zcount(LIKES_KEY, *self.__likes_bounds(value))
+            else:
+                pipe.zcard(self.__index_key(attribute, value))
+        return pipe.execute()
+
+    def find_ids(self, predicate, after=0, limit=None, until=None):
+        if predicate is None:
+            return map(int, self.__page(ALL_KEY, after, limit, until=until))
+        attribute, value = predicate
+        if attribute == 'likes':
+            ids = self.redis.zrangebyscore(LIKES_KEY, *self.__likes_bounds(value))
+            return sorted(id for id in map(int, ids)
+                          if id > after and (until is None or id <= until))[:limit]
+        return map(int, self.__page(self.__index_key(attribute, value), after, limit, until=until))
+
+    def find_positions(self, likes_range, after=None, limit=None):
+        args = list(self.__likes_bounds(likes_range)) + [-1 if limit is None else limit]
+        if after is not None:
+            args.extend(after)
+        entries = self.__find_positions(keys=[LIKES_KEY], args=args)
+        return [(int(float(entries[i + 1])), int(entries[i])) for i in range(0, len(entries), 2)]
+
+    def find_ids_many(self, predicates, limit=None):
+        pipe = self.redis.pipeline(transaction=False)
+        for attribute, value in predicates:
+            self.__page(self.__index_key(attribute, value), 0, limit, pipe)
+        return [map(int, ids) for ids in pipe.execute()]
+
+    def filter_ids(self, ids, predicate):
+        attribute, value = predicate
+        key = LIKES_KEY if attribute == 'likes' else self.__index_key(attribute, value)
+        pipe = self.redis.pipeline(transaction=False)
+        for id in ids:
+            pipe.zscore(key, id)
+        if attribute == 'likes':
+            min_likes, max_likes = value
+            return [id for id, likes in zip(ids, pipe.execute())
+                    if likes is not None and (min_likes is None or likes >= min_likes)
+                    and (max_likes is None or likes <= max_likes)]
+        return [id for id, score in zip(ids, pipe.execute()) if score is not None]
+
+    def get_many(self, ids, encoded=False):
+        return self.__mget(ids, encoded)
+
+    def incr_likes(self, id, amount):
+        value = self.__incr_likes(keys=[id], args=[amount])
+        if value == 0:
+            # Re-encode a pickled record so the script can update it in place
+            self.save(codec.decode(self.redis.get(id)))
+            value = self.__incr_likes(keys=[id], args=[amount])
+        if value:
+            return codec.decode(value)
+        return None
+
+    def incr_likes_many(self, likes):
+        ids = list(likes)
+        pipe = self.redis.pipeline(transaction=False)
+        for id in ids:
+            self.__incr_likes(keys=[id], args=[likes[id]], client=pipe)
+        for id, value in zip(ids, pipe.execute()):
+            if value == 0:
+                self.incr_likes(id, likes[id])
+
+    def scan(self, batch_size):
+        for keys in self.__scan(batch_size):
+            for data in self.redis.mget(keys):
+                if data:
+                    yield codec.decode(data)
+
+    def remove_all(self):
+        self.redis.flushall()
+
+    def rebuild_indexes(self, batch_size):
+        stale = list(self.redis.scan_iter(match='idx:*'))
+        if stale:
+            self.redis.delete(*stale)
+        count = 0
+        for keys in self.__scan(batch_size):
+            pipe = self.redis.pipeline()
+            for data in self.redis.mget(keys):
+                if data:
+                    self.__index(pipe, codec.decode(data))
+                    count += 1
+            pipe.execute()
+        return count
+
+    def version(self, id=None, product_id=None):
+        if id is not None:
+            key = VERSION_PREFIX + str(id)
+        elif product_id is not None:
+            key = PRODUCT_VERSION_PREFIX + str(product_id)
+        else:
+            key = ALL_VERSION_KEY
+        epoch, counter = self.redis.mget(EPOCH_KEY, key)
+        if epoch is None:
+            self.redis.set(EPOCH_KEY, uuid.uuid4().hex, nx=True)
+            epoch = self.redis.get(EPOCH_KEY)
+        return '%s.%s' % (epoch, counter or 0)
+
+    def publish(self, channel, message):
+        self.redis.publish(channel, message)
+
+    def subscribe(self, channel, handler):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{channel: lambda message: handler(message['data'])})
+        return pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def __page(self, key, after, limit, client=None, until=None):
+        """ Returns the ids of an id index after the given id, up to limit and until """
+        client = client or self.redis
+        last = '+inf' if until is None else until
+        if limit is None:
+            return client.zrangebyscore(key, '(%d' % after, last)
+        return client.zrangebyscore(key, '(%d' % after, last, start=0, num=limit)
+
+    def __mget(self, ids, encoded=False):
+        """ Fetches and decodes the records of a list of ids with one MGET """
+        if not ids:
+            return []
+        decode = codec.as_json if encoded else codec.decode
+        return [decode(data) for data in self.redis.mget(ids) if data]
+
+    @staticmethod
+    def __likes_bounds(likes_range):
+        """ Returns the score bounds of a likes range, open ends included """
+        min_likes, max_likes = likes_range
+        return ('-inf' if min_likes is None else min_likes,
+                '+inf' if max_likes is None else max_likes)
+
+    @staticmethod
+    def __index_key(attribute, value):
+        """ Returns the key of the index for an attribute value """
+        return 'idx:%s:%s' % (attribute, value)
+
+    @staticmethod
+    def __index(pipe, data):
+        """ Adds the index entries of a record """
+        for attribute in INDEXES:
+            key = RedisEngine.__index_key(attribute, data[attribute])
+            pipe.zadd(key, {data['id']: data['id']})
+        pipe.zadd(TOP_PREFIX + str(data['product_id']), {data['id']: data['likes']})
+        pipe.zadd(LIKES_KEY, {data['id']: data['likes']})
+        pipe.zadd(ALL_KEY, {data['id']: data['id']})
+
+    @staticmethod
+    def __unindex(pipe, data):
+        """ Removes the index entries of a record """
+        for attribute in INDEXES:
+            key = RedisEngine.__index_key(attribute, data[attribute])
+            pipe.zrem(key, data['id'])
+        pipe.zrem(TOP_PREFIX + str(data['product_id']), data['id'])
+        pipe.zrem(LIKES_KEY, data['id'])
+        pipe.zrem(ALL_KEY, data['id'])
+
+    @staticmethod
+    def __touch(pipe, data):
+        """ Bumps the versions of a record, its product and all of the records """
+        pipe.incr(VERSION_PREFIX + str(data['id']))
+        pipe.incr(PRODUCT_VERSION_PREFIX + str(data['product_id']))
+        pipe.incr(ALL_VERSION_KEY)
+
+    @staticmethod
+    def __is_record(key):
+        """ Tells record keys apart from the index and counter keys """
+        return key.isdigit()
+
+    def __scan(self, batch_size):
+        """ Walks the record keys with SCAN, one batch at a time """
+        cursor = 0
+        while True:
+            cursor, keys = self.redis.scan(cursor, match='[0-9]*', count=batch_size)
+            keys = [key for key in keys if self.__is_record(key)]
+            if keys:
+                yield keys
+            if cursor == 0:
+                break
+
+
+######################################################################
+# MEMORY ENGINE
+######################################################################
+
+
+class MemoryEngine(StorageEngine):
+    """
+    Keeps Recommendations in the memory of this process
+
+    Records live in a dictionary keyed by id and every indexed attribute
+    value has a sorted list of the ids that have it. A sorted list of
+    (likes, id) pairs answers the likes range queries and a sorted list of
+    all of the ids is used for paging. Nothing is shared between
+    processes, so this suits tests, benchmarks and single node deployments.
+    Records are kept as dictionaries and only encoded when they are read
+    encoded.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.records = {}
+        self.indexes = {}
+        self.likes = []
+        self.ids = []
+        self.counter = 0
+        self.versions = {}
+        self.epoch = uuid.uuid4().hex
+
+    def ping(self):
+        return True
+
+    def next_index(self):
+        return self.next_indexes(1)
+
+    def next_indexes(self, count):
+        with self.lock:
+            self.counter += count
+            return self.counter - count + 1
+
+    def advance_index(self, id):
+        with self.lock:
+            self.counter = max(self.counter, id)
+
+    def save(self, data):
+        with self.lock:
+            old = self.records.get(data['id'])
+            if old:
+                self.__unindex(old)
+                self.__touch(old)
+            self.records[data['id']] = dict(data)
+            self.__index(data)
+            self.__touch(data)
+
+    def save_many(self, records):
+        with self.lock:
+            for data in records:
+                self.save(data)
+
+    def delete(self, id):
+        with self.lock:
+            old = self.records.pop(int(id), None)
+            if old:
+                self.__unindex(old)
+                self.__touch(old)
+
+    def get(self, id, encoded=False):
+        data = self.records.get(int(id))
+        if data:
+            return codec.to_json(data) if encoded else dict(data)
+        return None
+
+    def find_all(self, after=0, limit=None, encoded=False):
+        with self.lock:
+            start = bisect.bisect_right(self.ids, after)
+            end = None if limit is None else start + limit
+            return self.get_many(self.ids[start:end], encoded)
+
+    def find_by(self, attribute, value, after=0, limit=None, encoded=False):
+        with self.lock:
+            return self.get_many(self.find_ids((attribute, value), after, limit), encoded)
+
+    def find_top(self, product_id, count, encoded=False):
+        with self.lock:
+            ids = self.indexes.get(('product_id', product_id), ())
+            top = heapq.nlargest(count, ids, key=lambda id: self.records[id]['likes'])
+            return self.get_many(top, encoded)
+
+    def find_by_likes(self, min_likes, max_likes, after=None, limit=None, encoded=False):
+        with self.lock:
+            positions = self.find_positions((min_likes, max_likes), after, limit)
+            return self.get_many([id for likes, id in positions], encoded)
+
+    def count(self, predicates):
+        with self.lock:
+            counts = []
+            for attribute, value in predicates:
+                if attribute == 'likes':
+                    start, end = self.__likes_slice(value)
+                    counts.append(max(end - start, 0))
+                else:
+                    counts.append(len(self.indexes.get((attribute, value), ())))
+            return counts
+
+    def find_ids(self, predicate, after=0, limit=None, until=None):
+        with self.lock:
+            if predicate is None:
+                ids = self.ids
+            elif predicate[0] == 'likes':
+                start, end = self.__likes_slice(predicate[1])
+                return sorted(id for likes, id in self.likes[start:end]
+                              if id > after and (until is None or id <= until))[:limit]
+            else:
+                attribute, value = predicate
+                ids = self.indexes.get((attribute, value), [])
+            start = bisect.bisect_right(ids, after)
+            end = len(ids) if until is None else bisect.bisect_right(ids, until)
+            if limit is not None:
+                end = min(end, start + limit)
+            return ids[start:end]
+
+    def find_positions(self, likes_range, after=None, limit=None):
+        with self.lock:
+            start, end = self.__likes_slice(likes_range)
+            if after is not None:
+                start = max(start, bisect.bisect_right(self.likes, tuple(after)))
+            if limit is not None:
+                end = min(end, start + limit)
+            return self.likes[start:end]
+
+    def find_ids_many(self, predicates, limit=None):
+        with self.lock:
+            return [self.find_ids(predicate, 0, limit) for predicate in predicates]
+
+    def filter_ids(self, ids, predicate):
+        attribute, value = predicate
+        with self.lock:
+            if attribute == 'likes':
+                min_likes, max_likes = value
+                return [id for id in ids if id in self.records
+                        and (min_likes is None or self.records[id]['likes'] >= min_likes)
+                        and (max_likes is None or self.records[id]['likes'] <= max_likes)]
+            matches = self.indexes.get((attribute, value), [])
+            return [id for id in ids if self.__contains(matches, id)]
+
+    def get_many(self, ids, encoded=False):
+        copy = codec.to_json if encoded else dict
+        with self.lock:
+            return [copy(self.records[id]) for id in ids if id in self.records]
+
+    def incr_likes(self, id, amount):
+        with self.lock:
+            data = self.records.get(int(id))
+            if data:
+                self.__unindex_likes(data)
+                data['likes'] += amount
+                self.__index_likes(data)
+                self.__touch(data)
+                return dict(data)
+            return None
+
+    def incr_likes_many(self, likes):
+        for id, amount in likes.items():
+            self.incr_likes(id, amount)
+
+    def scan(self, batch_size):
+        ids = list(self.records)
+        for start in range(0, len(ids), batch_size):
+            with self.lock:
+                batch = [self.records.get(id) for id in ids[start:start + batch_size]]
+            for data in batch:
+                if data:
+                    yield dict(data)
+
+    def remove_all(self):
+        with self.lock:
+            self.records.clear()
+            self.indexes.clear()
+            self.likes = []
+            self.ids = []
+            self.counter = 0
+            self.versions = {}
+            self.epoch = uuid.uuid4().hex
+
+    def rebuild_indexes(self, batch_size):
+        with self.lock:
+            self.indexes.clear()
+            self.likes = []
+            self.ids = []
+            for data in self.records.values():
+                self.__index(data)
+            return len(self.records)
+
+    def version(self, id=None, product_id=None):
+        if id is not None:
+            key = ('id', int(id))
+        elif product_id is not None:
+            key = ('product_id', product_id)
+        else:
+            key = 'all'
+        return '%s.%s' % (self.epoch, self.versions.get(key, 0))
+
+    def publish(self, channel, message):
+        # Nothing else shares this data store
+        pass
+
+    def subscribe(self, channel, handler):
+        return None
+
+    def __index(self, data):
+        """ Adds the index entries of a record """
+        for attribute in INDEXES:
+            bisect.insort(self.indexes.setdefault((attribute, data[attribute]), []), data['id'])
+        self.__index_likes(data)
+        bisect.insort(self.ids, data['id'])
+
+    def __unindex(self, data):
+        """ Removes the index entries of a record """
+        for attribute in INDEXES:
+            ids = self.indexes.get((attribute, data[attribute]))
+            if ids is not None:
+                self.__discard(ids, data['id'])
+                if not ids:
+                    del self.indexes[(attribute, data[attribute])]
+        self.__unindex_likes(data)
+        self.__discard(self.ids, data['id'])
+
+    @staticmethod
+    def __contains(ids, id):
+        """ Tells if a sorted list of ids has an id """
+        position = bisect.bisect_left(ids, id)
+        return position < len(ids) and ids[position] == id
+
+    @staticmethod
+    def __discard(ids, id):
+        """ Removes an id from a sorted list of ids if it is there """
+        position = bisect.bisect_left(ids, id)
+        if position < len(ids) and ids[position] == id:
+            del ids[position]
+
+    def __touch(self, data):
+        """ Bumps the versions of a record, its product and all of the records """
+        for key in (('id', data['id']), ('product_id', data['product_id']), 'all'):
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+    def __likes_slice(self, likes_range):
+        """ Returns the start and end of a likes range in the likes ordering """
+        min_likes, max_likes = likes_range
+        start = 0
+        if min_likes is not None:
+            start = bisect.bisect_left(self.likes, (min_likes,))
+        end = len(self.likes)
+        if max_likes is not None:
+            end = bisect.bisect_right(self.likes, (max_likes, float('inf')))
+        return start, end
+
+    def __index_likes(self, data):
+        """ Adds a record to the likes ordering """
+        bisect.insort(self.likes, (data['likes'], data['id']))
+
+    def __unindex_likes(self, data):
+        """ Removes a record from the likes ordering """
+        position = bisect.bisect_left(self.likes, (data['likes'], data['id']))
+        if position < len(self.likes) and self.likes[position] == (data['likes'], data['id']):
+            del self.likes[position]
+
+
+# Engines that can be selected by name
+ENGINES = {
+    'redis': RedisEngine,
+    'memory': MemoryEngine
+}
@@ -0,0 +1,167 @@
+"""
+Request tracing of the recommendation micro service.
+
+Adds up the Redis commands, the bytes they carried and the time spent in
+the model while a request is served, so the requests that make hundreds
+of round trips can be found. The service starts a trace before a request
+and finishes it when the request is done. The trace lives in a thread
+local, which the gevent server turns into a greenlet local when it
+patches threading.
+
+Traces
+------
+commands - the Redis commands sent
+round_trips - the Redis round trips, a pipeline is one
+bytes_sent - the bytes of the arguments of the commands
+bytes_received - the bytes of the strings and numbers in the replies
+redis_seconds - the seconds spent waiting on Redis
+model_seconds - the seconds spent in the outermost model calls
+calls - the first MAX_CALLS round trips as (command, commands, seconds)
+
+"""
+
+import re
+import time
+import functools
+import threading
+
+# Round trips of a request that are kept for the slow log
+MAX_CALLS = 200
+
+# Commands of a pipeline and characters of an argument that the slow log shows
+MAX_SENT = 10
+MAX_ARGUMENT = 60
+
+# Packed records are binary and are shown by their size
+BINARY = re.compile(u'[\x00-\x08\x0b-\x1f\x7f]')
+
+_local = threading.local()
+
+
+class Trace(object):
+    """ The Redis round trips and model time of one request """
+    __slots__ = ('started', 'status', 'commands', 'round_trips', 'bytes_sent', 'bytes_received',
+                 'redis_seconds', 'model_seconds', 'depth', 'calls')
+
+    def __init__(self):
+        self.started = time.time()
+        self.status = None
+        self.commands = 0
+        self.round_trips = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.redis_seconds = 0.0
+        self.model_seconds = 0.0
+        self.depth = 0
+        self.calls = []
+
+    def summary(self):
+        """ Returns the totals of the trace and the round trips it kept """
+        return {'seconds': round(time.time() - self.started, 6),
+                'redis_commands': self.commands,
+                'redis_round_trips': self.round_trips,
+                'redis_bytes_sent': self.bytes_sent,
+                'redis_bytes_received': self.bytes_received,
+                'redis_seconds': round(self.redis_seconds, 6),
+                'model_seconds': round(self.model_seconds, 6),
+                'commands': [describe_call(command, commands, seconds)
+                             for command, commands, seconds in self.calls],
+                'commands_dropped': self.round_trips - len(self.calls)}
+
+
+def start():
+    """ Starts the trace of the request this thread serves and returns it """
+    _local.trace = Trace()
+    return _local.trace
+
+
+def finish():
+    """ Ends the trace of the request this thread serves and returns it, or None """
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    return trace
+
+
+def current():
+    """ Returns the trace of the request this thread serves, or None """
+    return getattr(_local, 'trace', None)
+
+
+def payload_size(value):
+    """ Returns the bytes of the strings and numbers in Redis arguments or a reply """
+    if isinstance(value, basestring):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        try:
+            # Replies of many records are lists of strings, which join in C
+            return len(''.join(value))
+        except (TypeError, UnicodeDecodeError):
+            return sum(payload_size(item) for item in value)
+    if value is None:
+        return 0
+    return len(str(value))
+
+
+def observe_redis(command, commands, reply, seconds, failed):
+    """ Adds a Redis round trip to the trace of the request this thread serves """
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return
+    trace.commands += len(commands)
+    trace.round_trips += 1
+    trace.redis_seconds += seconds
+    trace.bytes_sent += payload_size(commands)
+    trace.bytes_received += payload_size(reply)
+    if len(trace.calls) < MAX_CALLS:
+        trace.calls.append((command, commands, seconds))
+
+
+def watch_redis(redis):
+    """ Traces the round trips of a Redis client that takes observers """
+    observers = getattr(redis, 'observers', None)
+    if observers is not None and observe_redis not in observers:
+        observers.append(observe_redis)
+
+
+def describe_argument(value):
+    """ Returns the text of an argument for the slow log, cut to MAX_ARGUMENT characters """
+    if isinstance(value, str):
+        try:
+            text = value.decode('utf-8')
+        except UnicodeDecodeError:
+            return u'<%d bytes>' % len(value)
+    else:
+        text = value if isinstance(value, unicode) else unicode(value)
+    if BINARY.search(text):
+        return u'<%d bytes>' % len(value)
+    return text if len(text) <= MAX_ARGUMENT else text[:MAX_ARGUMENT] + u'...'
+
+
+def describe_call(command, commands, seconds):
+    """ Describes a round trip for the slow log with the first arguments of its commands """
+    sent = []
+    for args in commands[:MAX_SENT]:
+        text = u' '.join(describe_argument(arg) for arg in args[:4])
+        if len(args) > 4:
+            text += u' ... (%d more)' % (len(args) - 4)
+        sent.append(text)
+    if len(commands) > MAX_SENT:
+        sent.append(u'... (%d more commands)' % (len(commands) - MAX_SENT))
+    return {'command': command, 'ms': round(seconds * 1000, 3), 'sent': sent}
+
+
+def timed(function):
+    """ Adds the time of the outermost model call to the trace of the request """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        trace = getattr(_local, 'trace', None)
+        if trace is None or trace.depth:
+            return function(*args, **kwargs)
+        trace.depth += 1
+        started = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            trace.depth -= 1
+            trace.model_seconds += time.time() - started
+    return wrapper
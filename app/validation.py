@@ -0,0 +1,84 @@
+"""
+Payload validation for recommendation micro service.
+
+A SchemaValidator checks documents against the subset of the Cerberus
+schema rules that the models use (type, required, min and max) and reports the same
+errors, with the same messages, as a Cerberus Validator of that schema.
+The schema is compiled once into a lookup of field rules, so validating a
+document is a single pass over its fields.
+
+"""
+
+# Python types and error names of the supported Cerberus types
+TYPES = {
+    'integer': (int, long),
+    'string': (basestring,),
+}
+
+
+class SchemaValidator(object):
+    """
+    Validates documents against a Cerberus style schema
+
+    Args:
+        schema (dict): field name to rules, where the rules can only be
+                       'type' (one of TYPES), 'required', 'min' and 'max'
+    """
+
+    def __init__(self, schema):
+        self.fields = {}
+        for field, rules in schema.items():
+            unknown = set(rules) - set(['type', 'required', 'min', 'max'])
+            if unknown or rules.get('type') not in TYPES:
+                raise ValueError('Unsupported rules for %s: %s' % (field, rules))
+            self.fields[field] = (TYPES[rules['type']], 'must be of %s type' % rules['type'],
+                                  rules.get('min'), rules.get('max'))
+        self.required = set(field for field, rules in schema.items() if rules.get('required') is True)
+
+    def validate(self, document):
+        """
+        Returns the errors of a document as a dictionary of field to messages
+
+        The dictionary is empty when the document is valid. Errors are added
+        in the same order as Cerberus adds them so both print the same.
+        """
+        found = []
+        for field in document:
+            value = document[field]
+            rule = self.fields.get(field)
+            if rule is None:
+                found.append((field, 'unknown field'))
+            elif value is None:
+                found.append((field, 'null value not allowed'))
+            elif not isinstance(value, rule[0]):
+                found.append((field, rule[1]))
+            elif rule[2] is not None and value < rule[2]:
+                found.append((field, 'min value is %s' % rule[2]))
+            elif rule[3] is not None and value > rule[3]:
+                found.append((field, 'max value is %s' % rule[3]))
+        for field in self.required - set(document):
+            found.append((field, 'required field'))
+        errors = {}
+        if len(found) > 1:
+            found.sort(cmp=compare_fields)
+        for field, message in found:
+            errors[field] = [message]
+        # Cerberus returns a copy of its errors, which can change the key order
+        return dict(errors.iteritems())
+
+
+def compare_fields(x, y):
+    """
+    Orders errors by field the way Cerberus sorts them
+
+    Integer fields come first, fields of the same type are compared and
+    fields of other types are left in the order they were found in.
+    """
+    x, y = x[0], y[0]
+    if isinstance(x, type(y)):
+        return cmp(x, y)
+    if isinstance(x, (int, long)):
+        return -1
+    if isinstance(y, (int, long)):
+        return 1
+    return 0
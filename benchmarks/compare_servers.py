@@ -0,0 +1,153 @@
+"""
+Throughput comparison of the Flask and gevent serving modes
+
+Starts run.py once with SERVER=flask and once with SERVER=gevent, loads the
+same recommendations into each and sends the same mix of id lookups and
+product_id queries from many concurrent clients. Prints the requests per
+second, latency percentiles and errors of each mode side by side.
+
+Needs Redis running on localhost, like the service itself.
+
+Usage:
+  python benchmarks/compare_servers.py --requests 5000 --concurrency 200
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import random
+import argparse
+import httplib
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(mode, port):
+    """ Starts run.py in a serving mode and waits until it answers """
+    env = dict(os.environ, SERVER=mode, PORT=str(port))
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen([sys.executable, 'run.py'], cwd=ROOT, env=env,
+                                   stdout=devnull, stderr=devnull)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return process
+        except socket.error:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('%s server did not start on port %d' % (mode, port))
+
+
+def load_data(port, products, per_product):
+    """ Replaces the recommendations with per_product for every product """
+    connection = httplib.HTTPConnection('127.0.0.1', port)
+    connection.request('DELETE', '/recommendations/reset')
+    connection.getresponse().read()
+    batch = [{'product_id': product_id, 'recommended_product_id': offset,
+              'recommendation_type': 'accessory', 'likes': 0}
+             for product_id in range(1, products + 1) for offset in range(per_product)]
+    connection.request('POST', '/recommendations/batch', json.dumps(batch),
+                       {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    if response.status != 201:
+        raise RuntimeError('Could not load the recommendations: %d' % response.status)
+    return len(batch)
+
+
+def run_clients(port, paths, concurrency):
+    """ Sends every path from concurrent keep-alive clients and times each request """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    queue = list(reversed(paths))
+
+    def client():
+        connection = httplib.HTTPConnection('127.0.0.1', port, timeout=30)
+        while True:
+            with lock:
+                if not queue:
+                    break
+                path = queue.pop()
+            started = time.time()
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                failed = response.status >= 500
+            except (socket.error, httplib.HTTPException):
+                connection.close()
+                connection = httplib.HTTPConnection('127.0.0.1', port, timeout=30)
+                failed = True
+            elapsed = time.time() - started
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += failed
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - started, sorted(latencies), errors[0]
+
+
+def percentile(latencies, fraction):
+    """ Returns the latency below which a fraction of the requests finished, in ms """
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the Flask and gevent serving modes')
+    parser.add_argument('--requests', type=int, default=2000, help='requests sent to each mode')
+    parser.add_argument('--concurrency', type=int, default=100, help='concurrent clients')
+    parser.add_argument('--products', type=int, default=100, help='products to load')
+    parser.add_argument('--per-product', type=int, default=10,
+                        help='recommendations loaded per product')
+    parser.add_argument('--port', type=int, default=8890, help='first port to serve on')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    random.seed(0)
+    count = args.products * args.per_product
+    paths = [random.choice(('/recommendations?product_id=%d' % random.randint(1, args.products),
+                            '/recommendations/%d' % random.randint(1, count)))
+             for _ in range(args.requests)]
+
+    results = []
+    for offset, mode in enumerate(('flask', 'gevent')):
+        port = args.port + offset
+        server = start_server(mode, port)
+        try:
+            load_data(port, args.products, args.per_product)
+            elapsed, latencies, errors = run_clients(port, paths, args.concurrency)
+        finally:
+            server.terminate()
+            server.wait()
+        results.append({'mode': mode, 'requests': len(latencies), 'errors': errors,
+                        'seconds': round(elapsed, 3),
+                        'requests_per_second': round(len(latencies) / elapsed, 1),
+                        'p50_ms': round(percentile(latencies, 0.5), 2),
+                        'p99_ms': round(percentile(latencies, 0.99), 2)})
+
+    if args.json:
+        print json.dumps(results, indent=2)
+    else:
+        print '%-8s %10s %8s %10s %10s %8s' % ('mode', 'requests', 'req/s', 'p50 ms', 'p99 ms', 'errors')
+        for result in results:
+            print '%-8s %10d %8.1f %10.2f %10.2f %8d' % (
+                result['mode'], result['requests'], result['requests_per_second'],
+                result['p50_ms'], result['p99_ms'], result['errors'])
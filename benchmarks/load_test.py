@@ -0,0 +1,298 @@
+"""
+Load test of the recommendation service routes
+
+Sends a configurable mix of list, filter, get, create, update, like and
+delete requests from concurrent clients and prints the throughput, the
+latency percentiles and the error rate of every route. Product popularity
+and record popularity follow a Zipf distribution, so a few products and
+records get most of the traffic like they do in production.
+
+By default the requests go through the WSGI test client of the app in
+this process, which needs no server and measures the cost of the service
+itself. Give --url to load a running server instead, for example one
+started with run.py. Either way the recommendations are reset and seeded
+first, so do not point it at a service with data you want to keep.
+
+Usage:
+  python benchmarks/load_test.py --requests 5000 --engine memory
+  python benchmarks/load_test.py --url http://127.0.0.1:8888 --concurrency 50 --duration 60
+  python benchmarks/load_test.py --mix list=1,filter=6,get=6,like=2 --json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import httplib
+import urlparse
+import argparse
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from model_scaling import Zipf, draw_type
+
+# Share of the requests that each route gets unless --mix says otherwise
+DEFAULT_MIX = 'list=5,filter=35,get=30,create=5,update=5,like=15,delete=5'
+
+ROUTES = ('list', 'filter', 'get', 'create', 'update', 'like', 'delete')
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class WsgiClient(object):
+    """ Sends requests to the app in this process through its test client """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        """ Returns the status and the body of the response """
+        response = self.client.open(path, method=method, data=body, headers=JSON_HEADERS)
+        return response.status_code, response.data
+
+    def close(self):
+        pass
+
+
+class HttpClient(object):
+    """ Sends requests to a running server over a keep-alive connection """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.connection = httplib.HTTPConnection(host, port, timeout=30)
+
+    def request(self, method, path, body=None):
+        """ Returns the status and the body of the response, or None for both on failure """
+        try:
+            self.connection.request(method, path, body, JSON_HEADERS)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (socket.error, httplib.HTTPException):
+            self.connection.close()
+            self.connection = httplib.HTTPConnection(self.host, self.port, timeout=30)
+            return None, None
+
+    def close(self):
+        self.connection.close()
+
+
+class Workload(object):
+    """
+    Makes the requests of the mix and keeps track of the ids that exist
+
+    Args:
+        mix (dict): route name to its weight
+        products (int): the number of products to recommend for
+        ids (list): the ids of the seeded recommendations
+        seed (int): the seed of the random choices
+    """
+
+    def __init__(self, mix, products, ids, seed):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.routes = [route for route in ROUTES if mix.get(route)]
+        self.cumulative = []
+        total = 0
+        for route in self.routes:
+            total += mix[route]
+            self.cumulative.append(total)
+        self.products = products
+        self.product_popularity = Zipf(products, 1.1, self.rng)
+        self.record_popularity = Zipf(max(1, len(ids)), 1.1, self.rng)
+        self.ids = list(ids)
+
+    def next_request(self):
+        """ Returns the route, method, path and body of a random request """
+        with self.lock:
+            point = self.rng.random() * self.cumulative[-1]
+            route = next(route for route, bound in zip(self.routes, self.cumulative) if point < bound)
+            product_id = self.product_popularity.draw()
+            id = self.ids[(self.record_popularity.draw() - 1) % len(self.ids)] if self.ids else 1
+            if route == 'delete' and len(self.ids) > 1:
+                self.ids.remove(id)
+            body = json.dumps({'product_id': product_id,
+                               'recommended_product_id': self.rng.randint(1, self.products),
+                               'recommendation_type': draw_type(self.rng),
+                               'likes': 0})
+            recommendation_type = draw_type(self.rng)
+        if route == 'list':
+            return route, 'GET', '/recommendations?limit=50', None
+        if route == 'filter':
+            if product_id % 2:
+                return route, 'GET', '/recommendations?product_id=%d' % product_id, None
+            return route, 'GET', '/recommendations?product_id=%d&recommendation_type=%s' % (
+                product_id, recommendation_type), None
+        if route == 'get':
+            return route, 'GET', '/recommendations/%d' % id, None
+        if route == 'create':
+            return route, 'POST', '/recommendations', body
+        if route == 'update':
+            return route, 'PUT', '/recommendations/%d' % id, body
+        if route == 'like':
+            return route, 'PUT', '/recommendations/%d/likes' % id, None
+        return route, 'DELETE', '/recommendations/%d' % id, None
+
+    def created(self, data):
+        """ Adds the id of a created recommendation to the ones that exist """
+        with self.lock:
+            self.ids.append(json.loads(data)['id'])
+
+
+def seed_data(client, products, per_product, seed):
+    """ Replaces the recommendations with per_product for every product and returns their ids """
+    rng = random.Random(seed)
+    status, data = client.request('DELETE', '/recommendations/reset')
+    if status != 204:
+        raise RuntimeError('Could not reset the recommendations: %s' % status)
+    batch = [{'product_id': product_id, 'recommended_product_id': rng.randint(1, products),
+              'recommendation_type': draw_type(rng), 'likes': 0}
+             for product_id in range(1, products + 1) for _ in range(per_product)]
+    status, data = client.request('POST', '/recommendations/batch', json.dumps(batch))
+    if status != 201:
+        raise RuntimeError('Could not seed the recommendations: %s' % status)
+    return [item['id'] for item in json.loads(data)]
+
+
+def run_clients(make_client, workload, concurrency, requests, duration):
+    """ Sends requests from concurrent clients until either limit is reached """
+    stats = []
+    remaining = [requests]
+    lock = threading.Lock()
+    deadline = time.time() + duration if duration else None
+
+    def client():
+        connection = make_client()
+        latencies = dict((route, []) for route in ROUTES)
+        statuses = dict((route, {}) for route in ROUTES)
+        while True:
+            with lock:
+                if remaining[0] <= 0 or (deadline and time.time() > deadline):
+                    break
+                remaining[0] -= 1
+            route, method, path, body = workload.next_request()
+            started = time.time()
+            status, data = connection.request(method, path, body)
+            latencies[route].append(time.time() - started)
+            statuses[route][status] = statuses[route].get(status, 0) + 1
+            if route == 'create' and status == 201:
+                workload.created(data)
+        connection.close()
+        with lock:
+            stats.append((latencies, statuses))
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - started, stats
+
+
+def percentile(latencies, fraction):
+    """ Returns the latency below which a fraction of the requests finished, in ms """
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000
+
+
+def summarize(elapsed, stats):
+    """ Merges the statistics of the clients into a report per route and in total """
+    report = {}
+    for route in ROUTES + ('total',):
+        if route == 'total':
+            latencies = sorted(latency for client, _ in stats for route_latencies in client.values()
+                               for latency in route_latencies)
+            statuses = {}
+            for _, client in stats:
+                for counts in client.values():
+                    for status, count in counts.items():
+                        statuses[status] = statuses.get(status, 0) + count
+        else:
+            latencies = sorted(latency for client, _ in stats for latency in client[route])
+            statuses = {}
+            for _, client in stats:
+                for status, count in client[route].items():
+                    statuses[status] = statuses.get(status, 0) + count
+        if not latencies:
+            continue
+        # Failed connections have no status and count as errors like the 5xx responses
+        errors = sum(count for status, count in statuses.items() if status is None or status >= 500)
+        report[route] = {'requests': len(latencies),
+                         'requests_per_second': round(len(latencies) / elapsed, 1),
+                         'p50_ms': round(percentile(latencies, 0.5), 2),
+                         'p95_ms': round(percentile(latencies, 0.95), 2),
+                         'p99_ms': round(percentile(latencies, 0.99), 2),
+                         'errors': errors,
+                         'error_rate': round(float(errors) / len(latencies), 4),
+                         'statuses': dict((str(status), count) for status, count in statuses.items())}
+    return report
+
+
+def parse_mix(text):
+    """ Parses route=weight pairs separated by commas """
+    mix = {}
+    for item in text.split(','):
+        route, _, weight = item.partition('=')
+        if route.strip() not in ROUTES:
+            raise argparse.ArgumentTypeError('unknown route %s, use one of %s' % (route, ', '.join(ROUTES)))
+        mix[route.strip()] = float(weight or 1)
+    return mix
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test the recommendation service')
+    parser.add_argument('--url', help='base URL of a running server, the app in this '
+                                      'process is used when it is not given')
+    parser.add_argument('--engine', choices=('redis', 'memory'),
+                        help='storage engine of the app in this process, defaults to STORAGE_ENGINE')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help='route=weight pairs, default %s' % DEFAULT_MIX)
+    parser.add_argument('--requests', type=int, default=5000, help='requests to send at most')
+    parser.add_argument('--duration', type=float, help='seconds to send requests for at most')
+    parser.add_argument('--concurrency', type=int, default=1, help='concurrent clients')
+    parser.add_argument('--products', type=int, default=500, help='products to seed')
+    parser.add_argument('--per-product', type=int, default=20,
+                        help='recommendations seeded per product')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random requests')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    if args.url:
+        url = urlparse.urlparse(args.url)
+        make_client = lambda: HttpClient(url.hostname, url.port or 80)
+    else:
+        from app import service
+        if args.engine:
+            service.app.config['STORAGE_ENGINE'] = args.engine
+        service.init_db()
+        make_client = lambda: WsgiClient(service.app)
+
+    seeder = make_client()
+    ids = seed_data(seeder, args.products, args.per_product, args.seed)
+    seeder.close()
+    workload = Workload(args.mix, args.products, ids, args.seed)
+    elapsed, stats = run_clients(make_client, workload, args.concurrency, args.requests,
+                                 args.duration)
+    report = summarize(elapsed, stats)
+
+    if args.json:
+        print json.dumps({'target': args.url or 'wsgi', 'concurrency': args.concurrency,
+                          'seconds': round(elapsed, 3), 'routes': report}, indent=2, sort_keys=True)
+    else:
+        print '%-8s %9s %9s %9s %9s %9s %8s' % ('route', 'requests', 'req/s', 'p50 ms', 'p95 ms',
+                                               'p99 ms', 'errors')
+        for route in ROUTES + ('total',):
+            if route in report:
+                result = report[route]
+                print '%-8s %9d %9.1f %9.2f %9.2f %9.2f %7.2f%%' % (
+                    route, result['requests'], result['requests_per_second'], result['p50_ms'],
+                    result['p95_ms'], result['p99_ms'], result['error_rate'] * 100)
@@ -0,0 +1,259 @@
+"""
+Scaling benchmark of the Recommendation model operations
+
+Seeds synthetic datasets of growing size and times the model operations
+on each of them. Product popularity follows a Zipf distribution, so a few
+products have most of the recommendations and are also queried the most,
+and the recommendation types and likes are skewed the same way real data
+is. Prints the operations per second, the latency percentiles and the
+memory of each operation at every size.
+
+The memory engine is used as the data store by default, so no Redis server
+is needed and the numbers show the cost of the model itself. Use
+--engine redis to run against the local Redis, which is emptied first.
+
+Usage:
+  python benchmarks/model_scaling.py --sizes 1000,10000,100000,1000000
+  python benchmarks/model_scaling.py --json > before.json
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import random
+import bisect
+import logging
+import argparse
+import platform
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.models import Recommendation
+
+# Share of each recommendation type in the synthetic data
+TYPE_WEIGHTS = (('accessory', 0.5), ('cross-sell', 0.3), ('up-sell', 0.2))
+
+# Recommendations per product on average
+PER_PRODUCT = 20
+
+# Rows of a page of find_all
+PAGE_SIZE = 50
+
+# Results of an operation that are sized to find its memory per call
+SIZED_RESULTS = 20
+
+
+class Zipf(object):
+    """
+    Draws ranks from 1 to count, rank k with a weight of 1 / k ** exponent
+
+    Args:
+        count (int): the number of ranks
+        exponent (float): the skew, 0 draws every rank equally often
+        rng (Random): the random number generator to draw with
+    """
+
+    def __init__(self, count, exponent, rng):
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for rank in range(1, count + 1):
+            total += 1.0 / rank ** exponent
+            self.cumulative.append(total)
+
+    def draw(self):
+        """ Returns a random rank """
+        return bisect.bisect(self.cumulative, self.rng.random() * self.cumulative[-1]) + 1
+
+
+def draw_type(rng):
+    """ Returns a random recommendation type """
+    point = rng.random()
+    for recommendation_type, weight in TYPE_WEIGHTS:
+        if point < weight:
+            return recommendation_type
+        point -= weight
+    return TYPE_WEIGHTS[-1][0]
+
+
+def seed(size, rng, batch_size=10000):
+    """ Replaces the recommendations with size synthetic ones """
+    products = max(1, size // PER_PRODUCT)
+    popularity = Zipf(products, 1.1, rng)
+    likes = Zipf(1000, 1.5, rng)
+    Recommendation.remove_all()
+    for start in range(0, size, batch_size):
+        Recommendation.save_all([Recommendation(0, popularity.draw(), rng.randint(1, products),
+                                                draw_type(rng), likes.draw() - 1)
+                                 for _ in range(min(batch_size, size - start))])
+    return popularity
+
+
+def operations(size, rng, popularity):
+    """ Returns the operations to time as a list of (name, function) """
+    products = max(1, size // PER_PRODUCT)
+
+    def save():
+        Recommendation(rng.randint(1, size), popularity.draw(), rng.randint(1, products),
+                       draw_type(rng), 0).save()
+
+    def deserialize():
+        return Recommendation().deserialize({'product_id': popularity.draw(),
+                                             'recommended_product_id': rng.randint(1, products),
+                                             'recommendation_type': draw_type(rng),
+                                             'likes': 0})
+
+    return [
+        ('deserialize', deserialize),
+        ('save', save),
+        ('find', lambda: Recommendation.find(rng.randint(1, size))),
+        ('like', lambda: Recommendation.like(rng.randint(1, size))),
+        ('find_all_page', lambda: Recommendation.find_all(rng.randint(0, size), PAGE_SIZE)),
+        ('find_by_product_id', lambda: Recommendation.find_by_product_id(popularity.draw())),
+        ('find_by_recommend_type', lambda: Recommendation.find_by_recommend_type(
+            draw_type(rng), rng.randint(0, size), PAGE_SIZE)),
+        ('find_where', lambda: Recommendation.find_where({'product_id': popularity.draw(),
+                                                         'recommendation_type': draw_type(rng)})),
+        ('find_by_likes_range', lambda: Recommendation.find_by_likes_range(
+            100, None, (rng.randint(100, 999), rng.randint(0, size)), PAGE_SIZE)),
+        ('serialized_find_by_product_id', lambda: Recommendation.find_where(
+            {'product_id': popularity.draw()}, serialized=True)),
+        ('all', Recommendation.all),
+    ]
+
+
+def deep_size(value, seen=None):
+    """ Returns the bytes of a value and of the values it holds, counting each once """
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key, seen) + deep_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_size(item, seen) for item in value)
+    elif isinstance(value, Recommendation):
+        size += sum(deep_size(getattr(value, name), seen) for name in Recommendation.__slots__)
+    return size
+
+
+def resident_memory():
+    """ Returns the resident memory of this process in bytes """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(latencies, fraction):
+    """ Returns the latency below which a fraction of the calls finished """
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def measure(function, count, budget):
+    """
+    Calls a function count times and returns its statistics
+
+    Stops early once the calls took budget seconds, after at least 3 calls,
+    so the slow operations on the large sizes finish in a bounded time.
+    """
+    latencies = []
+    result_bytes = 0
+    gc.collect()
+    memory = resident_memory()
+    while len(latencies) < count and (len(latencies) < 3 or sum(latencies) < budget):
+        started = time.time()
+        result = function()
+        latencies.append(time.time() - started)
+        # Sizing the result is left out of the timing
+        if len(latencies) <= SIZED_RESULTS:
+            result_bytes += deep_size(result)
+        del result
+    calls = len(latencies)
+    latencies.sort()
+    return {'calls': calls,
+            'ops_per_second': round(calls / sum(latencies), 1),
+            'p50_us': round(percentile(latencies, 0.5) * 1e6, 1),
+            'p99_us': round(percentile(latencies, 0.99) * 1e6, 1),
+            'result_bytes_per_op': result_bytes // min(calls, SIZED_RESULTS),
+            'resident_bytes_per_op': (resident_memory() - memory) // calls}
+
+
+def run(size, calls, budget, rng):
+    """ Seeds size recommendations and measures every operation on them """
+    gc.collect()
+    memory = resident_memory()
+    started = time.time()
+    popularity = seed(size, rng)
+    result = {'size': size,
+              'seed_seconds': round(time.time() - started, 3),
+              'resident_bytes_per_record': (resident_memory() - memory) // size,
+              'operations': {}}
+    for name, function in operations(size, rng, popularity):
+        result['operations'][name] = measure(function, calls, budget)
+    Recommendation.remove_all()
+    return result
+
+
+def git_commit():
+    """ Returns the commit of the benchmarked code or None """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                           stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the Recommendation model at several sizes')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                        help='comma separated numbers of recommendations to seed')
+    parser.add_argument('--calls', type=int, default=1000, help='calls of each operation per size')
+    parser.add_argument('--budget', type=float, default=5.0,
+                        help='seconds after which an operation stops being called')
+    parser.add_argument('--engine', default='memory', choices=('memory', 'redis'),
+                        help='storage engine, redis empties the local Redis')
+    parser.add_argument('--record-format', default='packed', choices=('packed', 'json'),
+                        help='format the redis engine keeps the records in')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    Recommendation.init_db(None, args.engine, None, args.record_format)
+    rng = random.Random(args.seed)
+    results = {'commit': git_commit(),
+               'python': platform.python_version(),
+               'engine': args.engine,
+               'record_format': args.record_format,
+               'seed': args.seed,
+               'calls': args.calls,
+               'budget': args.budget,
+               'sizes': []}
+    for size in [int(size) for size in args.sizes.split(',')]:
+        results['sizes'].append(run(size, args.calls, args.budget, rng))
+
+    if args.json:
+        print json.dumps(results, indent=2, sort_keys=True)
+    else:
+        print '%-30s %10s %12s %10s %10s %12s' % ('operation', 'size', 'ops/s', 'p50 us',
+                                                   'p99 us', 'result B/op')
+        for result in results['sizes']:
+            print '%-30s %10d %12s %10s %10s %12d' % ('(seed)', result['size'],
+                                                       '%.1fs' % result['seed_seconds'], '', '',
+                                                       result['resident_bytes_per_record'])
+            for name, stats in sorted(result['operations'].items()):
+                print '%-30s %10d %12.1f %10.1f %10.1f %12d' % (
+                    name, result['size'], stats['ops_per_second'], stats['p50_us'],
+                    stats['p99_us'], stats['result_bytes_per_op'])
@@ -1,3 +1,55 @@
+import os
 import logging
 SECRET_KEY = 'secret-for-dev'
 LOGGING_LEVEL = logging.INFO
+
+# Storage engine for the recommendations: 'redis' or 'memory'
+STORAGE_ENGINE = os.getenv('STORAGE_ENGINE', 'redis')
+
+# Format Redis keeps the records in: 'packed' for the smallest records or
+# 'json' for records that are sent as they are stored, see app/codec.py
+RECORD_FORMAT = os.getenv('RECORD_FORMAT', 'packed')
+
+# Write-behind buffering of likes, flushed every interval seconds
+# or as soon as the threshold number of likes are waiting
+LIKES_BUFFERED = (os.getenv('LIKES_BUFFERED', 'False') == 'True')
+LIKES_FLUSH_INTERVAL = float(os.getenv('LIKES_FLUSH_INTERVAL', '1.0'))
+LIKES_FLUSH_THRESHOLD = int(os.getenv('LIKES_FLUSH_THRESHOLD', '1000'))
+
+# The most recommendations that POST /recommendations/batch accepts
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '10000'))
+
+# The most ids or product_ids that GET /recommendations?ids= or ?product_ids= accepts
+MAX_MULTI_GET = int(os.getenv('MAX_MULTI_GET', '1000'))
+
+# The largest page that GET /recommendations?limit= returns
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '1000'))
+
+# The most recommendations that GET /products/{id}/recommendations/top?n= returns
+MAX_TOP_COUNT = int(os.getenv('MAX_TOP_COUNT', '100'))
+
+# Per worker cache of the records read by id and by the index queries
+CACHE_ENABLED = (os.getenv('CACHE_ENABLED', 'False') == 'True')
+CACHE_SIZE = int(os.getenv('CACHE_SIZE', '10000'))
+CACHE_TTL = float(os.getenv('CACHE_TTL', '30'))
+
+# Request, Redis and query metrics served on GET /metrics, see app/metrics.py
+METRICS_ENABLED = (os.getenv('METRICS_ENABLED', 'True') == 'True')
+
+# Per request accounting of Redis commands and model time, and the slow log
+# of the requests that take SLOW_REQUEST_MS or more, see app/tracing.py
+REQUEST_TRACING = (os.getenv('REQUEST_TRACING', 'True') == 'True')
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '500'))
+
+# Redis connection pool, timeouts and retries, see app/connection.py
+REDIS_OPTIONS = {
+    'max_connections': int(os.getenv('REDIS_MAX_CONNECTIONS', '50')),
+    'blocking': (os.getenv('REDIS_POOL_BLOCKING', 'False') == 'True'),
+    'pool_timeout': float(os.getenv('REDIS_POOL_TIMEOUT', '5')),
+    'connect_timeout': float(os.getenv('REDIS_CONNECT_TIMEOUT', '2')),
+    'socket_timeout': float(os.getenv('REDIS_SOCKET_TIMEOUT', '5')),
+    'health_check_interval': int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', '30')),
+    'retries': int(os.getenv('REDIS_RETRIES', '3')),
+    'retry_backoff': float(os.getenv('REDIS_RETRY_BACKOFF', '0.05')),
+    'retry_max_backoff': float(os.getenv('REDIS_RETRY_MAX_BACKOFF', '1')),
+}
@@ -0,0 +1,150 @@
+"""
+Recommendation Service Management Commands
+
+Maintenance tasks that run against the recommendation data store
+
+Commands
+--------
+rebuild-indexes - Rebuilds the query indexes from the stored recommendations
+export          - Writes every recommendation as NDJSON to stdout or a file
+import          - Reads NDJSON recommendations from stdin or a file and saves them
+"""
+
+import sys
+import json
+import time
+import argparse
+from app import service
+from app.models import Recommendation, DataValidationError
+
+
+def rebuild_indexes(args):
+    """ Rebuilds the query indexes for existing data """
+    count = Recommendation.rebuild_indexes()
+    print 'Indexed %d recommendations' % count
+
+
+def export_recommendations(args):
+    """ Streams every recommendation to NDJSON one page of ids at a time """
+    output = open(args.output, 'w') if args.output else sys.stdout
+    started = time.time()
+    count = 0
+    after = 0
+    try:
+        # Paging by id writes every recommendation once, even while others
+        # are saved, which a SCAN of the keys doesn't promise
+        while after is not None:
+            page, after = Recommendation.find_page({}, after, args.batch_size, serialized='json')
+            for recommendation in page:
+                output.write(recommendation + '\n')
+                count += 1
+                if count % args.progress == 0:
+                    report_progress('Exported', count, started)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    report_progress('Exported', count, started)
+
+
+def import_recommendations(args):
+    """ Streams NDJSON recommendations in and saves them in validated chunks """
+    source = open(args.input) if args.input else sys.stdin
+    started = time.time()
+    count = 0
+    skipped = 0
+    chunk = []
+    try:
+        for number, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                chunk.append(load_recommendation(line, args.keep_ids))
+            except (KeyError, ValueError, DataValidationError) as error:
+                print >> sys.stderr, 'Skipping line %d: %s' % (number, error)
+                skipped += 1
+                continue
+            if len(chunk) == args.batch_size:
+                count += save_chunk(chunk, args.progress, count, started)
+                chunk = []
+        count += save_chunk(chunk, args.progress, count, started)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    report_progress('Imported', count, started)
+    if skipped:
+        print >> sys.stderr, 'Skipped %d invalid recommendations' % skipped
+        sys.exit(1)
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+
+def load_recommendation(line, keep_ids):
+    """ Validates one NDJSON line and returns it as a Recommendation """
+    data = json.loads(line)
+    if not isinstance(data, dict):
+        raise DataValidationError('Recommendation must be a JSON object')
+    recommendation = Recommendation().deserialize(data)
+    if keep_ids:
+        try:
+            recommendation.id = int(data['id'])
+        except (KeyError, TypeError, ValueError):
+            raise DataValidationError('Recommendation must have an integer id')
+        if recommendation.id < 1:
+            raise DataValidationError('Recommendation id must be positive')
+    return recommendation
+
+
+def save_chunk(chunk, progress, count, started):
+    """ Saves a chunk of recommendations in one transaction and reports progress """
+    if not chunk:
+        return 0
+    Recommendation.save_all(chunk)
+    if (count + len(chunk)) // progress > count // progress:
+        report_progress('Imported', count + len(chunk), started)
+    return len(chunk)
+
+
+def report_progress(action, count, started):
+    """ Prints the number of recommendations handled so far and the throughput """
+    elapsed = max(time.time() - started, 1e-6)
+    print >> sys.stderr, '%s %d recommendations in %.1fs (%.0f/s)' % \
+        (action, count, elapsed, count / elapsed)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Recommendation Service management commands')
+    commands = parser.add_subparsers(dest='command')
+    rebuild = commands.add_parser('rebuild-indexes', help='rebuild the query indexes for existing data')
+    rebuild.set_defaults(func=rebuild_indexes)
+
+    export = commands.add_parser('export', help='write every recommendation as NDJSON')
+    export.add_argument('-o', '--output', help='file to write to instead of stdout')
+    export.add_argument('--batch-size', type=int, default=1000,
+                        help='number of recommendations read per page')
+    export.add_argument('--progress', type=int, default=10000,
+                        help='report progress every this many recommendations')
+    export.set_defaults(func=export_recommendations)
+
+    load = commands.add_parser('import', help='save NDJSON recommendations')
+    load.add_argument('-i', '--input', help='file to read from instead of stdin')
+    load.add_argument('--batch-size', type=int, default=1000,
+                      help='number of recommendations validated and saved together')
+    load.add_argument('--progress', type=int, default=10000,
+                      help='report progress every this many recommendations')
+    load.add_argument('--new-ids', dest='keep_ids', action='store_false',
+                      help='give the imported recommendations new ids')
+    load.set_defaults(func=import_recommendations)
+    args = parser.parse_args()
+
+    service.initialize_logging()
+    Recommendation.init_db(None, service.app.config['STORAGE_ENGINE'],
+                           service.app.config['REDIS_OPTIONS'], service.app.config['RECORD_FORMAT'])
+    # The workers of the service drop the records this command writes from their caches
+    Recommendation.publish_invalidations = service.app.config['CACHE_ENABLED']
+    args.func(args)
+    sys.exit(0)
@@ -2,14 +2,29 @@
 Recommendation Service Runner
 
 Start the Recommendation Service and initializes logging
+
+Set SERVER=gevent to serve with the cooperative gevent WSGI server, which
+keeps many requests in flight in one process while they wait on Redis.
 """
 
 import os
-from app import app, service
+import sys
+import signal
 
 # Pull options from environment
 DEBUG = (os.getenv('DEBUG', 'False') == 'True')
 PORT = os.getenv('PORT', '8888')
+SERVER = os.getenv('SERVER', 'flask')
+GEVENT_POOL_SIZE = int(os.getenv('GEVENT_POOL_SIZE', '1000'))
+
+if SERVER == 'gevent':
+    # Sockets, locks and threads have to be patched before anything uses them
+    from gevent import monkey
+    monkey.patch_all()
+    # Greenlets wait for a free Redis connection instead of failing
+    os.environ.setdefault('REDIS_POOL_BLOCKING', 'True')
+
+from app import app, service
 
 ######################################################################
 #   M A I N
@@ -19,4 +34,14 @@ if __name__ == "__main__":
     print " R E C O M M E N D A T I O N   S E R V I C E   R U N N I N G"
     print "****************************************"
     service.initialize_logging()
-    app.run(host='0.0.0.0', port=int(PORT), debug=DEBUG)
+    # Exit cleanly on SIGTERM so buffered likes are flushed on shutdown
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if SERVER == 'gevent':
+        from gevent.pool import Pool
+        from gevent.pywsgi import WSGIServer
+        print "Serving with gevent on port %s, up to %d requests at once" % (PORT, GEVENT_POOL_SIZE)
+        # app.run sets this for the Flask server, the debug headers depend on it
+        app.debug = DEBUG
+        WSGIServer(('0.0.0.0', int(PORT)), app, spawn=Pool(GEVENT_POOL_SIZE)).serve_forever()
+    else:
+        app.run(host='0.0.0.0', port=int(PORT), debug=DEBUG)
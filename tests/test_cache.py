@@ -0,0 +1,101 @@
+"""
+Test cases for the record cache.
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+
+"""
+
+import time
+import unittest
+from app.cache import RecordCache
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestRecordCache(unittest.TestCase):
+    """ Test Cases for the record cache """
+
+    def setUp(self):
+        self.cache = RecordCache(max_size=3, ttl=60)
+        self.record = {'id': 1, 'product_id': 10}
+
+    def test_get_and_put(self):
+        """ Cache a record and count the hits and misses """
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', self.record, [1])
+        self.assertEqual(self.cache.get('a'), self.record)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_version_mismatch(self):
+        """ Miss the entries that were cached at another version """
+        self.cache.put('a', self.record, [1], version='3')
+        self.assertEqual(self.cache.get('a', '3'), self.record)
+        self.assertEqual(self.cache.get('a'), self.record)
+        self.assertIsNone(self.cache.get('a', '4'))
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_least_recently_used_evicted(self):
+        """ Evict the least recently used entry when the cache is full """
+        for key in 'abc':
+            self.cache.put(key, [], [])
+        self.cache.get('a')
+        self.cache.put('d', [], [])
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), [])
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_expired(self):
+        """ Miss entries that outlived the time to live """
+        cache = RecordCache(ttl=0.01)
+        cache.put('a', self.record, [1])
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_invalidate_by_id(self):
+        """ Drop the entries that hold a record """
+        self.cache.put('a', self.record, [1])
+        self.cache.put('b', [self.record, {'id': 2}], [1, 2])
+        self.cache.put('c', [{'id': 2}], [2])
+        self.cache.invalidate(ids=[1])
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), [{'id': 2}])
+        self.assertEqual(self.cache.containing, {2: set(['c'])})
+
+    def test_invalidate_by_tag(self):
+        """ Drop the query entries that a record joins """
+        self.cache.put('a', [], [], [('product_id', 10)])
+        self.cache.put('b', [], [], [('product_id', 20)])
+        self.cache.invalidate(tags=[('product_id', 10)])
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), [])
+
+    def test_put_after_invalidation_dropped(self):
+        """ Don't cache a value that was fetched before an invalidation """
+        generation = self.cache.generation
+        self.cache.invalidate(ids=[1])
+        self.cache.put('a', self.record, [1], generation=generation)
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_clear(self):
+        """ Drop all of the entries """
+        self.cache.put('a', self.record, [1], [('product_id', 10)])
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.tagged, {})
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
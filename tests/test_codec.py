@@ -0,0 +1,82 @@
+"""
+Test cases for the Recommendation record codec.
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+
+"""
+
+import pickle
+import struct
+import unittest
+from app import codec
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestCodec(unittest.TestCase):
+    """ Test Cases for the record codec """
+
+    def setUp(self):
+        self.data = {'id': 7, 'product_id': 1, 'recommended_product_id': 2,
+                     'recommendation_type': u'accessory', 'likes': 10}
+
+    def test_encode_and_decode(self):
+        """ Encode a record and decode it back """
+        value = codec.encode(self.data)
+        self.assertEqual(len(value), codec.HEADER.size)
+        self.assertEqual(codec.decode(value), self.data)
+
+    def test_encoding_is_smaller_than_pickle(self):
+        """ Encoded records are smaller than pickled ones """
+        self.assertLess(len(codec.encode(self.data)), len(pickle.dumps(self.data)) / 3)
+
+    def test_custom_recommendation_type(self):
+        """ Encode a recommendation type that has no code """
+        self.data['recommendation_type'] = u'bundle \u2605'
+        value = codec.encode(self.data)
+        self.assertGreater(len(value), codec.HEADER.size)
+        self.assertEqual(codec.decode(value), self.data)
+
+    def test_decode_pickled_record(self):
+        """ Decode a record that was saved as a pickled dictionary """
+        self.assertEqual(codec.decode(pickle.dumps(self.data)), self.data)
+        self.assertEqual(codec.decode(pickle.dumps(self.data, 2)), self.data)
+
+    def test_likes_offset(self):
+        """ The likes counter can be read at its fixed offset """
+        value = codec.encode(self.data)
+        self.assertEqual(struct.unpack_from('<q', value, codec.LIKES_OFFSET)[0], 10)
+
+    def test_encode_out_of_range(self):
+        """ Encode a record with an id that doesn't fit """
+        self.data['id'] = 2 ** 64
+        self.assertRaises(ValueError, codec.encode, self.data)
+
+    def test_encode_and_decode_json(self):
+        """ Encode a record as canonical JSON and decode it back """
+        value = codec.encode(dict(self.data, color='red'), 'json')
+        self.assertEqual(value, '{"id":7,"likes":10,"product_id":1,'
+                                '"recommendation_type":"accessory","recommended_product_id":2}')
+        self.assertEqual(codec.decode(value), self.data)
+        self.assertEqual(codec.json_id(value), 7)
+
+    def test_as_json(self):
+        """ Get the canonical JSON of a record in every format """
+        text = codec.to_json(self.data)
+        self.assertIs(codec.as_json(text), text)
+        self.assertEqual(codec.as_json(codec.encode(self.data)), text)
+        self.assertEqual(codec.as_json(pickle.dumps(self.data)), text)
+        self.data['recommendation_type'] = u'bundle "\u2605"'
+        self.assertEqual(codec.as_json(codec.encode(self.data)), codec.to_json(self.data))
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
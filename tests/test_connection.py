@@ -0,0 +1,141 @@
+"""
+Test cases for the Redis connection setup.
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+
+"""
+
+import unittest
+from mock import patch
+from redis import Redis, BlockingConnectionPool
+from redis.exceptions import ConnectionError, TimeoutError
+from app import connection
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestConnection(unittest.TestCase):
+    """ Test Cases for the Redis connection setup """
+
+    def test_connect(self):
+        """ Build the connection pool from the options """
+        redis = connection.connect('127.0.0.1', '6379', None,
+                                   {'max_connections': 7, 'socket_timeout': 1.5})
+        pool = redis.connection_pool
+        self.assertEqual(pool.max_connections, 7)
+        self.assertEqual(pool.connection_kwargs['port'], 6379)
+        self.assertEqual(pool.connection_kwargs['socket_timeout'], 1.5)
+        self.assertEqual(pool.connection_kwargs['socket_connect_timeout'],
+                         connection.DEFAULTS['connect_timeout'])
+        self.assertEqual(pool.connection_kwargs['health_check_interval'],
+                         connection.DEFAULTS['health_check_interval'])
+        self.assertEqual(redis.retries, connection.DEFAULTS['retries'])
+
+    def test_connect_blocking(self):
+        """ Build a pool that waits for a free connection """
+        redis = connection.connect('127.0.0.1', 6379, None, {'blocking': True, 'pool_timeout': 0.5})
+        self.assertIsInstance(redis.connection_pool, BlockingConnectionPool)
+        self.assertEqual(redis.connection_pool.timeout, 0.5)
+
+    def test_connect_with_text_options(self):
+        """ Convert the options of JSON credentials, which are often strings """
+        redis = connection.connect('127.0.0.1', '6379', None,
+                                   {'socket_timeout': '3', 'connect_timeout': 1, 'blocking': 'false',
+                                    'max_connections': '9', 'retries': '2',
+                                    'retry_backoff': '0.5'})
+        pool = redis.connection_pool
+        self.assertNotIsInstance(pool, BlockingConnectionPool)
+        self.assertEqual(pool.max_connections, 9)
+        self.assertEqual(pool.connection_kwargs['socket_timeout'], 3.0)
+        self.assertIsInstance(pool.connection_kwargs['socket_connect_timeout'], float)
+        self.assertEqual((redis.retries, redis.backoff), (2, 0.5))
+        self.assertTrue(redis.ping())
+        redis = connection.connect('127.0.0.1', 6379, None, {'blocking': 'True'})
+        self.assertIsInstance(redis.connection_pool, BlockingConnectionPool)
+        self.assertRaises(ValueError, connection.connect, '127.0.0.1', 6379, None,
+                          {'blocking': 'maybe'})
+
+    @patch('time.sleep')
+    @patch('redis.Redis.execute_command')
+    def test_retry_idempotent_command(self, execute_mock, sleep_mock):
+        """ Retry a read with exponential backoff """
+        execute_mock.side_effect = [ConnectionError(), TimeoutError(), 'PONG']
+        redis = connection.RetryingRedis(retries=3, backoff=0.1, max_backoff=0.15)
+        self.assertEqual(redis.execute_command('PING'), 'PONG')
+        self.assertEqual([call[0][0] for call in sleep_mock.call_args_list], [0.1, 0.15])
+        self.assertEqual((redis.retried, redis.failed), (2, 0))
+
+    @patch('time.sleep')
+    @patch('redis.Redis.execute_command')
+    def test_retries_exhausted(self, execute_mock, sleep_mock):
+        """ Give up on a read after the last retry """
+        execute_mock.side_effect = ConnectionError()
+        redis = connection.RetryingRedis(retries=2)
+        self.assertRaises(ConnectionError, redis.execute_command, 'GET', '1')
+        self.assertEqual(execute_mock.call_count, 3)
+        self.assertEqual((redis.retried, redis.failed), (2, 1))
+
+    @patch('time.sleep')
+    @patch('redis.Redis.execute_command')
+    def test_no_retry_for_increments(self, execute_mock, sleep_mock):
+        """ Don't retry a command that may have run already """
+        execute_mock.side_effect = TimeoutError()
+        redis = connection.RetryingRedis(retries=3)
+        self.assertRaises(TimeoutError, redis.execute_command, 'INCR', 'index')
+        self.assertEqual(execute_mock.call_count, 1)
+        self.assertFalse(sleep_mock.called)
+
+    def test_pool_stats(self):
+        """ Count the connections of both kinds of pools """
+        for options in ({}, {'blocking': True}):
+            redis = connection.connect('127.0.0.1', 6379, None, dict(options, max_connections=5))
+            stats = connection.pool_stats(redis)
+            self.assertEqual((stats['created'], stats['idle'], stats['in_use']), (0, 0, 0))
+            self.assertEqual(stats['max_connections'], 5)
+            self.assertEqual(stats['blocking'], bool(options))
+            redis.ping()
+            stats = connection.pool_stats(redis)
+            self.assertEqual((stats['created'], stats['idle'], stats['in_use']), (1, 1, 0))
+
+    def test_observers(self):
+        """ Tell the observers about commands, pipelines and transactions """
+        redis = connection.connect('127.0.0.1', 6379)
+        trips = []
+        redis.observers.append(lambda command, commands, reply, seconds, failed:
+                               trips.append((command, [args[0] for args in commands], failed)))
+        redis.set('observed', 1)
+        redis.pipeline(transaction=False).get('observed').get('missing').execute()
+        redis.pipeline().incr('observed').delete('observed').execute()
+        redis.pipeline().execute()
+        self.assertEqual(trips, [('SET', ['SET'], False),
+                                 ('PIPELINE', ['GET', 'GET'], False),
+                                 ('MULTI', ['INCRBY', 'DEL'], False)])
+
+    @patch('redis.Redis.execute_command')
+    def test_observers_of_failures(self, execute_mock):
+        """ Tell the observers about a command that failed """
+        execute_mock.side_effect = TimeoutError()
+        redis = connection.RetryingRedis(retries=0)
+        trips = []
+        redis.observers.append(lambda *trip: trips.append(trip))
+        self.assertRaises(TimeoutError, redis.execute_command, 'INCR', 'index')
+        self.assertEqual([(command, reply, failed)
+                          for command, commands, reply, seconds, failed in trips],
+                         [('INCR', None, True)])
+
+    def test_pool_stats_of_plain_client(self):
+        """ Count the connections of a client without retries """
+        stats = connection.pool_stats(Redis())
+        self.assertNotIn('retried', stats)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+Test cases for the management commands
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+
+"""
+
+import os
+import json
+import time
+import tempfile
+import unittest
+from argparse import Namespace
+from StringIO import StringIO
+from mock import patch
+import manage
+from app.models import Recommendation, DataValidationError
+
+# Product_id
+PS4 = 1
+CONTROLLER = 2
+ADAPTER = 3
+PS5 = 11
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestManage(unittest.TestCase):
+    """ Management Command Tests """
+
+    def setUp(self):
+        Recommendation.init_db()
+        Recommendation.remove_all()
+        self.stderr = StringIO()
+        patcher = patch('sys.stderr', self.stderr)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_file(self, text=''):
+        """ Creates a temporary file with some text and returns its path """
+        handle, path = tempfile.mkstemp(suffix='.ndjson')
+        os.write(handle, text)
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_load_recommendation(self):
+        """ Load a Recommendation from a line of NDJSON """
+        line = json.dumps({'id': 7, 'product_id': PS4, 'recommended_product_id': CONTROLLER,
+                           'recommendation_type': "accessory", 'likes': 3})
+        recommendation = manage.load_recommendation(line, True)
+        self.assertEqual(recommendation.id, 7)
+        self.assertEqual(recommendation.product_id, PS4)
+        self.assertEqual(recommendation.likes, 3)
+        self.assertEqual(manage.load_recommendation(line, False).id, 0)
+
+        line = json.dumps({'id': 7, 'product_id': PS4, 'recommended_product_id': CONTROLLER,
+                           'recommendation_type': "accessory"})
+        self.assertEqual(manage.load_recommendation(line, True).likes, 0)
+
+    def test_load_invalid_recommendation(self):
+        """ Reject lines of NDJSON that are not valid Recommendations """
+        self.assertRaises(ValueError, manage.load_recommendation, '{"id": 1,', True)
+        self.assertRaises(DataValidationError, manage.load_recommendation, '[1, 2]', True)
+        self.assertRaises(DataValidationError, manage.load_recommendation,
+                          json.dumps({'id': 1, 'recommended_product_id': CONTROLLER,
+                                      'recommendation_type': "accessory"}), True)
+        data = {'product_id': PS4, 'recommended_product_id': CONTROLLER,
+                'recommendation_type': "accessory"}
+        self.assertRaises(DataValidationError, manage.load_recommendation, json.dumps(data), True)
+        self.assertRaises(DataValidationError, manage.load_recommendation,
+                          json.dumps(dict(data, id='seven')), True)
+        self.assertRaises(DataValidationError, manage.load_recommendation,
+                          json.dumps(dict(data, id=0)), True)
+        self.assertEqual(manage.load_recommendation(json.dumps(data), False).id, 0)
+
+    def test_save_chunk(self):
+        """ Save a chunk of Recommendations and report the progress """
+        started = time.time()
+        self.assertEqual(manage.save_chunk([], 2, 0, started), 0)
+        chunk = [Recommendation(0, PS4, CONTROLLER, "accessory"),
+                 Recommendation(0, PS5, ADAPTER, "up-sell")]
+        self.assertEqual(manage.save_chunk(chunk, 10, 0, started), 2)
+        self.assertEqual(len(Recommendation.all()), 2)
+        self.assertEqual(self.stderr.getvalue(), '')
+
+        chunk = [Recommendation(0, PS4, ADAPTER, "accessory")]
+        self.assertEqual(manage.save_chunk(chunk, 3, 2, started), 1)
+        self.assertIn('Imported 3 recommendations', self.stderr.getvalue())
+
+    def test_export_and_import(self):
+        """ Export every Recommendation and import them again """
+        for recommended_product_id in range(1, 6):
+            Recommendation(0, PS4, recommended_product_id, "accessory", recommended_product_id).save()
+        Recommendation(0, PS5, CONTROLLER, "up-sell", 9).save()
+        Recommendation.find(2).delete()
+        expected = [recommendation.serialize() for recommendation in Recommendation.find_all()]
+
+        path = self.make_file()
+        manage.export_recommendations(Namespace(output=path, batch_size=2, progress=100))
+        with open(path) as exported:
+            self.assertEqual([json.loads(line) for line in exported], expected)
+        self.assertIn('Exported 5 recommendations', self.stderr.getvalue())
+
+        Recommendation.remove_all()
+        manage.import_recommendations(Namespace(input=path, batch_size=2, progress=100,
+                                                keep_ids=True))
+        self.assertEqual([recommendation.serialize() for recommendation in Recommendation.find_all()],
+                         expected)
+        self.assertIn('Imported 5 recommendations', self.stderr.getvalue())
+
+        # New ids come after the imported ones
+        manage.import_recommendations(Namespace(input=path, batch_size=2, progress=100,
+                                                keep_ids=False))
+        self.assertEqual([recommendation.id for recommendation in Recommendation.find_all()],
+                         [1, 3, 4, 5, 6, 7, 8, 9, 10, 11])
+
+    def test_import_skips_invalid_lines(self):
+        """ Import the valid lines, skip the others and exit with an error """
+        lines = [json.dumps({'id': 1, 'product_id': PS4, 'recommended_product_id': CONTROLLER,
+                             'recommendation_type': "accessory", 'likes': 2}),
+                 '{"id": 2,',
+                 '',
+                 json.dumps({'id': 3, 'recommended_product_id': CONTROLLER,
+                             'recommendation_type': "accessory"}),
+                 json.dumps({'id': 4, 'product_id': PS5, 'recommended_product_id': ADAPTER,
+                             'recommendation_type': "up-sell"})]
+        path = self.make_file('\n'.join(lines) + '\n')
+
+        with self.assertRaises(SystemExit) as context:
+            manage.import_recommendations(Namespace(input=path, batch_size=1, progress=100,
+                                                    keep_ids=True))
+        self.assertEqual(context.exception.code, 1)
+        self.assertEqual([recommendation.id for recommendation in Recommendation.find_all()], [1, 4])
+        self.assertEqual(Recommendation.find(4).likes, 0)
+        errors = self.stderr.getvalue()
+        self.assertIn('Skipping line 2', errors)
+        self.assertIn('Skipping line 4', errors)
+        self.assertIn('Skipped 2 invalid recommendations', errors)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
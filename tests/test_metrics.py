@@ -0,0 +1,106 @@
+"""
+Test cases for the metrics of the service.
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+
+"""
+
+import unittest
+from app import metrics
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestMetrics(unittest.TestCase):
+    """ Test Cases for the metrics and their text format """
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        """ Count by label values """
+        counter = self.registry.counter('jobs_total', 'Jobs done', ('queue',))
+        counter.inc(('fast',))
+        counter.inc(('fast',), 2)
+        counter.inc(('slow',))
+        self.assertEqual(counter.get(('fast',)), 3)
+        self.assertEqual(counter.get(('none',)), 0)
+        self.assertEqual(self.registry.render(),
+                         '# HELP jobs_total Jobs done\n'
+                         '# TYPE jobs_total counter\n'
+                         'jobs_total{queue="fast"} 3\n'
+                         'jobs_total{queue="slow"} 1\n')
+
+    def test_gauge(self):
+        """ Move a gauge up and down """
+        gauge = self.registry.gauge('busy', 'Busy workers')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.assertEqual(gauge.get(), 1)
+        gauge.set(0.5)
+        self.assertIn('busy 0.5\n', self.registry.render())
+
+    def test_histogram(self):
+        """ Count observations in cumulative buckets """
+        histogram = self.registry.histogram('wait_seconds', 'Waits', ('queue',), (0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, ('fast',))
+        self.assertEqual(histogram.get(('fast',)), 4)
+        lines = self.registry.render().splitlines()
+        self.assertEqual(lines[1], '# TYPE wait_seconds histogram')
+        self.assertEqual(lines[2:], ['wait_seconds_bucket{queue="fast",le="0.1"} 2',
+                                     'wait_seconds_bucket{queue="fast",le="1.0"} 3',
+                                     'wait_seconds_bucket{queue="fast",le="+Inf"} 4',
+                                     'wait_seconds_sum{queue="fast"} 3.65',
+                                     'wait_seconds_count{queue="fast"} 4'])
+
+    def test_escape_labels(self):
+        """ Escape the quotes, backslashes and new lines of label values """
+        counter = self.registry.counter('paths_total', 'Paths', ('path',))
+        counter.inc(('a"b\\c\nd',))
+        self.assertIn(r'paths_total{path="a\"b\\c\nd"} 1', self.registry.render())
+
+    def test_collectors(self):
+        """ Render the metrics of a collector when scraped """
+        def collect():
+            gauge = metrics.Gauge('size', 'Entries')
+            gauge.set(7)
+            return [gauge]
+        self.registry.register(collect)
+        self.registry.register(collect)
+        self.assertEqual(self.registry.render().count('size 7\n'), 1)
+
+    def test_observe_redis(self):
+        """ Count the commands of a pipeline and time it as one round trip """
+        sets = metrics.REDIS_COMMANDS.get(('SET',))
+        gets = metrics.REDIS_COMMANDS.get(('GET',))
+        trips = metrics.REDIS_LATENCY.get(('PIPELINE',))
+        errors = metrics.REDIS_ERRORS.get(('PIPELINE',))
+        metrics.observe_redis('PIPELINE', [('SET', 'a', 1), ('SET', 'b', 2), ('GET', 'a')],
+                              None, 0.001, True)
+        self.assertEqual(metrics.REDIS_COMMANDS.get(('SET',)), sets + 2)
+        self.assertEqual(metrics.REDIS_COMMANDS.get(('GET',)), gets + 1)
+        self.assertEqual(metrics.REDIS_LATENCY.get(('PIPELINE',)), trips + 1)
+        self.assertEqual(metrics.REDIS_ERRORS.get(('PIPELINE',)), errors + 1)
+
+    def test_watch_redis(self):
+        """ Only add the observer once to clients that take observers """
+        class Client(object):
+            observers = []
+        metrics.watch_redis(Client)
+        metrics.watch_redis(Client)
+        self.assertEqual(Client.observers, [metrics.observe_redis])
+        metrics.watch_redis(None)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -9,10 +9,16 @@ Test cases can be run with:
 
 import os
 import json
+import time
+import pickle
+import threading
 import unittest
 from redis import Redis, ConnectionError
 from mock import patch
 from app.models import Recommendation, DataValidationError
+from app.storage import MemoryEngine
+from app.cache import CHANNEL
+from app import metrics
 
 
 # Product_id
@@ -133,6 +139,11 @@ class TestRecommendations(unittest.TestCase):
         data = {"id": 0, 'recommended_product_id': CONTROLLER, 'recommendation_type': "accessory", 'likes': 10}
         self.assertRaises(DataValidationError, recommendation.deserialize, data)
 
+    def test_deserialize_without_likes(self):
+        """ Deserialize a Recommendation without the optional likes """
+        data = {'product_id': PS4, 'recommended_product_id': CONTROLLER, 'recommendation_type': "accessory"}
+        self.assertEqual(Recommendation().deserialize(data).likes, 0)
+
     def test_deserialize_with_no_data(self):
         """ Deserialize a Recommend with no data """
         recommendation = Recommendation()
@@ -210,6 +221,697 @@ class TestRecommendations(unittest.TestCase):
         self.assertEqual(len(recommendations), 1)
         self.assertEqual(recommendations[0].recommended_product_id, MONSTER_HUNTER)
 
+    def test_iter_all_in_batches(self):
+        """ Iterate over all Recommendations a few keys at a time """
+        for product_id in range(1, 26):
+            Recommendation(product_id=product_id, recommended_product_id=CONTROLLER, recommendation_type="accessory").save()
+
+        recommendations = Recommendation.iter_all(batch_size=4)
+        self.assertFalse(isinstance(recommendations, list))
+        product_ids = sorted(recommendation.product_id for recommendation in recommendations)
+        self.assertEqual(product_ids, range(1, 26))
+        self.assertEqual(len(Recommendation.all()), 25)
+
+    def test_like_a_recommendation(self):
+        """ Like a Recommendation """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory", likes=2)
+        recommendation.save()
+
+        liked = Recommendation.like(recommendation.id)
+        self.assertEqual(liked.id, recommendation.id)
+        self.assertEqual(liked.likes, 3)
+        self.assertEqual(liked.product_id, PS4)
+        self.assertEqual(Recommendation.like(recommendation.id, 5).likes, 8)
+        self.assertEqual(Recommendation.find(recommendation.id).likes, 8)
+
+    def test_like_with_large_integers(self):
+        """ Like Recommendations whose product_id and likes don't fit a double """
+        product_id = 2 ** 60 + 1
+        recommendation = Recommendation(product_id=product_id, recommended_product_id=CONTROLLER,
+                                        recommendation_type="accessory", likes=2 ** 60 + 1)
+        recommendation.save()
+        version = Recommendation.version(product_id=product_id)
+
+        liked = Recommendation.like(recommendation.id)
+        self.assertEqual(liked.likes, 2 ** 60 + 2)
+        self.assertEqual(liked.product_id, product_id)
+        self.assertEqual(Recommendation.find(recommendation.id).likes, 2 ** 60 + 2)
+        self.assertNotEqual(Recommendation.version(product_id=product_id), version)
+        self.assertEqual([found.id for found in Recommendation.find_top_by_product_id(product_id)],
+                         [recommendation.id])
+        if Recommendation.redis:
+            self.assertEqual(Recommendation.redis.keys('idx:top:*'), ['idx:top:%d' % product_id])
+
+        for likes, amount, expected in ((-1, 3, 2), (2, -5, -3), (-2 ** 63 + 5, -5, -2 ** 63),
+                                        (2 ** 63 - 9, 8, 2 ** 63 - 1), (-2 ** 53 - 1, -2 ** 40, -2 ** 53 - 1 - 2 ** 40)):
+            recommendation.likes = likes
+            recommendation.save()
+            self.assertEqual(Recommendation.like(recommendation.id, amount).likes, expected)
+            self.assertEqual(Recommendation.find(recommendation.id).likes, expected)
+
+    def test_like_a_recommendation_not_found(self):
+        """ Like a Recommendation that doesn't exist """
+        self.assertIsNone(Recommendation.like(1))
+
+    def test_like_concurrently(self):
+        """ Concurrent likes are not lost """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        recommendation.save()
+
+        def like():
+            for _ in range(50):
+                Recommendation.like(recommendation.id)
+        threads = [threading.Thread(target=like) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(Recommendation.find(recommendation.id).likes, 200)
+
+    def test_like_a_pickled_recommendation(self):
+        """ Like a Recommendation that was saved as a pickled dictionary """
+        if not Recommendation.redis:
+            self.skipTest('needs the Redis engine')
+        data = {'id': 1, 'product_id': PS4, 'recommended_product_id': CONTROLLER,
+                'recommendation_type': "accessory", 'likes': 4}
+        Recommendation.redis.set(1, pickle.dumps(data))
+
+        self.assertEqual(Recommendation.like(1).likes, 5)
+        self.assertEqual(Recommendation.find(1).likes, 5)
+        self.assertEqual(len(Recommendation.find_by_product_id(PS4)), 1)
+
+    def test_buffered_likes(self):
+        """ Buffer likes and flush them in one batch """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory", likes=2)
+        recommendation.save()
+        Recommendation.start_like_buffer(interval=60, threshold=100)
+        self.addCleanup(Recommendation.stop_like_buffer)
+
+        self.assertEqual(Recommendation.like(recommendation.id).likes, 3)
+        self.assertEqual(Recommendation.like(recommendation.id).likes, 4)
+        self.assertIsNone(Recommendation.like(recommendation.id + 1))
+        # Reads include the waiting likes but the data store doesn't have them yet
+        self.assertEqual(Recommendation.find(recommendation.id).likes, 4)
+        self.assertEqual(Recommendation.find_by_product_id(PS4)[0].likes, 4)
+        self.assertEqual(Recommendation.engine.get(recommendation.id)['likes'], 2)
+
+        Recommendation.like_buffer.flush()
+        self.assertEqual(Recommendation.engine.get(recommendation.id)['likes'], 4)
+        self.assertEqual(Recommendation.find(recommendation.id).likes, 4)
+
+    def test_buffered_likes_read_once(self):
+        """ Read a Recommendation once per flush when its likes are buffered """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        recommendation.save()
+        Recommendation.start_like_buffer(interval=60, threshold=100)
+        self.addCleanup(Recommendation.stop_like_buffer)
+
+        with patch.object(Recommendation.engine, 'get', wraps=Recommendation.engine.get) as get:
+            for likes in range(1, 6):
+                self.assertEqual(Recommendation.like(recommendation.id).likes, likes)
+            self.assertEqual(get.call_count, 1)
+            Recommendation.like_buffer.flush()
+            self.assertEqual(Recommendation.like(recommendation.id).likes, 6)
+            self.assertEqual(get.call_count, 2)
+
+            # A save on this worker replaces the kept record
+            recommendation.recommendation_type = "up-sell"
+            recommendation.save()
+            self.assertEqual(Recommendation.like(recommendation.id).recommendation_type, "up-sell")
+            self.assertEqual(get.call_count, 3)
+
+    def test_buffered_likes_threshold(self):
+        """ Flush buffered likes when the threshold is reached """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        recommendation.save()
+        Recommendation.start_like_buffer(interval=60, threshold=3)
+        self.addCleanup(Recommendation.stop_like_buffer)
+
+        Recommendation.like(recommendation.id)
+        Recommendation.like(recommendation.id)
+        self.assertEqual(Recommendation.engine.get(recommendation.id)['likes'], 0)
+        self.assertEqual(Recommendation.like(recommendation.id).likes, 3)
+        self.assertEqual(Recommendation.engine.get(recommendation.id)['likes'], 3)
+
+    def test_buffered_likes_flushed_on_stop(self):
+        """ Flush buffered likes when the buffer is stopped """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        recommendation.save()
+        Recommendation.start_like_buffer(interval=60, threshold=100)
+        Recommendation.like(recommendation.id, 5)
+
+        Recommendation.stop_like_buffer()
+        self.assertIsNone(Recommendation.like_buffer)
+        self.assertEqual(Recommendation.engine.get(recommendation.id)['likes'], 5)
+
+    def test_buffered_likes_overwritten_by_save(self):
+        """ Saving a Recommendation replaces its buffered likes """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        recommendation.save()
+        Recommendation.start_like_buffer(interval=60, threshold=100)
+        self.addCleanup(Recommendation.stop_like_buffer)
+
+        recommendation = Recommendation.like(recommendation.id, 2)
+        recommendation.save()
+        Recommendation.like_buffer.flush()
+        self.assertEqual(Recommendation.find(recommendation.id).likes, 2)
+
+    def test_cached_find(self):
+        """ Cache Recommendations found by id and drop them when they change """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        recommendation.save()
+        Recommendation.enable_cache()
+        self.addCleanup(Recommendation.disable_cache)
+
+        self.assertEqual(Recommendation.find(recommendation.id).product_id, PS4)
+        self.assertEqual(Recommendation.find(recommendation.id).product_id, PS4)
+        stats = Recommendation.cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+        recommendation.product_id = PS5
+        recommendation.save()
+        self.assertEqual(Recommendation.find(recommendation.id).product_id, PS5)
+        Recommendation.like(recommendation.id)
+        self.assertEqual(Recommendation.find(recommendation.id).likes, 1)
+        recommendation.delete()
+        self.assertIsNone(Recommendation.find(recommendation.id))
+
+    def test_cached_find_by_product_id(self):
+        """ Cache index queries and drop them when a Recommendation joins or leaves """
+        controller = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        controller.save()
+        Recommendation.enable_cache()
+        self.addCleanup(Recommendation.disable_cache)
+
+        self.assertEqual(len(Recommendation.find_by_product_id(PS4)), 1)
+        self.assertEqual(len(Recommendation.find_by_product_id(PS5)), 0)
+        self.assertEqual(len(Recommendation.find_by_product_id(PS4)), 1)
+        self.assertEqual(Recommendation.cache_stats()['hits'], 1)
+
+        Recommendation(product_id=PS4, recommended_product_id=ADAPTER, recommendation_type="accessory").save()
+        self.assertEqual(len(Recommendation.find_by_product_id(PS4)), 2)
+        controller.product_id = PS5
+        controller.save()
+        self.assertEqual(len(Recommendation.find_by_product_id(PS4)), 1)
+        self.assertEqual(len(Recommendation.find_by_product_id(PS5)), 1)
+        Recommendation.remove_all()
+        self.assertEqual(Recommendation.find_by_product_id(PS4), [])
+
+    def test_cached_buffered_likes(self):
+        """ Read buffered likes through the cache before and after a flush """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        recommendation.save()
+        Recommendation.enable_cache()
+        self.addCleanup(Recommendation.disable_cache)
+        Recommendation.start_like_buffer(interval=60, threshold=100)
+        self.addCleanup(Recommendation.stop_like_buffer)
+
+        Recommendation.like(recommendation.id, 2)
+        self.assertEqual(Recommendation.find(recommendation.id).likes, 2)
+        Recommendation.like_buffer.flush()
+        self.assertEqual(Recommendation.find(recommendation.id).likes, 2)
+        self.assertEqual(Recommendation.find_by_product_id(PS4)[0].likes, 2)
+
+    def test_cache_invalidated_by_other_process(self):
+        """ Drop cached Recommendations that another process changed """
+        if not Recommendation.redis:
+            self.skipTest('needs Redis pub/sub')
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        recommendation.save()
+        Recommendation.enable_cache()
+        self.addCleanup(Recommendation.disable_cache)
+        self.assertEqual(Recommendation.find(recommendation.id).likes, 0)
+
+        # Another process writes the record and publishes the invalidation
+        data = recommendation.serialize()
+        data['likes'] = 7
+        Recommendation.engine.save(data)
+        Recommendation.engine.publish(CHANNEL, json.dumps(
+            {'origin': 'other', 'clear': False, 'ids': [recommendation.id], 'tags': []}))
+        deadline = time.time() + 5
+        while Recommendation.cache_stats()['size'] and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(Recommendation.find(recommendation.id).likes, 7)
+
+    def test_version(self):
+        """ Change the versions of a Recommendation, its product and all of them on writes """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        recommendation.save()
+        versions = lambda: (Recommendation.version(id=recommendation.id),
+                            Recommendation.version(product_id=PS4),
+                            Recommendation.version(product_id=PS5),
+                            Recommendation.version())
+        before = versions()
+        Recommendation.find(recommendation.id)
+        self.assertEqual(versions(), before)
+
+        for write in (lambda: Recommendation.like(recommendation.id),
+                      recommendation.save,
+                      recommendation.delete):
+            write()
+            after = versions()
+            self.assertNotEqual(after[0], before[0])
+            self.assertNotEqual(after[1], before[1])
+            self.assertEqual(after[2], before[2])
+            self.assertNotEqual(after[3], before[3])
+            before = after
+
+        # Moving to another product changes the versions of both products
+        recommendation.save()
+        before = versions()
+        recommendation.product_id = PS5
+        recommendation.save()
+        after = versions()
+        self.assertNotEqual(after[1], before[1])
+        self.assertNotEqual(after[2], before[2])
+
+    def test_version_after_remove_all(self):
+        """ Never repeat a version after the data store is emptied """
+        Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory").save()
+        version = Recommendation.version(id=1)
+        Recommendation.remove_all()
+        Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory").save()
+        self.assertNotEqual(Recommendation.version(id=1), version)
+
+    def test_version_with_buffered_likes(self):
+        """ Change the version when likes are buffered """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        recommendation.save()
+        Recommendation.start_like_buffer(interval=60, threshold=100)
+        self.addCleanup(Recommendation.stop_like_buffer)
+        version = Recommendation.version(id=recommendation.id)
+        Recommendation.like(recommendation.id)
+        self.assertNotEqual(Recommendation.version(id=recommendation.id), version)
+
+    def test_find_top_by_product_id(self):
+        """ Rank the Recommendations of a product_id by likes """
+        controller = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory", likes=5)
+        controller.save()
+        adapter = Recommendation(product_id=PS4, recommended_product_id=ADAPTER, recommendation_type="accessory", likes=1)
+        adapter.save()
+        monster_hunter = Recommendation(product_id=PS4, recommended_product_id=MONSTER_HUNTER, recommendation_type="cross-sell", likes=3)
+        monster_hunter.save()
+        Recommendation(product_id=PS5, recommended_product_id=DISPLAY, recommendation_type="accessory", likes=10).save()
+
+        top = Recommendation.find_top_by_product_id(PS4)
+        self.assertEqual([recommendation.id for recommendation in top],
+                         [controller.id, monster_hunter.id, adapter.id])
+        top = Recommendation.find_top_by_product_id(PS4, 2)
+        self.assertEqual([recommendation.id for recommendation in top], [controller.id, monster_hunter.id])
+
+        # Likes, updates and deletes move the ranking
+        Recommendation.like(adapter.id, 10)
+        self.assertEqual(Recommendation.find_top_by_product_id(PS4, 1)[0].id, adapter.id)
+        adapter.product_id = PS5
+        adapter.save()
+        controller.delete()
+        top = Recommendation.find_top_by_product_id(PS4)
+        self.assertEqual([recommendation.id for recommendation in top], [monster_hunter.id])
+        self.assertEqual(len(Recommendation.find_top_by_product_id(PS5)), 2)
+        self.assertEqual(Recommendation.find_top_by_product_id(PS3), [])
+
+    def test_find_by_likes_range(self):
+        """ Find Recommendations with likes in a range """
+        Recommendation(product_id=PS3, recommended_product_id=CONTROLLER, recommendation_type="accessory", likes=1).save()
+        Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory", likes=5).save()
+        Recommendation(product_id=PS4, recommended_product_id=MONSTER_HUNTER, recommendation_type="accessory", likes=10).save()
+
+        recommendations = Recommendation.find_by_likes_range(5)
+        self.assertEqual([recommendation.likes for recommendation in recommendations], [5, 10])
+        recommendations = Recommendation.find_by_likes_range(max_likes=5)
+        self.assertEqual([recommendation.likes for recommendation in recommendations], [1, 5])
+        recommendations = Recommendation.find_by_likes_range(2, 9)
+        self.assertEqual([recommendation.likes for recommendation in recommendations], [5])
+        self.assertEqual(len(Recommendation.find_by_likes_range()), 3)
+        self.assertEqual(Recommendation.find_by_likes_range(11), [])
+
+        # Likes move a Recommendation within the range index
+        Recommendation.like(recommendations[0].id, 10)
+        self.assertEqual(Recommendation.find_by_likes_range(2, 9), [])
+        self.assertEqual(len(Recommendation.find_by_likes_range(15)), 1)
+
+    def test_find_many(self):
+        """ Find the Recommendations of many ids at once """
+        for recommended_product_id in (CONTROLLER, ADAPTER, PS5):
+            Recommendation(product_id=PS4, recommended_product_id=recommended_product_id,
+                           recommendation_type="accessory").save()
+        recommendations = Recommendation.find_many([3, 1, 9])
+        self.assertEqual(sorted(recommendations), [1, 3])
+        self.assertEqual(recommendations[3].recommended_product_id, PS5)
+        self.assertEqual(Recommendation.find_many([]), {})
+
+    def test_find_serialized(self):
+        """ Find serialized Recommendations without creating Recommendations """
+        Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory").save()
+        Recommendation(product_id=PS4, recommended_product_id=ADAPTER, recommendation_type="up-sell", likes=4).save()
+        expected = [recommendation.serialize() for recommendation in Recommendation.find_where({})]
+        self.assertEqual(Recommendation.find_where({}, serialized=True), expected)
+        self.assertEqual(Recommendation.find_where({'product_id': PS4}, serialized=True), expected)
+        self.assertEqual(Recommendation.find_where({'product_id': PS4, 'recommendation_type': 'up-sell'},
+                                                   serialized=True), expected[1:])
+        self.assertEqual(Recommendation.find_top_by_product_id(PS4, 1, serialized=True), expected[1:])
+        self.assertEqual(Recommendation.find_many([2], serialized=True), {2: expected[1]})
+        self.assertEqual(Recommendation.find_by_product_ids([PS4], serialized=True), {PS4: expected})
+
+        # Buffered likes are added to a copy of the stored record
+        Recommendation.start_like_buffer(interval=60, threshold=100)
+        self.addCleanup(Recommendation.stop_like_buffer)
+        Recommendation.like(1, 3)
+        self.assertEqual([data['likes'] for data in Recommendation.find_all(serialized=True)], [3, 4])
+
+    def test_recommendation_slots(self):
+        """ Recommendations only have slots for their fields """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER)
+        self.assertFalse(hasattr(recommendation, '__dict__'))
+        self.assertRaises(AttributeError, setattr, recommendation, 'color', 'red')
+
+    def test_find_by_product_ids(self):
+        """ Find the Recommendations of many product_ids at once """
+        Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory").save()
+        Recommendation(product_id=PS5, recommended_product_id=CONTROLLER, recommendation_type="accessory").save()
+        Recommendation(product_id=PS4, recommended_product_id=ADAPTER, recommendation_type="accessory").save()
+
+        groups = Recommendation.find_by_product_ids([PS4, PS5, PS3])
+        self.assertEqual(sorted(groups), sorted([PS4, PS5, PS3]))
+        self.assertEqual([recommendation.id for recommendation in groups[PS4]], [1, 3])
+        self.assertEqual([recommendation.id for recommendation in groups[PS5]], [2])
+        self.assertEqual(groups[PS3], [])
+        groups = Recommendation.find_by_product_ids([PS4], limit=1)
+        self.assertEqual([recommendation.id for recommendation in groups[PS4]], [1])
+
+    def test_cached_find_by_product_ids(self):
+        """ Share the cached product_id queries with the multi product lookup """
+        Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory").save()
+        Recommendation.enable_cache()
+        self.addCleanup(Recommendation.disable_cache)
+
+        Recommendation.find_by_product_id(PS4)
+        groups = Recommendation.find_by_product_ids([PS4, PS5])
+        self.assertEqual(len(groups[PS4]), 1)
+        self.assertEqual(Recommendation.cache_stats()['hits'], 1)
+        self.assertEqual(Recommendation.find_by_product_id(PS5), [])
+        self.assertEqual(Recommendation.cache_stats()['hits'], 2)
+
+        Recommendation(product_id=PS5, recommended_product_id=ADAPTER, recommendation_type="accessory").save()
+        self.assertEqual(len(Recommendation.find_by_product_ids([PS4, PS5])[PS5]), 1)
+
+    def test_find_where(self):
+        """ Find Recommendations that match several filters """
+        Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory", likes=1).save()
+        Recommendation(product_id=PS4, recommended_product_id=ADAPTER, recommendation_type="accessory", likes=5).save()
+        Recommendation(product_id=PS4, recommended_product_id=PS5, recommendation_type="up-sell", likes=5).save()
+        Recommendation(product_id=PS3, recommended_product_id=ADAPTER, recommendation_type="accessory", likes=9).save()
+
+        ids = lambda filters, after=0, limit=None: [recommendation.id for recommendation in
+                                                    Recommendation.find_where(filters, after, limit)]
+        self.assertEqual(ids({}), [1, 2, 3, 4])
+        self.assertEqual(ids({'product_id': PS4}), [1, 2, 3])
+        self.assertEqual(ids({'product_id': PS4, 'recommendation_type': "accessory"}), [1, 2])
+        self.assertEqual(ids({'recommended_product_id': ADAPTER, 'recommendation_type': "accessory"}), [2, 4])
+        self.assertEqual(ids({'product_id': PS4, 'min_likes': 5}), [2, 3])
+        self.assertEqual(ids({'product_id': PS4, 'recommendation_type': "accessory", 'max_likes': 4}), [1])
+        self.assertEqual(ids({'min_likes': 5, 'max_likes': 9}), [2, 3, 4])
+        self.assertEqual(ids({'product_id': PS3, 'recommendation_type': "up-sell"}), [])
+        self.assertEqual(ids({'product_id': PS5, 'recommendation_type': "up-sell"}), [])
+        self.assertEqual(ids({'product_id': PS4, 'min_likes': 5}, after=2), [3])
+        self.assertEqual(ids({'product_id': PS4, 'recommendation_type': "accessory"}, limit=1), [1])
+        self.assertEqual(ids({'product_id': None, 'recommendation_type': "up-sell"}), [3])
+
+    def test_explain(self):
+        """ Plan a query from the most selective index """
+        for recommended_product_id in range(20):
+            Recommendation(product_id=PS4, recommended_product_id=recommended_product_id,
+                           recommendation_type="accessory").save()
+        Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="up-sell").save()
+        Recommendation(product_id=PS5, recommended_product_id=CONTROLLER, recommendation_type="up-sell").save()
+
+        plan = Recommendation.explain({'product_id': PS4, 'recommendation_type': "up-sell",
+                                       'recommended_product_id': CONTROLLER})
+        self.assertEqual([(step['operation'], step['index'], step['rows']) for step in plan['steps']],
+                         [('scan', 'recommendation_type', 2),
+                          ('intersect', 'recommended_product_id', 3),
+                          ('probe', 'product_id', 21)])
+        self.assertEqual(plan['estimated_rows'], 2)
+
+    def test_query_row_metrics(self):
+        """ Count the index entries a query reads and the rows it returns """
+        for recommended_product_id in range(20):
+            Recommendation(product_id=PS4, recommended_product_id=recommended_product_id,
+                           recommendation_type="accessory").save()
+        Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="up-sell").save()
+        Recommendation(product_id=PS5, recommended_product_id=CONTROLLER, recommendation_type="up-sell").save()
+        scanned = metrics.ROWS_SCANNED.get(('find_where',))
+        returned = metrics.ROWS_RETURNED.get(('find_where',))
+        Recommendation.find_where({'product_id': PS4, 'recommendation_type': "up-sell",
+                                   'recommended_product_id': CONTROLLER})
+        # 2 up-sell ids, 3 ids of the controller and 2 probes of the product
+        self.assertEqual(metrics.ROWS_SCANNED.get(('find_where',)), scanned + 7)
+        self.assertEqual(metrics.ROWS_RETURNED.get(('find_where',)), returned + 1)
+        self.assertEqual([recommendation.id for recommendation in Recommendation.find_where(
+            {'product_id': PS4, 'recommendation_type': "up-sell", 'recommended_product_id': CONTROLLER})], [21])
+
+        plan = Recommendation.explain({'min_likes': 1})
+        self.assertEqual(plan['steps'], [{'operation': 'scan', 'index': 'likes', 'value': (1, None), 'rows': 0}])
+        self.assertEqual(Recommendation.explain({})['steps'], [{'operation': 'scan', 'index': 'all'}])
+
+    def test_cached_find_where(self):
+        """ Drop cached queries with several filters when a Recommendation joins them """
+        Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory").save()
+        Recommendation.enable_cache()
+        self.addCleanup(Recommendation.disable_cache)
+        filters = {'product_id': PS4, 'recommendation_type': "accessory"}
+
+        self.assertEqual(len(Recommendation.find_where(filters)), 1)
+        self.assertEqual(len(Recommendation.find_where(filters)), 1)
+        self.assertEqual(Recommendation.cache_stats()['hits'], 1)
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=ADAPTER, recommendation_type="up-sell")
+        recommendation.save()
+        self.assertEqual(len(Recommendation.find_where(filters)), 1)
+        recommendation.recommendation_type = "accessory"
+        recommendation.save()
+        self.assertEqual(len(Recommendation.find_where(filters)), 2)
+
+    def test_find_pages(self):
+        """ Page through Recommendations by id """
+        for recommended_product_id in range(1, 8):
+            Recommendation(product_id=PS4, recommended_product_id=recommended_product_id,
+                           recommendation_type="accessory", likes=recommended_product_id).save()
+        Recommendation(product_id=PS5, recommended_product_id=DISPLAY, recommendation_type="up-sell", likes=5).save()
+
+        page = Recommendation.find_all(limit=3)
+        self.assertEqual([recommendation.id for recommendation in page], [1, 2, 3])
+        page = Recommendation.find_all(page[-1].id, 3)
+        self.assertEqual([recommendation.id for recommendation in page], [4, 5, 6])
+        page = Recommendation.find_all(page[-1].id)
+        self.assertEqual([recommendation.id for recommendation in page], [7, 8])
+
+        page = Recommendation.find_by_product_id(PS4, 2, 2)
+        self.assertEqual([recommendation.id for recommendation in page], [3, 4])
+        page = Recommendation.find_by_recommend_type("accessory", 6, 5)
+        self.assertEqual([recommendation.id for recommendation in page], [7])
+        page = Recommendation.find_by_recommend_product_id(DISPLAY, 0, 1)
+        self.assertEqual([recommendation.id for recommendation in page], [8])
+        page = Recommendation.find_by_likes_range(4, None, (5, 5), 2)
+        self.assertEqual([recommendation.id for recommendation in page], [8, 6])
+
+    def test_find_likes_pages(self):
+        """ Page through a likes range by likes and then by id """
+        for recommended_product_id in range(1, 10):
+            Recommendation(product_id=PS4, recommended_product_id=recommended_product_id,
+                           recommendation_type="accessory", likes=recommended_product_id % 3).save()
+
+        positions = []
+        after = None
+        while True:
+            page, after = Recommendation.find_page({'min_likes': 1}, after, 2)
+            positions.extend((recommendation.likes, recommendation.id) for recommendation in page)
+            if after is None:
+                break
+            self.assertEqual(after, positions[-1])
+        self.assertEqual(positions, [(1, 1), (1, 4), (1, 7), (2, 2), (2, 5), (2, 8)])
+
+        # A page goes on after a position that is no longer there
+        Recommendation.find(4).delete()
+        page, after = Recommendation.find_page({'min_likes': 1, 'max_likes': 1}, (1, 4), 2)
+        self.assertEqual([recommendation.id for recommendation in page], [7])
+        self.assertEqual(after, None)
+        Recommendation.like(1, 5)
+        page, after = Recommendation.find_page({'min_likes': 1}, (1, 1), 2)
+        self.assertEqual([recommendation.id for recommendation in page], [7, 2])
+        self.assertEqual(after, (2, 2))
+        self.assertEqual([recommendation.id for recommendation in
+                          Recommendation.find_where({'max_likes': 0}, limit=2)], [3, 6])
+
+        self.assertRaises(DataValidationError, Recommendation.find_page, {'min_likes': 1}, 4, 2)
+        self.assertRaises(DataValidationError, Recommendation.find_page, {}, (1, 4), 2)
+
+    def test_find_likes_pages_of_ties(self):
+        """ Page through many Recommendations that have the same likes """
+        Recommendation.save_all([Recommendation(0, PS4, recommended_product_id, "accessory", 0)
+                                 for recommended_product_id in range(25)])
+        ids = []
+        after = None
+        while True:
+            page, after = Recommendation.find_page({'max_likes': 0}, after, 4)
+            ids.extend(recommendation.id for recommendation in page)
+            if after is None:
+                break
+            Recommendation.find(after[1]).delete()
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(sorted(ids), range(1, 26))
+
+    def test_find_where_pages_read_the_page(self):
+        """ Read about as many index entries as a page of several filters needs """
+        for recommended_product_id in range(20):
+            Recommendation(product_id=PS4, recommended_product_id=recommended_product_id,
+                           recommendation_type="accessory", likes=recommended_product_id).save()
+        Recommendation(product_id=PS5, recommended_product_id=CONTROLLER, recommendation_type="up-sell").save()
+        filters = {'product_id': PS4, 'recommendation_type': "accessory"}
+
+        scanned = metrics.ROWS_SCANNED.get(('find_where',))
+        page, after = Recommendation.find_page(filters, 0, 2)
+        self.assertEqual([recommendation.id for recommendation in page], [1, 2])
+        self.assertEqual(after, 2)
+        # 3 product ids and the 3 accessory ids up to the last of them
+        self.assertEqual(metrics.ROWS_SCANNED.get(('find_where',)), scanned + 6)
+
+        ids = []
+        after = 0
+        while after is not None:
+            page, after = Recommendation.find_page(dict(filters, min_likes=5), after, 4)
+            ids.extend(recommendation.id for recommendation in page)
+        self.assertEqual(ids, range(6, 21))
+
+    def test_explain_large_likes_range(self):
+        """ Probe a likes range that is too large to read whole """
+        for recommended_product_id in range(6):
+            Recommendation(product_id=PS4, recommended_product_id=recommended_product_id,
+                           recommendation_type="accessory", likes=recommended_product_id).save()
+        Recommendation(product_id=PS5, recommended_product_id=CONTROLLER, recommendation_type="up-sell").save()
+        filters = {'recommendation_type': "accessory", 'min_likes': 4}
+
+        plan = Recommendation.explain(filters)
+        self.assertEqual([(step['operation'], step['index']) for step in plan['steps']],
+                         [('scan', 'likes'), ('intersect', 'recommendation_type')])
+        batch_size = Recommendation.scan_batch_size
+        Recommendation.scan_batch_size = 1
+        self.addCleanup(setattr, Recommendation, 'scan_batch_size', batch_size)
+        plan = Recommendation.explain(filters)
+        self.assertEqual([(step['operation'], step['index']) for step in plan['steps']],
+                         [('scan', 'recommendation_type'), ('probe', 'likes')])
+        self.assertEqual([recommendation.id for recommendation in Recommendation.find_where(filters)],
+                         [5, 6])
+
+    def test_find_page_past_a_delete(self):
+        """ Page past a Recommendation deleted between reading the ids and the records """
+        for recommended_product_id in range(1, 7):
+            Recommendation(product_id=PS4, recommended_product_id=recommended_product_id,
+                           recommendation_type="accessory").save()
+        get_many = Recommendation.engine.get_many
+
+        def delete_and_get_many(ids, encoded=False):
+            Recommendation.engine.delete(2)
+            return get_many(ids, encoded)
+
+        for filters in ({}, {'product_id': PS4}, {'product_id': PS4, 'recommendation_type': "accessory"}):
+            Recommendation(2, PS4, 2, "accessory").save()
+            with patch.object(Recommendation.engine, 'get_many', side_effect=delete_and_get_many):
+                page, cursor = Recommendation.find_page(filters, 0, 2)
+            self.assertEqual([recommendation.id for recommendation in page], [1])
+            self.assertEqual(cursor, 2)
+            page, cursor = Recommendation.find_page(filters, cursor, 2)
+            self.assertEqual([recommendation.id for recommendation in page], [3, 4])
+            self.assertEqual(cursor, 4)
+            page, cursor = Recommendation.find_page(filters, cursor, 2)
+            self.assertEqual([recommendation.id for recommendation in page], [5, 6])
+            self.assertEqual(cursor, None)
+
+    def test_save_all(self):
+        """ Save a list of Recommendations at once """
+        existing = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        existing.save()
+        existing.product_id = PS3
+        recommendations = [existing] + [
+            Recommendation(product_id=PS5, recommended_product_id=recommended_product_id,
+                           recommendation_type="accessory")
+            for recommended_product_id in range(1, 4)]
+
+        Recommendation.save_all(recommendations)
+        self.assertEqual([recommendation.id for recommendation in recommendations], [1, 2, 3, 4])
+        self.assertEqual(len(Recommendation.all()), 4)
+        self.assertEqual(len(Recommendation.find_by_product_id(PS5)), 3)
+        self.assertEqual(Recommendation.find_by_product_id(PS4), [])
+        self.assertEqual(Recommendation.find_by_product_id(PS3)[0].id, existing.id)
+
+        # The next id comes after the reserved block
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        recommendation.save()
+        self.assertEqual(recommendation.id, 5)
+
+    def test_save_all_with_a_repeated_id(self):
+        """ Save a batch that has an id twice, the last copy wins """
+        Recommendation(5, PS3, CONTROLLER, "accessory").save()
+        Recommendation.save_all([Recommendation(5, PS4, CONTROLLER, "accessory"),
+                                 Recommendation(5, PS5, ADAPTER, "up-sell")])
+        self.assertEqual(Recommendation.find(5).product_id, PS5)
+        self.assertEqual(Recommendation.find_by_product_id(PS3), [])
+        self.assertEqual(Recommendation.find_by_product_id(PS4), [])
+        self.assertEqual([r.id for r in Recommendation.find_by_product_id(PS5)], [5])
+        self.assertEqual(Recommendation.find_by_recommend_type("accessory"), [])
+        self.assertEqual(len(Recommendation.find_all()), 1)
+
+    def test_save_all_keeps_given_ids(self):
+        """ Save Recommendations with given ids and move the id sequence past them """
+        recommendations = [Recommendation(id, PS4, CONTROLLER, "accessory") for id in (7, 3)]
+        Recommendation.save_all(recommendations)
+        self.assertEqual(Recommendation.find(7).product_id, PS4)
+        self.assertEqual(Recommendation.find(3).product_id, PS4)
+
+        recommendation = Recommendation(product_id=PS3, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        recommendation.save()
+        self.assertEqual(recommendation.id, 8)
+
+    def test_find_by_product_id_after_update(self):
+        """ Find by product_id follows updates of the product_id """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        recommendation.save()
+        recommendation.product_id = PS5
+        recommendation.recommendation_type = "up-sell"
+        recommendation.save()
+
+        self.assertEqual(len(Recommendation.find_by_product_id(PS4)), 0)
+        self.assertEqual(len(Recommendation.find_by_recommend_type("accessory")), 0)
+        recommendations = Recommendation.find_by_product_id(PS5)
+        self.assertEqual(len(recommendations), 1)
+        self.assertEqual(recommendations[0].id, recommendation.id)
+        self.assertEqual(len(Recommendation.find_by_recommend_type("up-sell")), 1)
+
+    def test_find_by_product_id_after_delete(self):
+        """ Find by product_id does not return deleted Recommendations """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory")
+        recommendation.save()
+        Recommendation(product_id=PS4, recommended_product_id=ADAPTER, recommendation_type="accessory").save()
+        recommendation.delete()
+
+        recommendations = Recommendation.find_by_product_id(PS4)
+        self.assertEqual(len(recommendations), 1)
+        self.assertEqual(recommendations[0].recommended_product_id, ADAPTER)
+        self.assertEqual(len(Recommendation.find_by_recommend_product_id(CONTROLLER)), 0)
+
+    def test_rebuild_indexes(self):
+        """ Rebuild the indexes for Recommendations saved without them """
+        data = {'id': 1, 'product_id': PS4, 'recommended_product_id': CONTROLLER,
+                'recommendation_type': "accessory", 'likes': 0}
+        Recommendation.redis.set(1, pickle.dumps(data))
+        self.assertEqual(len(Recommendation.find_by_product_id(PS4)), 0)
+
+        self.assertEqual(Recommendation.rebuild_indexes(), 1)
+        recommendations = Recommendation.find_by_product_id(PS4)
+        self.assertEqual(len(recommendations), 1)
+        self.assertEqual(recommendations[0].id, 1)
+        self.assertEqual(len(Recommendation.find_by_recommend_product_id(CONTROLLER)), 1)
+        self.assertEqual(len(Recommendation.find_by_recommend_type("accessory")), 1)
+
         #    @patch.dict(os.environ, {'VCAP_SERVICES': json.dumps(VCAP_SERVICES).encode('utf8')})
     @patch.dict(os.environ, {'VCAP_SERVICES': VCAP_SERVICES})
     def test_vcap_services(self):
@@ -224,6 +926,27 @@ class TestRecommendations(unittest.TestCase):
         self.assertRaises(ConnectionError, Recommendation.init_db)
         self.assertIsNone(Recommendation.redis)
 
+    @patch.dict(os.environ, {'VCAP_SERVICES': json.dumps({'rediscloud': [{'credentials': {
+        'password': '', 'hostname': '127.0.0.1', 'port': '6379', 'max_connections': 7}}]})})
+    def test_vcap_services_options(self):
+        """ Take the connection pool options from VCAP_SERVICES """
+        Recommendation.init_db(options={'max_connections': 20, 'socket_timeout': 3})
+        pool = Recommendation.redis.connection_pool
+        self.assertEqual(pool.max_connections, 7)
+        self.assertEqual(pool.connection_kwargs['socket_timeout'], 3)
+        self.assertEqual(Recommendation.pool_stats()['max_connections'], 7)
+
+    @patch.dict(os.environ, {'VCAP_SERVICES': json.dumps({'rediscloud': [{'credentials': {
+        'password': '', 'hostname': '127.0.0.1', 'port': '6379', 'socket_timeout': '3',
+        'blocking': 'false', 'retries': '1'}}]})})
+    def test_vcap_services_text_options(self):
+        """ Convert the options of VCAP_SERVICES that are given as strings """
+        Recommendation.init_db()
+        pool = Recommendation.redis.connection_pool
+        self.assertFalse(Recommendation.pool_stats()['blocking'])
+        self.assertEqual(pool.connection_kwargs['socket_timeout'], 3.0)
+        self.assertEqual(Recommendation.redis.retries, 1)
+
     def test_passing_connection(self):
         """ Pass in the Redis connection """
         # Recommendation.init_db(Redis(host='127.0.0.1', port=6379))
@@ -249,6 +972,84 @@ class TestRecommendations(unittest.TestCase):
         self.assertRaises(ConnectionError, Recommendation.init_db)
         self.assertIsNone(Recommendation.redis)
 
+class TestMemoryRecommendations(TestRecommendations):
+    """ Test Cases for Recommendations kept by the memory engine """
+
+    def setUp(self):
+        Recommendation.init_db(engine='memory')
+        Recommendation.remove_all()
+
+    def test_memory_engine_selected(self):
+        """ Use the memory engine without a Redis connection """
+        self.assertIsInstance(Recommendation.engine, MemoryEngine)
+        self.assertIsNone(Recommendation.redis)
+
+    def test_rebuild_indexes(self):
+        """ Rebuild the indexes of the memory engine """
+        Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory").save()
+        Recommendation.engine.indexes.clear()
+        self.assertEqual(len(Recommendation.find_by_product_id(PS4)), 0)
+
+        self.assertEqual(Recommendation.rebuild_indexes(), 1)
+        self.assertEqual(len(Recommendation.find_by_product_id(PS4)), 1)
+
+    def test_pool_stats(self):
+        """ Have no pool without Redis """
+        self.assertIsNone(Recommendation.pool_stats())
+
+    def test_unknown_engine(self):
+        """ Select a storage engine that doesn't exist """
+        self.assertRaises(ValueError, Recommendation.init_db, None, 'mongodb')
+
+
+class TestJsonRecommendations(TestRecommendations):
+    """ Test Cases for Recommendations kept in Redis as canonical JSON """
+
+    def setUp(self):
+        Recommendation.init_db(record_format='json')
+        Recommendation.remove_all()
+
+    def test_stored_as_json(self):
+        """ Store a Recommendation as its canonical JSON and read it back as is """
+        recommendation = Recommendation(product_id=PS4, recommended_product_id=CONTROLLER,
+                                        recommendation_type="accessory", likes=2)
+        recommendation.save()
+        stored = Recommendation.redis.get(recommendation.id)
+        self.assertEqual(json.loads(stored), recommendation.serialize())
+        self.assertEqual(Recommendation.find(recommendation.id, serialized='json'), stored)
+        self.assertEqual(Recommendation.find_where({'product_id': PS4}, serialized='json'), [stored])
+
+    def test_like_json_and_packed_recommendations(self):
+        """ Like Recommendations stored in either format """
+        Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory", likes=-3).save()
+        Recommendation.init_db(record_format='packed')
+        Recommendation(product_id=PS5, recommended_product_id=ADAPTER, recommendation_type="accessory", likes=9).save()
+        Recommendation.init_db(record_format='json')
+
+        self.assertEqual(Recommendation.like(1, 10).likes, 7)
+        self.assertEqual(Recommendation.like(2).likes, 10)
+        self.assertEqual(Recommendation.redis.get(1)[:1], '{')
+        self.assertEqual(Recommendation.redis.get(2)[:1], '\x01')
+        self.assertEqual(json.loads(Recommendation.find(1, serialized='json'))['likes'], 7)
+        self.assertEqual(json.loads(Recommendation.find(2, serialized='json'))['likes'], 10)
+        self.assertEqual([data.id for data in Recommendation.find_top_by_product_id(PS4)], [1])
+        self.assertEqual(len(Recommendation.find_by_likes_range(7, 7)), 1)
+
+    def test_json_with_buffered_likes(self):
+        """ Add the buffered likes to the stored JSON """
+        Recommendation(product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory").save()
+        Recommendation.start_like_buffer(interval=60, threshold=100)
+        self.addCleanup(Recommendation.stop_like_buffer)
+        Recommendation.like(1, 2)
+        self.assertEqual(json.loads(Recommendation.find(1, serialized='json'))['likes'], 2)
+        self.assertEqual(Recommendation.redis.get(1), Recommendation.find(1, serialized='json').replace(
+            '"likes":2', '"likes":0'))
+
+    def test_unknown_record_format(self):
+        """ Select a record format that doesn't exist """
+        self.assertRaises(ValueError, Recommendation.init_db, None, 'redis', None, 'xml')
+
+
 ######################################################################
 #   M A I N
 ######################################################################
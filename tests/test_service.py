@@ -2,6 +2,7 @@ import unittest
 import json
 import logging
 from flask_api import status    # HTTP Status Codes
+from mock import patch
 
 from app import service
 
@@ -60,6 +61,48 @@ class TestRecommendationservice(unittest.TestCase):
         resp = self.app.get('/recommendations/11')
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_get_recommendation_not_modified(self):
+        """ Read a Recommendation again with its ETag """
+        service.Recommendation(0, PS4, CONTROLLER, "accessory").save()
+        resp = self.app.get('/recommendations/1')
+        etag = resp.headers['ETag']
+        self.assertTrue(etag)
+
+        resp = self.app.get('/recommendations/1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.data, '')
+        self.assertEqual(resp.headers['ETag'], etag)
+
+        self.app.put('/recommendations/1/likes')
+        resp = self.app.get('/recommendations/1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(resp.data)['likes'], 1)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_query_recommendation_not_modified(self):
+        """ Query the Recommendations of a product again with the ETag """
+        service.Recommendation(0, PS4, CONTROLLER, "accessory").save()
+        resp = self.app.get('/recommendations?product_id=%d' % PS4)
+        etag = resp.headers['ETag']
+
+        # Other products and other pages of the same product don't share it
+        service.Recommendation(0, PS5, CONTROLLER, "accessory").save()
+        resp = self.app.get('/recommendations?product_id=%d' % PS4, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        resp = self.app.get('/recommendations?product_id=%d&limit=1' % PS4, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+        service.Recommendation(0, PS4, ADAPTER, "accessory").save()
+        resp = self.app.get('/recommendations?product_id=%d' % PS4, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(resp.data)), 2)
+
+        # Every write changes the list of all recommendations
+        etag = self.app.get('/recommendations').headers['ETag']
+        service.Recommendation(0, PS5, ADAPTER, "accessory").save()
+        resp = self.app.get('/recommendations', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
     def test_query_recommendation_by_product_id(self):
         """ Query Recommendations by the product_id """
         service.Recommendation(id=0, product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory").save()
@@ -90,6 +133,68 @@ class TestRecommendationservice(unittest.TestCase):
         resp = self.app.get('/recommendations?product_id=' + 'PS5')
         self.assertEqual(resp.status_code, 500)
 
+    def test_query_recommendation_by_several_filters(self):
+        """ Query Recommendations that match several filters """
+        service.Recommendation(0, PS4, CONTROLLER, "accessory", 1).save()
+        service.Recommendation(0, PS4, PS5, "up-sell", 7).save()
+        service.Recommendation(0, PS4, ADAPTER, "accessory", 7).save()
+        service.Recommendation(0, PS5, ADAPTER, "accessory", 7).save()
+
+        resp = self.app.get('/recommendations?product_id=%d&recommendation_type=accessory' % PS4)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([data['id'] for data in json.loads(resp.data)], [1, 3])
+        resp = self.app.get('/recommendations?recommendation_type=accessory&min_likes=5')
+        self.assertEqual([data['id'] for data in json.loads(resp.data)], [3, 4])
+        resp = self.app.get('/recommendations?product_id=%d&recommended_product_id=%d&max_likes=5'
+                            % (PS4, ADAPTER))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn('recommended_product_id: %d' % ADAPTER, json.loads(resp.data)['error'])
+
+    def test_get_many_by_ids(self):
+        """ Get many Recommendations by id in one request """
+        service.Recommendation(0, PS4, CONTROLLER, "accessory").save()
+        service.Recommendation(0, PS5, CONTROLLER, "accessory").save()
+        resp = self.app.get('/recommendations?ids=2,1,7,2')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual(sorted(data), ['1', '2', '7'])
+        self.assertEqual(data['2']['product_id'], PS5)
+        self.assertIsNone(data['7'])
+        self.assertEqual(resp.data.count('"2":'), 1)
+
+    def test_get_many_by_product_ids(self):
+        """ Get the Recommendations of many products in one request """
+        service.Recommendation(0, PS4, CONTROLLER, "accessory").save()
+        service.Recommendation(0, PS5, CONTROLLER, "accessory").save()
+        service.Recommendation(0, PS4, ADAPTER, "accessory").save()
+        resp = self.app.get('/recommendations?product_ids=%d,%d,%d' % (PS4, PS5, PS3))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual([item['id'] for item in data[str(PS4)]], [1, 3])
+        self.assertEqual([item['id'] for item in data[str(PS5)]], [2])
+        self.assertEqual(data[str(PS3)], [])
+        resp = self.app.get('/recommendations?product_ids=%d&limit=1' % PS4)
+        self.assertEqual(len(json.loads(resp.data)[str(PS4)]), 1)
+
+    def test_get_many_bad_request(self):
+        """ Get many Recommendations with invalid arguments """
+        for query in ('ids=1,x', 'ids=', 'product_ids=1&recommendation_type=accessory',
+                      'ids=1&cursor=%s' % service.encode_cursor(1),
+                      'ids=' + ','.join(['1'] * (service.app.config['MAX_MULTI_GET'] + 1))):
+            resp = self.app.get('/recommendations?' + query)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_explain_query(self):
+        """ Get the query plan of several filters """
+        service.Recommendation(0, PS4, CONTROLLER, "accessory").save()
+        service.Recommendation(0, PS4, PS5, "up-sell").save()
+        resp = self.app.get('/recommendations?product_id=%d&recommendation_type=up-sell&explain=1' % PS4)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        plan = json.loads(resp.data)
+        self.assertEqual(plan['steps'][0]['index'], 'recommendation_type')
+        self.assertEqual(plan['steps'][0]['rows'], 1)
+        self.assertEqual(plan['estimated_rows'], 1)
+
     def test_query_recommendation_by_recommendation_type(self):
         """ Query Recommendations by the recommendation_type """
         service.Recommendation(id=0, product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory").save()
@@ -134,6 +239,301 @@ class TestRecommendationservice(unittest.TestCase):
         resp = self.app.get('/recommendations?recommended_product_id=' + str(PS4))
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_query_recommendation_by_likes(self):
+        """ Query Recommendations by a range of likes """
+        service.Recommendation(0, PS4, CONTROLLER, "accessory", 2).save()
+        service.Recommendation(0, PS4, MONSTER_HUNTER, "cross-sell", 7).save()
+        service.Recommendation(0, PS5, MONSTER_HUNTER, "cross-sell", 9).save()
+
+        resp = self.app.get('/recommendations?min_likes=5')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual([item['likes'] for item in data], [7, 9])
+
+        resp = self.app.get('/recommendations?min_likes=3&max_likes=8')
+        data = json.loads(resp.data)
+        self.assertEqual([item['likes'] for item in data], [7])
+
+        resp = self.app.get('/recommendations?max_likes=1')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_query_recommendation_by_likes_bad_request(self):
+        """ Query Recommendations by an invalid range of likes """
+        resp = self.app.get('/recommendations?min_likes=many')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_recommendation_pages(self):
+        """ Page through a list of Recommendations """
+        for recommended_product_id in range(1, 6):
+            service.Recommendation(0, PS4, recommended_product_id, "accessory", 0).save()
+        service.Recommendation(0, PS5, CONTROLLER, "up-sell", 0).save()
+
+        ids = []
+        url = '/recommendations?product_id=%d&limit=2' % PS4
+        while url:
+            resp = self.app.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            data = json.loads(resp.data)
+            self.assertLessEqual(len(data), 2)
+            ids.extend(item['id'] for item in data)
+            link = resp.headers.get('Link')
+            url = link[link.index('/recommendations'):link.index('>')] if link else None
+            if link:
+                self.assertIn(resp.headers['X-Next-Cursor'], link)
+        self.assertEqual(ids, [1, 2, 3, 4, 5])
+
+        resp = self.app.get('/recommendations?limit=6')
+        self.assertEqual(len(json.loads(resp.data)), 6)
+        self.assertNotIn('Link', resp.headers)
+
+    def test_get_recommendation_likes_pages(self):
+        """ Page through a likes range by likes and then by id """
+        for likes in (3, 1, 2, 1, 3):
+            service.Recommendation(0, PS4, CONTROLLER, "accessory", likes).save()
+
+        items = []
+        url = '/recommendations?min_likes=1&limit=2'
+        while url:
+            resp = self.app.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            items.extend((item['likes'], item['id']) for item in json.loads(resp.data))
+            link = resp.headers.get('Link')
+            url = link[link.index('/recommendations'):link.index('>')] if link else None
+        self.assertEqual(items, [(1, 2), (1, 4), (2, 3), (3, 1), (3, 5)])
+
+        resp = self.app.get('/recommendations?min_likes=1&cursor=%s' % service.encode_cursor(2))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/recommendations?cursor=%s' % service.encode_cursor((1, 2)))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(service.decode_cursor(service.encode_cursor((-1, 2))), (-1, 2))
+
+    def test_get_recommendation_pages_past_a_delete(self):
+        """ Link the next page when a Recommendation of the page is deleted while it is read """
+        for recommended_product_id in range(1, 6):
+            service.Recommendation(0, PS4, recommended_product_id, "accessory", 0).save()
+        engine = service.Recommendation.engine
+        get_many = engine.get_many
+
+        def delete_and_get_many(ids, encoded=False):
+            engine.delete(2)
+            return get_many(ids, encoded)
+
+        with patch.object(engine, 'get_many', side_effect=delete_and_get_many):
+            resp = self.app.get('/recommendations?limit=2')
+        self.assertEqual([item['id'] for item in json.loads(resp.data)], [1])
+        self.assertEqual(resp.headers['X-Next-Cursor'], service.encode_cursor(2))
+
+    def test_get_recommendation_pages_bad_request(self):
+        """ Page through Recommendations with an invalid limit or cursor """
+        resp = self.app.get('/recommendations?limit=0')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/recommendations?limit=2&cursor=not-a-cursor')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/recommendations?limit=%d' % (service.app.config['MAX_PAGE_SIZE'] + 1))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/recommendations?limit=' + '9' * 30)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/recommendations?limit=%d' % service.app.config['MAX_PAGE_SIZE'])
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_stream_recommendations(self):
+        """ Stream all Recommendations as newline delimited JSON """
+        for recommended_product_id in range(1, 6):
+            service.Recommendation(0, PS4, recommended_product_id, "accessory", 0).save()
+        service.Recommendation(0, PS5, CONTROLLER, "up-sell", 0).save()
+        batch_size = service.Recommendation.scan_batch_size
+        service.Recommendation.scan_batch_size = 2
+        self.addCleanup(setattr, service.Recommendation, 'scan_batch_size', batch_size)
+
+        resp = self.app.get('/recommendations?stream=1')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        data = [json.loads(line) for line in resp.data.splitlines()]
+        self.assertEqual([item['id'] for item in data], [1, 2, 3, 4, 5, 6])
+
+        resp = self.app.get('/recommendations?product_id=%d' % PS5,
+                            headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        data = [json.loads(line) for line in resp.data.splitlines()]
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['product_id'], PS5)
+
+    def test_stream_recommendations_past_a_delete(self):
+        """ Stream the Recommendations after one that is deleted while a page is read """
+        for recommended_product_id in range(1, 7):
+            service.Recommendation(0, PS4, recommended_product_id, "accessory", 0).save()
+        batch_size = service.Recommendation.scan_batch_size
+        service.Recommendation.scan_batch_size = 2
+        self.addCleanup(setattr, service.Recommendation, 'scan_batch_size', batch_size)
+        engine = service.Recommendation.engine
+        get_many = engine.get_many
+
+        def delete_and_get_many(ids, encoded=False):
+            engine.delete(2)
+            return get_many(ids, encoded)
+
+        with patch.object(engine, 'get_many', side_effect=delete_and_get_many):
+            resp = self.app.get('/recommendations?stream=1')
+            data = [json.loads(line) for line in resp.data.splitlines()]
+        self.assertEqual([item['id'] for item in data], [1, 3, 4, 5, 6])
+
+    def test_top_recommendations(self):
+        """ Get the Recommendations of a product with the most likes first """
+        service.Recommendation(0, PS4, CONTROLLER, "accessory", 2).save()
+        service.Recommendation(0, PS4, MONSTER_HUNTER, "cross-sell", 7).save()
+        service.Recommendation(0, PS4, PS5, "up-sell", 4).save()
+        service.Recommendation(0, PS5, MONSTER_HUNTER, "cross-sell", 9).save()
+
+        resp = self.app.get('/products/%d/recommendations/top' % PS4)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual([item['likes'] for item in data], [7, 4, 2])
+
+        resp = self.app.get('/products/%d/recommendations/top?n=1' % PS4)
+        data = json.loads(resp.data)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['recommended_product_id'], MONSTER_HUNTER)
+
+    def test_cache_statistics(self):
+        """ Get the counters of the record cache """
+        resp = self.app.get('/recommendations/cache')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(resp.data), {'enabled': False})
+
+        service.Recommendation.enable_cache()
+        self.addCleanup(service.Recommendation.disable_cache)
+        service.Recommendation(0, PS4, CONTROLLER, "accessory").save()
+        self.app.get('/recommendations?product_id=%d' % PS4)
+        self.app.get('/recommendations?product_id=%d' % PS4)
+        data = json.loads(self.app.get('/recommendations/cache').data)
+        self.assertTrue(data['enabled'])
+        self.assertEqual((data['hits'], data['misses']), (1, 1))
+
+    def test_cached_records_match_etag(self):
+        """ Refetch the cached records that were read at an older version than the ETag """
+        service.Recommendation.enable_cache()
+        self.addCleanup(service.Recommendation.disable_cache)
+        recommendation = service.Recommendation(0, PS4, CONTROLLER, "accessory")
+        recommendation.save()
+        urls = ['/recommendations/1', '/recommendations?product_id=%d' % PS4,
+                '/recommendations?product_ids=%d' % PS4]
+        etags = [self.app.get(url).headers['ETag'] for url in urls]
+
+        # Another worker saves, and its invalidation has not arrived yet
+        recommendation.likes = 7
+        with patch.object(service.Recommendation, '_Recommendation__invalidate',
+                          staticmethod(lambda *args, **kwargs: None)):
+            recommendation.save()
+        records = []
+        for url, etag in zip(urls, etags):
+            resp = self.app.get(url)
+            self.assertNotEqual(resp.headers['ETag'], etag)
+            records.append(json.loads(resp.data))
+        self.assertEqual(records[0]['likes'], 7)
+        self.assertEqual(records[1][0]['likes'], 7)
+        self.assertEqual(records[2][str(PS4)][0]['likes'], 7)
+
+    def test_pool_statistics(self):
+        """ Get the connection counts of the Redis pool """
+        service.Recommendation(0, PS4, CONTROLLER, "accessory").save()
+        resp = self.app.get('/recommendations/pool')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertTrue(data['enabled'])
+        self.assertGreaterEqual(data['created'], 1)
+        self.assertEqual(data['in_use'] + data['idle'], data['created'])
+
+    def test_metrics(self):
+        """ Get the request, Redis and query metrics """
+        service.init_db()
+        service.Recommendation(0, PS4, CONTROLLER, "accessory").save()
+        self.app.get('/recommendations/1')
+        self.app.get('/recommendations?product_id=%d' % PS4)
+        resp = self.app.get('/metrics')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith('text/plain; version=0.0.4'))
+        self.assertIn('http_requests_total{method="GET",route="/recommendations/<int:id>",'
+                      'status="200"}', resp.data)
+        self.assertIn('http_request_duration_seconds_count{method="GET",'
+                      'route="/recommendations"}', resp.data)
+        self.assertIn('http_requests_in_flight{method="GET",route="/metrics"} 1', resp.data)
+        self.assertIn('http_response_size_bytes_sum{method="GET",route="/recommendations"}',
+                      resp.data)
+        self.assertIn('query_rows_returned_total{query="find_by_product_id"}', resp.data)
+        if service.Recommendation.redis:
+            self.assertIn('redis_commands_total{command="MGET"}', resp.data)
+            self.assertIn('redis_pool_connections{state="idle"}', resp.data)
+
+    def test_metrics_disabled(self):
+        """ Serve no metrics when they are disabled """
+        service.app.config['METRICS_ENABLED'] = False
+        self.addCleanup(service.app.config.__setitem__, 'METRICS_ENABLED', True)
+        resp = self.app.get('/metrics')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_slow_request_log(self):
+        """ Log the query and the Redis commands of a slow request """
+        service.init_db()
+        service.app.config['SLOW_REQUEST_MS'] = 0
+        self.addCleanup(service.app.config.__setitem__, 'SLOW_REQUEST_MS', 500)
+        service.Recommendation(0, PS4, CONTROLLER, "accessory").save()
+        with patch.object(service.SLOW_LOG, 'warning') as warning_mock:
+            resp = self.app.get('/recommendations?product_id=%d&limit=5' % PS4)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Redis-Commands', resp.headers)
+        entry = json.loads(warning_mock.call_args[0][0])
+        self.assertEqual((entry['method'], entry['route'], entry['status']),
+                         ('GET', '/recommendations', 200))
+        self.assertEqual(entry['query'], {'product_id': [str(PS4)], 'limit': ['5']})
+        self.assertGreater(entry['model_seconds'], 0)
+        if service.Recommendation.redis:
+            self.assertGreater(entry['redis_commands'], 0)
+            self.assertGreater(entry['redis_bytes_received'], 0)
+            self.assertIn('MGET', [call['command'] for call in entry['commands']])
+
+    def test_fast_requests_are_not_logged(self):
+        """ Don't log the requests under the threshold """
+        with patch.object(service.SLOW_LOG, 'warning') as warning_mock:
+            self.app.get('/recommendations/1')
+        self.assertFalse(warning_mock.called)
+
+    def test_redis_commands_header(self):
+        """ Send the Redis command count in debug mode """
+        service.init_db()
+        service.Recommendation(0, PS4, CONTROLLER, "accessory").save()
+        service.app.debug = True
+        self.addCleanup(setattr, service.app, 'debug', False)
+        resp = self.app.get('/recommendations/1')
+        commands = int(resp.headers['X-Redis-Commands'])
+        if service.Recommendation.redis:
+            self.assertGreater(commands, 0)
+
+    def test_like_is_one_redis_command(self):
+        """ Like a Recommendation with one Redis command when the workers don't cache """
+        service.init_db()
+        service.Recommendation(0, PS4, CONTROLLER, "accessory").save()
+        service.app.debug = True
+        self.addCleanup(setattr, service.app, 'debug', False)
+        resp = self.app.put('/recommendations/1/likes')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        if service.Recommendation.redis:
+            self.assertEqual(resp.headers['X-Redis-Commands'], '1')
+
+    def test_top_recommendations_not_found(self):
+        """ Get the top Recommendations of a product that has none """
+        resp = self.app.get('/products/%d/recommendations/top' % PS3)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_top_recommendations_bad_request(self):
+        """ Get the top Recommendations with an invalid n """
+        resp = self.app.get('/products/%d/recommendations/top?n=zero' % PS4)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/products/%d/recommendations/top?n=%d'
+                            % (PS4, service.app.config['MAX_TOP_COUNT'] + 1))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/products/%d/recommendations/top?n=%s' % (PS4, '9' * 30))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_recommendation_list(self):
         """ Get a list of Recommendations """
         service.Recommendation(0, product_id=PS4, recommended_product_id=CONTROLLER, recommendation_type="accessory").save()
@@ -166,6 +566,58 @@ class TestRecommendationservice(unittest.TestCase):
         self.assertEqual(len(data), recommendation_count + 1)
         self.assertIn(new_json, data)
 
+    def test_create_recommendation_out_of_range(self):
+        """ Create a recommendation with a product_id that doesn't fit 64 bits """
+        data = json.dumps({'product_id': 2 ** 70, 'recommended_product_id': 7,
+                           'recommendation_type': "up-sell", 'likes': 0})
+        resp = self.app.post('/recommendations', data=data, content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get_recommendation_count(), 0)
+
+    def test_create_recommendations_batch(self):
+        """ Create a list of Recommendations at once """
+        batch = [{'product_id': PS4, 'recommended_product_id': recommended_product_id,
+                  'recommendation_type': "accessory", 'likes': 0}
+                 for recommended_product_id in range(1, 51)]
+        resp = self.app.post('/recommendations/batch', data=json.dumps(batch),
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = json.loads(resp.data)
+        self.assertEqual([item['id'] for item in data], range(1, 51))
+        self.assertEqual([item['recommended_product_id'] for item in data], range(1, 51))
+        self.assertEqual(self.get_recommendation_count(), 50)
+
+    def test_create_recommendations_batch_without_likes(self):
+        """ Create a list of Recommendations that leave out the optional likes """
+        batch = [{'product_id': PS4, 'recommended_product_id': CONTROLLER,
+                  'recommendation_type': "accessory"},
+                 {'product_id': PS4, 'recommended_product_id': ADAPTER,
+                  'recommendation_type': "accessory", 'likes': 'many'}]
+        resp = self.app.post('/recommendations/batch', data=json.dumps(batch),
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error['index'] for error in json.loads(resp.data)['errors']], [1])
+        resp = self.app.post('/recommendations/batch', data=json.dumps(batch[:1]),
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(json.loads(resp.data)[0]['likes'], 0)
+
+    def test_create_recommendations_batch_bad_request(self):
+        """ Create a list of Recommendations with invalid items """
+        batch = [{'product_id': PS4, 'recommended_product_id': CONTROLLER,
+                  'recommendation_type': "accessory", 'likes': 0},
+                 {'product_id': PS4, 'recommendation_type': "accessory", 'likes': 0}]
+        resp = self.app.post('/recommendations/batch', data=json.dumps(batch),
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        data = json.loads(resp.data)
+        self.assertEqual([error['index'] for error in data['errors']], [1])
+        self.assertEqual(self.get_recommendation_count(), 0)
+
+        resp = self.app.post('/recommendations/batch', data=json.dumps(batch[0]),
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_delete_recommendation(self):
         """Deletes a recommendation"""
         service.Recommendation(0, 2, 4, "up-sell", 1).save()
@@ -226,6 +678,17 @@ class TestRecommendationservice(unittest.TestCase):
         resp = self.app.put('/recommendations/1', data=data, content_type='application/json')
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_update_recommendation_keeps_likes(self):
+        """ Update a Recommendation without likes and keep its likes """
+        service.Recommendation(0, 2, 4, "up-sell", 40).save()
+        new_recommendation = {'product_id': 2, 'recommended_product_id': 8, 'recommendation_type': "up-sell"}
+        data = json.dumps(new_recommendation)
+        resp = self.app.put('/recommendations/1', data=data, content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(resp.data)['likes'], 40)
+        resp = self.app.get('/recommendations/1')
+        self.assertEqual(json.loads(resp.data)['likes'], 40)
+
     def test_update_recommendation_not_found(self):
         """ Update a recommendation that can't be found """
         new_recommendation = {'id': 0, 'product_id': 2, 'recommended_product_id': 8, 'recommendation_type': "up-sell", 'likes': 1}
@@ -259,6 +722,23 @@ class TestRecommendationservice(unittest.TestCase):
         data = json.loads(resp.data)
         return len(data)
 
+
+class TestJsonRecommendationservice(TestRecommendationservice):
+    """ Recommendation Service Tests with the records kept as canonical JSON """
+
+    def setUp(self):
+        """ Runs before each test """
+        service.Recommendation.init_db(record_format='json')
+        service.Recommendation.remove_all()
+        self.app = service.app.test_client()
+
+    def test_get_stored_json(self):
+        """ Send a stored Recommendation as it is stored """
+        service.Recommendation(0, PS4, CONTROLLER, "accessory").save()
+        stored = service.Recommendation.redis.get(1)
+        self.assertEqual(self.app.get('/recommendations/1').data, stored)
+        self.assertEqual(self.app.get('/recommendations?product_id=%d' % PS4).data, '[%s]' % stored)
+
 ######################################################################
 #   M A I N
 ######################################################################
@@ -0,0 +1,87 @@
+"""
+Test cases for the request tracing.
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+
+"""
+
+import unittest
+from app import tracing
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestTracing(unittest.TestCase):
+    """ Test Cases for the accounting of Redis commands and model time """
+
+    def tearDown(self):
+        tracing.finish()
+
+    def test_observe_redis(self):
+        """ Add up the round trips of the traced request """
+        tracing.observe_redis('GET', (('GET', '1'),), 'abc', 0.5, False)
+        trace = tracing.start()
+        tracing.observe_redis('GET', (('GET', '1'),), 'abc', 0.002, False)
+        tracing.observe_redis('PIPELINE', [('ZCARD', 'a'), ('ZCARD', 'bc')], [3, 12], 0.001, False)
+        self.assertIs(tracing.finish(), trace)
+        self.assertIsNone(tracing.current())
+        self.assertEqual((trace.commands, trace.round_trips), (3, 2))
+        self.assertEqual((trace.bytes_sent, trace.bytes_received), (4 + 6 + 7, 3 + 3))
+        self.assertAlmostEqual(trace.redis_seconds, 0.003)
+        summary = trace.summary()
+        self.assertEqual(summary['commands'][1],
+                         {'command': 'PIPELINE', 'ms': 1.0, 'sent': ['ZCARD a', 'ZCARD bc']})
+        self.assertEqual(summary['commands_dropped'], 0)
+
+    def test_keep_the_first_calls(self):
+        """ Count every round trip but keep only the first ones """
+        trace = tracing.start()
+        for _ in range(tracing.MAX_CALLS + 5):
+            tracing.observe_redis('GET', (('GET', '1'),), None, 0.0, False)
+        self.assertEqual(trace.round_trips, tracing.MAX_CALLS + 5)
+        self.assertEqual(trace.summary()['commands_dropped'], 5)
+
+    def test_describe_call(self):
+        """ Shorten the arguments and pipelines of the slow log """
+        self.assertEqual(tracing.describe_call('MGET', [('MGET', 1, 2, 3, 4, 5)], 0.0)['sent'],
+                         [u'MGET 1 2 3 ... (2 more)'])
+        sent = tracing.describe_call('SET', [('SET', '1', '\x01\x00\x07'), ('SET', 'k', 'x' * 100)],
+                                     0.0)['sent']
+        self.assertEqual(sent[0], u'SET 1 <3 bytes>')
+        self.assertEqual(sent[1], u'SET k ' + u'x' * tracing.MAX_ARGUMENT + u'...')
+        sent = tracing.describe_call('PIPELINE', [('GET', str(id)) for id in range(15)], 0.0)['sent']
+        self.assertEqual(len(sent), tracing.MAX_SENT + 1)
+        self.assertEqual(sent[-1], u'... (5 more commands)')
+
+    def test_timed(self):
+        """ Count the time of the outermost model call only """
+        calls = []
+
+        @tracing.timed
+        def inner():
+            trace = tracing.current()
+            calls.append(trace.depth if trace else None)
+
+        @tracing.timed
+        def outer():
+            inner()
+            return 'done'
+
+        self.assertEqual(outer(), 'done')
+        trace = tracing.start()
+        self.assertEqual(outer(), 'done')
+        self.assertEqual(calls, [None, 1])
+        self.assertEqual(trace.depth, 0)
+        self.assertGreater(trace.model_seconds, 0)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
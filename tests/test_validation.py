@@ -0,0 +1,71 @@
+"""
+Test cases for the payload validator.
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+
+"""
+
+import itertools
+import unittest
+from cerberus import Validator
+from app.models import Recommendation
+from app.validation import SchemaValidator
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+
+
+class TestSchemaValidator(unittest.TestCase):
+    """ Test Cases for the payload validator """
+
+    def setUp(self):
+        self.validator = SchemaValidator(Recommendation.schema)
+        self.cerberus = Validator(Recommendation.schema)
+
+    def test_valid_document(self):
+        """ Accept a valid Recommendation """
+        document = {u'id': 1, u'product_id': 1, u'recommended_product_id': 2L,
+                    u'recommendation_type': u'accessory', u'likes': True}
+        self.assertEqual(self.validator.validate(document), {})
+
+    def test_same_errors_as_cerberus(self):
+        """ Report the same errors as Cerberus with the same messages """
+        values = (None, 1, u'text', 1.5, [])
+        fields = ('product_id', 'recommended_product_id', 'recommendation_type', 'likes', 'extra')
+        documents = [{}, {1: 2}]
+        # Every combination of missing, null, valid and wrongly typed fields
+        for present in range(len(fields) + 1):
+            for names in itertools.combinations(fields, present):
+                for choice in itertools.product(values, repeat=len(names)):
+                    documents.append(dict((unicode(name), value) for name, value in zip(names, choice)))
+        for document in documents:
+            self.cerberus.validate(document)
+            self.assertEqual(str(self.validator.validate(document)), str(self.cerberus.errors), document)
+
+    def test_out_of_range(self):
+        """ Refuse integers that don't fit the packed records """
+        document = {u'product_id': 2 ** 70, u'recommended_product_id': -2 ** 64,
+                    u'recommendation_type': u'accessory', u'likes': 2 ** 63 - 1}
+        self.assertEqual(self.validator.validate(document),
+                         {u'product_id': ['max value is 9223372036854775807'],
+                          u'recommended_product_id': ['min value is -9223372036854775808']})
+        for value in (2 ** 63, 2 ** 63 - 1, -2 ** 63, -2 ** 63 - 1):
+            document[u'likes'] = value
+            self.cerberus.validate(document)
+            self.assertEqual(str(self.validator.validate(document)), str(self.cerberus.errors))
+
+    def test_unsupported_rules(self):
+        """ Refuse schemas with rules it can't check """
+        self.assertRaises(ValueError, SchemaValidator, {'name': {'type': 'string', 'maxlength': 3}})
+        self.assertRaises(ValueError, SchemaValidator, {'when': {'type': 'datetime'}})
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()